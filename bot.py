@@ -1,62 +1,85 @@
-from datetime import datetime
+import argparse
+import asyncio
+import time
 from typing import cast
+STARTED = time.perf_counter() #before the slow imports, so they are part of the startup breakdown
 import discord
-from discord.ext import tasks
 import bot_io as bi
+import bot_grammar as bg
+import bot_throttle as bth
 import bot_db as bd
+import bot_db_async as bda
+import bot_store as bst
+import bot_scheduler as bs
+import bot_delivery as bdv
+import bot_occurrences as bo
+import bot_shards as bsh
 import bot_response as br
 import bot_permissions as bp
 import bot_log as bl
+import bot_metrics as bm
+import bot_imports as bim
+import bot_blobs as bb
 
-token = ''
-with open('token.txt', 'r') as f:
-    token = f.read()
-
-intents = discord.Intents.default()
-intents.message_content = True
-
-client = discord.Client(intents=intents)
-
-async def copy_message(message):
-    message_files = [await attachment.to_file() for attachment in message.attachments]
-
-    return {
-        'content' : message.content,
-        'tts' : message.tts,
-        'embed' : message.embeds[0] if len(message.embeds) == 1 else None,
-        'embeds' : message.embeds if len(message.embeds) > 1 else None,
-        'file' : message_files[0] if len(message_files) == 1 else None,
-        'files' : message_files if len(message_files) > 1 else None,
-        'stickers' : message.stickers,
-        'reference' : message.reference,
-        'suppress_embeds' : len(message.embeds) == 0,
-        'poll' : message.poll
-    }
-
-@client.event
-async def on_message(message: discord.message.Message):
+#(phase, seconds) for the startup breakdown that is logged once the bot is ready.
+#nothing is read from disk at import, every phase is started from main
+startup_phases: list[tuple[str, float]] = []
+phase_started = STARTED
+
+def end_phase(name: str):
+    global phase_started
+    now = time.perf_counter()
+    startup_phases.append((name, now - phase_started))
+    phase_started = now
+
+def format_startup_phases() -> str:
+    total = sum(seconds for _, seconds in startup_phases)
+    return f"Started in {total:.3f}s ({", ".join(f"{name} {seconds * 1000:.1f}ms" for name, seconds in startup_phases)})."
+
+#the message being replied to, which is usually already sent along with the reply by the gateway
+async def get_reply_message(message: discord.Message) -> discord.Message|None:
+    if message.reference is None or message.reference.message_id is None:
+        return None
+    if isinstance(message.reference.resolved, discord.Message):
+        return message.reference.resolved
+    try:
+        return await message.channel.fetch_message(message.reference.message_id)
+    except discord.NotFound:
+        return None
+
+async def handle_message(client: discord.Client, message: discord.Message):
     try:
         if message.author == client.user:
             return
+        #most messages aren't commands, so that is checked before anything else
+        command = bg.parse_command(message.content, bi.COMMAND_PREFIX)
+        if command is None:
+            return
+
+        perms = bp.get_admin()
+        #permissions don't matter in a dm channel
+        if not isinstance(message.channel, discord.DMChannel):
+            try:
+                perms = message.channel.permissions_for(cast(discord.Member, message.author)) #will always be a member if not in a dm channel
+            except AttributeError as e:
+                return #if you cant get perms dont even try replying to the message
 
         response = None
+        reason = bth.check(message.author.id, message.channel.id, bi.get_canonical_name(command.name))
+        if reason is not None:
+            response = bth.make_throttled_response(message.author.id, reason)
+            if response is not None:
+                await message.channel.send(embed=response.make_embed())
+            return
+
         try:
-            perms = bp.ADMIN
-            #permissions don't matter in a dm channel
-            if not isinstance(message.channel, discord.DMChannel):
-                try:
-                    perms = message.channel.permissions_for(cast(discord.Member, message.author)) #will always be a member if not in a dm channel
-                except AttributeError as e:
-                    return #if you cant get perms dont even try replying to the message
-
-            response = bi.parse_command(message.content, 
-                                        message.channel.id, 
-                                        message.author.id, 
-                                        message.author.name,
-                                        perms,
-                                        message.reference.message_id if message.reference is not None else None)
-            if response is None:
-                return
+            response = await bi.run_command(command,
+                                            message.channel.id, 
+                                            message.guild.id if message.guild is not None else None,
+                                            message.author.id, 
+                                            message.author.name,
+                                            perms,
+                                            await get_reply_message(message))
         except Exception as e:
             response = br.Response(
                 is_error=True,
@@ -64,68 +87,273 @@ async def on_message(message: discord.message.Message):
                 txt=str(e)
             )
 
-        await message.channel.send(embed=response.make_embed())
+        await message.channel.send(embed=response.make_embed(), view=response.view)
+    except Exception as e:
+        bl.log_err(e, channel_id=message.channel.id, user_id=message.author.id)
+
+async def handle_interaction(interaction: discord.Interaction):
+    try:
+        if interaction.type != discord.InteractionType.component or interaction.data is None or interaction.channel_id is None:
+            return
+        response = await bi.handle_component(str(interaction.data.get('custom_id', '')), interaction.channel_id, interaction.user.id)
+        if response is None:
+            return
+        await interaction.response.edit_message(embed=response.make_embed(), view=response.view)
+    except Exception as e:
+        bl.log_err(e, channel_id=interaction.channel_id, user_id=interaction.user.id)
+
+BLOB_COLLECTION_SECONDS = 10 * 60
+
+#also deletes finished deliveries older than bot_store.DELIVERY_RETENTION_SECONDS
+async def collect_blobs_forever():
+    while True:
+        try:
+            collected = await bda.collect_blobs()
+            if collected > 0:
+                bl.log_info(f"Deleted {collected} unused attachment blobs.")
+            await bda.prune_deliveries()
+        except Exception as e:
+            bl.log_err(e)
+        await asyncio.sleep(BLOB_COLLECTION_SECONDS)
+
+#reminders in channels that were deleted (or that the bot lost access to) are purged as soon as discord says so, and a
+#reconciliation pass checks every channel against the gateway cache now and then to catch what happened while the bot was down.
+#channels missing from the cache are fetched before being purged, since archived threads aren't cached
+RECONCILE_SECONDS = 60 * 60
+RECONCILE_BATCH_SIZE = 500
+RECONCILE_BATCH_PAUSE_SECONDS = 1
+
+async def purge_channels(channel_ids: list[int]):
+    try:
+        await bda.remove_channels_reminders(channel_ids)
     except Exception as e:
-        bl.log_err(e) 
+        bl.log_err(e, channel_ids=channel_ids)
 
-@tasks.loop(seconds=5)
-async def event_loop():
-    now = datetime.now()
-    while True: #so the bot can send multiple repeats of a reminder in one event loop
+async def purge_guild(guild_id: int):
+    try:
+        await bda.remove_guild_reminders(guild_id)
+    except Exception as e:
+        bl.log_err(e, guild_id=guild_id)
+
+#channels of reminders without a guild id that turned out to be dms, so they aren't fetched again every pass
+dm_channel_ids: set[int] = set()
+
+#reminders set before guild ids were stored have none. their channel is resolved, and the guild it is in is filled in
+#so the guild can be purged later. returns whether the channel is gone
+async def reconcile_channel_guild(client: discord.Client, channel_id: int, channel_guilds: list[tuple[int, int]]) -> bool:
+    channel = await bdv.resolve_channel(client, channel_id)
+    if channel is None:
+        return True
+    guild = getattr(channel, "guild", None)
+    if guild is not None:
+        channel_guilds.append((channel_id, guild.id))
+    else:
+        dm_channel_ids.add(channel_id) #delivery notices when a dm is gone
+    return False
+
+#returns how many channels and guilds were purged
+async def reconcile_channels(client: discord.Client) -> tuple[int, int]:
+    channels = bst.get_channels()
+    dead_channel_ids = []
+    dead_guild_ids = set()
+    channel_guilds = []
+    for i in range(0, len(channels), RECONCILE_BATCH_SIZE):
+        for channel_id, guild_id in channels[i:i + RECONCILE_BATCH_SIZE]:
+            if guild_id is None:
+                if channel_id not in dm_channel_ids and await reconcile_channel_guild(client, channel_id, channel_guilds):
+                    dead_channel_ids.append(channel_id)
+                continue
+            #a backfilled guild can belong to another process's shards, it moves there when the bot restarts
+            if guild_id in dead_guild_ids or not bsh.owns(guild_id) or client.get_channel(channel_id) is not None:
+                continue
+            guild = client.get_guild(guild_id)
+            if guild is None: #every guild of this process's shards is cached once it is ready, so the bot was removed
+                dead_guild_ids.add(guild_id)
+            elif not guild.unavailable and await bdv.resolve_channel(client, channel_id) is None:
+                dead_channel_ids.append(channel_id)
+        await asyncio.sleep(RECONCILE_BATCH_PAUSE_SECONDS)
+
+    if len(channel_guilds) > 0:
         try:
-            due_reminders = bd.get_due_reminders(now)
-            if len(due_reminders) == 0:
-                break
-
-            for (name, channel_id, reply_message_id, setter_user_id, start_timestamp, next_timestamp, 
-            has_repeat, repeat_interval_index, repeat_interval_increment, repeat_increment_count) in due_reminders:
-                # type ignores are because any channel in the database must be messageable already, so the type checking is busted
-                channel = None
-                try:
-                    channel = await client.fetch_channel(channel_id)
-                except discord.NotFound as e: #The channel was deleted #TODO: figure out if there is any other way for this exception to be raised
-                    bd.remove_reminder(name, channel_id) #reminder no longer applicable
-
-                ping_text = f"<@!{setter_user_id}>"
-
-                reminder_response = br.Response(
-                    title=f"Reminder: {name}",
-                    txt=ping_text
-                )
-
-                reply_errs = []
-                reply_message = None
-                if reply_message_id is not None:
-                    try:
-                        reply_message = await channel.fetch_message(reply_message_id) # type: ignore
-                    except discord.NotFound as e: #The reply was deleted #TODO: figure out if there is any other way for this exception to be raised
-                        reply_errs.append("The custom message for this reminder was deleted.")
-    
-                await channel.send(embed=reminder_response.make_embed()) # type: ignore 
-                ghost_ping_message = await channel.send(ping_text) # type: ignore 
-                await ghost_ping_message.delete()
-
-                if reply_message is not None:
-                    try:
-                        await channel.send(**await copy_message(reply_message)) # type: ignore
-                    except discord.HTTPException as e:
-                        reply_errs.append("The custom message for this reminder cannot be copied.")
-                
-                if len(reply_errs) > 0:
-                    reply_err_msg = br.Response(
-                        is_error=True,
-                        title=f"Custom Message Failed:",
-                        txt=f"{" ".join(reply_errs)}"
-                    )
-                    await channel.send(embed=reply_err_msg.make_embed()) # type: ignore
-            
-                bd.update_reminder(name, channel_id, now)
+            await bda.set_channel_guilds(channel_guilds)
         except Exception as e:
-            bl.log_err(e) #for truly odd errors
+            bl.log_err(e)
+    if len(dead_channel_ids) > 0:
+        await purge_channels(dead_channel_ids)
+    for guild_id in dead_guild_ids:
+        await purge_guild(guild_id)
+    return (len(dead_channel_ids), len(dead_guild_ids))
 
-@client.event
-async def on_ready():
-    print(f'We have logged in as {client.user}')
-    event_loop.start()
+async def reconcile_channels_forever(client: discord.Client):
+    while True:
+        try:
+            if client.is_ready():
+                channel_count, guild_count = await reconcile_channels(client)
+                if channel_count > 0 or guild_count > 0:
+                    bl.log_info(f"Purged reminders of {channel_count} dead channels and {guild_count} guilds the bot left.")
+        except Exception as e:
+            bl.log_err(e)
+        await asyncio.sleep(RECONCILE_SECONDS)
+
+#reminders and timezones staged by bot_admin imports are applied on startup and picked up while the bot runs, a batch at a time
+#so commands still get the writer thread in between
+async def apply_imports():
+    started = time.perf_counter()
+    total_rows, total_added, total_users = 0, 0, 0
+    while True:
+        rows, added, users, full = await bda.apply_pending_imports()
+        total_rows, total_added, total_users = total_rows + rows, total_added + added, total_users + users
+        if rows < bim.APPLY_BATCH_SIZE:
+            break
+        await asyncio.sleep(0)
+    if total_rows > 0:
+        bl.log_info(bim.format_applied(total_rows, total_added, total_users, time.perf_counter() - started))
+    if full:
+        bl.log_err(bim.make_store_full_error())
+
+async def apply_imports_forever():
+    while True:
+        try:
+            await apply_imports()
+        except Exception as e:
+            bl.log_err(e)
+        await asyncio.sleep(bim.APPLY_POLL_SECONDS)
+
+scheduler_task = None
+blob_collection_task = None
+occurrence_refill_task = None
+reconcile_task = None
+import_task = None
+outbox_task = None
+metrics_task = None
+
+async def serve_metrics(port: int):
+    try:
+        await bm.start_server(port)
+        bl.log_info(f"Serving metrics on http://{bm.METRICS_HOST}:{port}/metrics")
+    except OSError as e: #the bot works fine without them
+        bl.log_err(e)
+
+#starts firing reminders (and serving metrics, unless metrics_port is 0).
+#only does anything the first time, since on_ready is called again after reconnecting
+def start_background_tasks(client: discord.Client, metrics_port: int = 0):
+    global scheduler_task, blob_collection_task, occurrence_refill_task, reconcile_task, import_task, outbox_task, metrics_task
+    if scheduler_task is None:
+        bs.scheduler.load()
+        scheduler_task = asyncio.create_task(bs.scheduler.run(bdv.claim_due))
+        outbox_task = asyncio.create_task(bdv.drain_forever(client)) #also sends what was claimed before a restart
+        blob_collection_task = asyncio.create_task(collect_blobs_forever())
+        occurrence_refill_task = asyncio.create_task(bo.refill_forever())
+        reconcile_task = asyncio.create_task(reconcile_channels_forever(client))
+        import_task = asyncio.create_task(apply_imports_forever())
+        if metrics_port != 0:
+            metrics_task = asyncio.create_task(serve_metrics(metrics_port))
+
+def make_client(shard_count: int|None, shard_ids: list[int]|None, auto_shard: bool, metrics_port: int = 0) -> discord.Client:
+    intents = discord.Intents.default()
+    intents.message_content = True
+
+    client = None
+    if shard_count is not None: #bot_shards is configured by main, before the store is loaded
+        client = discord.AutoShardedClient(intents=intents, shard_count=shard_count, shard_ids=shard_ids)
+    elif auto_shard:
+        client = discord.AutoShardedClient(intents=intents) #all shards are in this process, so every reminder is ours
+    else:
+        client = discord.Client(intents=intents)
+
+    bdv.enforce_nonces(client.http)
+
+    @client.event
+    async def on_message(message: discord.Message):
+        await handle_message(client, message)
+
+    @client.event
+    async def on_interaction(interaction: discord.Interaction):
+        await handle_interaction(interaction)
+
+    @client.event
+    async def on_guild_channel_delete(channel: discord.abc.GuildChannel):
+        threads = channel.threads if isinstance(channel, (discord.TextChannel, discord.ForumChannel)) else [] #deleted along with it
+        await purge_channels([channel.id] + [thread.id for thread in threads])
+
+    @client.event
+    async def on_raw_thread_delete(payload: discord.RawThreadDeleteEvent): #raw, so threads that weren't cached count too
+        await purge_channels([payload.thread_id])
+
+    @client.event
+    async def on_guild_remove(guild: discord.Guild):
+        await purge_guild(guild.id)
+
+    @client.event
+    async def on_ready():
+        print(f'We have logged in as {client.user}')
+        if scheduler_task is not None: #reconnected
+            return
+        end_phase("connect")
+        start_background_tasks(client, metrics_port)
+        end_phase("scheduler")
+        bl.log_info(format_startup_phases(), phases={name: round(seconds, 6) for name, seconds in startup_phases})
+
+    return client
+
+#what client.run does, except for setting up logging (bot_log already has), and the aiohttp session used for downloading
+#attachments is closed on the same loop
+async def run_client(client: discord.Client, token: str):
+    try:
+        async with client:
+            await client.start(token)
+    finally:
+        await bb.close_session()
+
+def main():
+    end_phase("imports")
+    parser = argparse.ArgumentParser(description="Runs RemindBot.")
+    parser.add_argument("--auto-shard", action="store_true", help="run every shard discord recommends in this process")
+    parser.add_argument("--shard-count", type=int, help="total number of shards across all processes")
+    parser.add_argument("--shard-ids", type=int, nargs="+", help="shards run by this process (default: all of them)")
+    parser.add_argument("--metrics-port", type=int, default=bm.METRICS_PORT, help="local port prometheus metrics are served on (0 to turn off)")
+    args = parser.parse_args()
+    if args.shard_ids is not None and args.shard_count is None:
+        parser.error("--shard-ids needs --shard-count")
+
+    bl.setup()
+    end_phase("logging")
+
+    bd.connect()
+    end_phase("database")
+
+    #before connecting, so no command can run against an empty store
+    if args.shard_count is not None:
+        bsh.configure(args.shard_count, args.shard_ids)
+    bst.load()
+    started = time.perf_counter()
+    applied = (0, 0, 0)
+    while True: #nothing else is writing yet
+        rows, added, users, full = bim.apply_pending_imports()
+        applied = (applied[0] + rows, applied[1] + added, applied[2] + users)
+        if rows == 0 or full:
+            break
+    if applied[0] > 0:
+        bl.log_info(bim.format_applied(*applied, time.perf_counter() - started))
+    if full:
+        bl.log_err(bim.make_store_full_error())
+    reminder_count, reminder_bytes = bst.get_memory_stats()
+    bl.log_info(f"Loaded {reminder_count} reminders into memory ({reminder_bytes / 1024 / 1024:.1f} MiB).")
+    end_phase("store")
+
+    token = ''
+    with open('token.txt', 'r') as f:
+        token = f.read()
+
+    client = make_client(args.shard_count, args.shard_ids, args.auto_shard, args.metrics_port)
+    end_phase("client")
+
+    try:
+        asyncio.run(run_client(client, token))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        bst.flush() #whatever the write-behind journal hadn't written yet
 
-client.run(token)
+if __name__ == "__main__":
+    main()
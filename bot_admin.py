@@ -0,0 +1,129 @@
+import argparse
+import contextlib
+import csv
+import json
+import sys
+import time
+import bot_db as bd
+import bot_imports as bim
+
+#bulk export and import of reminders and user timezones, as json lines or csv (picked by the file's extension, "-" is stdout/stdin).
+#  python bot_admin.py export reminders reminders.jsonl
+#  python bot_admin.py import users users.csv
+#files are streamed a chunk at a time, so memory doesn't grow with their size. exports read what the bot has flushed to disk.
+#imports are validated here and staged in the database, and the bot applies them within bot_imports.APPLY_POLL_SECONDS
+#(or when it next starts), so it can keep running. records that fail validation are reported and skipped
+DEFAULT_CHUNK_SIZE = 10000
+FORMATS = ["jsonl", "csv"]
+FIELDS = {"reminders" : bim.REMINDER_FIELDS, "users" : bim.USER_FIELDS}
+
+def guess_format(path: str) -> str|None:
+    if path.endswith(".csv"):
+        return "csv"
+    if path.endswith(".jsonl") or path.endswith(".json") or path == "-":
+        return "jsonl"
+    return None
+
+def open_file(path: str, mode: str):
+    if path == "-":
+        return contextlib.nullcontext(sys.stdout if mode == "w" else sys.stdin)
+    return open(path, mode, newline="", encoding="utf-8")
+
+def report(verb: str, count: int, table: str, seconds: float):
+    print(f"{verb} {count} {table} in {seconds:.2f}s ({count / max(seconds, 1e-9):.0f} rows/s).", file=sys.stderr)
+
+def export_rows(table: str, path: str, file_format: str, chunk_size: int) -> int:
+    fields = FIELDS[table]
+    rows = bd.iter_reminders(chunk_size) if table == "reminders" else bd.iter_users(chunk_size)
+    count = 0
+    with open_file(path, "w") as f:
+        if file_format == "csv":
+            writer = csv.writer(f)
+            writer.writerow(fields)
+            for row in rows:
+                writer.writerow(["" if value is None else value for value in row])
+                count += 1
+        else:
+            for row in rows:
+                f.write(json.dumps(dict(zip(fields, row)), ensure_ascii=False))
+                f.write("\n")
+                count += 1
+    return count
+
+#(line number, record) of every record in the file
+def read_records(f, file_format: str):
+    if file_format == "csv":
+        reader = csv.DictReader(f)
+        for record in reader:
+            yield (reader.line_num, record)
+        return
+    for line_number, line in enumerate(f, 1):
+        if line.strip() == "":
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield (line_number, e)
+            continue
+        yield (line_number, record)
+
+#returns (records staged, records skipped)
+def import_rows(table: str, path: str, file_format: str, chunk_size: int) -> tuple[int, int]:
+    parse, make_pending = (bim.parse_reminder, bim.make_pending_reminder) if table == "reminders" else (bim.parse_user, bim.make_pending_user)
+    staged = 0
+    invalid = 0
+    chunk = []
+    with open_file(path, "r") as f:
+        for line_number, record in read_records(f, file_format):
+            try:
+                if isinstance(record, json.JSONDecodeError):
+                    raise bim.InvalidRecordError(f"invalid json: {record}")
+                if not isinstance(record, dict):
+                    raise bim.InvalidRecordError("not a json object")
+                chunk.append(make_pending(parse(record))) # type: ignore the parser for the table
+            except bim.InvalidRecordError as e:
+                print(f"{path}:{line_number}: {e}", file=sys.stderr)
+                invalid += 1
+                continue
+            if len(chunk) >= chunk_size:
+                bd.add_pending_imports(chunk)
+                staged += len(chunk)
+                chunk.clear()
+    if len(chunk) > 0:
+        bd.add_pending_imports(chunk)
+        staged += len(chunk)
+    return (staged, invalid)
+
+def main():
+    parser = argparse.ArgumentParser(description="Exports and imports RemindBot's reminders and user timezones.")
+    parser.add_argument("action", choices=["export", "import"])
+    parser.add_argument("table", choices=list(FIELDS))
+    parser.add_argument("path", help="file to write or read, - for stdout/stdin")
+    parser.add_argument("--format", choices=FORMATS, help="default: from the file's extension")
+    parser.add_argument("--db", default=bd.DB_PATH, help=f"database file (default {bd.DB_PATH})")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="rows read or written per query or transaction")
+    args = parser.parse_args()
+
+    file_format = args.format if args.format is not None else guess_format(args.path)
+    if file_format is None:
+        parser.error("can't tell the format from the file's extension, use --format")
+    if args.chunk_size < 1:
+        parser.error("--chunk-size must be at least 1")
+
+    bd.connect(args.db)
+    started = time.perf_counter()
+    if args.action == "export":
+        count = export_rows(args.table, args.path, file_format, args.chunk_size)
+        report("Exported", count, args.table, time.perf_counter() - started)
+        return
+
+    staged, invalid = import_rows(args.table, args.path, file_format, args.chunk_size)
+    report("Staged", staged, args.table, time.perf_counter() - started)
+    if staged > 0:
+        print(f"The bot applies them within {bim.APPLY_POLL_SECONDS}s, or when it next starts.", file=sys.stderr)
+    if invalid > 0:
+        print(f"Skipped {invalid} invalid records.", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
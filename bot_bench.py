@@ -0,0 +1,342 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+#benchmarks for the hot paths. everything runs in a scratch directory, so the bot's own database and blobs are never touched.
+#  python bot_bench.py --output baseline.json
+#  python bot_bench.py --compare baseline.json
+#results are seconds per operation (lower is better), except where the unit says otherwise
+START_DIR = os.getcwd()
+os.chdir(tempfile.mkdtemp(prefix="remindbot-bench-"))
+
+import bot_timing as bt
+import bot_grammar as bg
+import bot_db as bd
+import bot_store as bst
+import bot_scheduler as bs
+import bot_delivery as bdv
+import bot_permissions as bp
+import bot_io as bi
+import bot_fake_discord as bfd
+import bot_log as bl
+
+SEED = 1
+STORE_SIZES = [10000, 100000, 1000000]
+DUE_FRACTION = 0.01 #of the store that is due in one tick
+MIN_STORE_SIZE = 200 #so at least two reminders are due, one claimed alone and one in a batch
+LIST_SIZES = [1000, 5000]
+TICK_SIZES = [(100, 10), (1000, 100)] #(due reminders, channels)
+REGRESSION_THRESHOLD = 0.25 #single runs of the store benchmarks are noisy
+
+#messages like the ones the bot actually sees: mostly chat, then commands with the time expressions people use
+NON_COMMAND_CORPUS = [
+    "lol",
+    "did anyone see the game last night",
+    "!important: meeting moved to thursday",
+    "https://example.com/some/long/link?with=query&params=1",
+    "ok see you at 5pm",
+    "time: to go home",
+    "! !",
+    "",
+]
+COMMAND_CORPUS = [
+    "!!sr standup time: 9am repeat: 1 day",
+    "!!set_reminder take out the trash time: 8 pm repeat: 1 week missed: skip",
+    "!!remind pay rent time: 1 jan 2030 9:00 am repeat: 1 month",
+    "!!sr tea time: 15 min",
+    "!!ar dentist time: 14 mar 10:30",
+    "!!sr water plants repeat: 3 days",
+    "!!SR Birthday time: 29 feb 2028 12 pm repeat: 1 year missed: once",
+    "!!sr backup time: 2 hours repeat: 6 hours missed: all",
+    "!!rr standup",
+    "!!lr",
+    "!!st Europe/Berlin",
+    "!!help sr",
+    "!!ct",
+]
+START_TIME_CORPUS = ["9am", "8 pm", "1 jan 2030 9:00 am", "15 min", "14 mar 10:30", "29 feb 2028 12 pm", "2 hours", "23:59", "3 weeks", "1 year"]
+
+class Result:
+    def __init__(self, value: float, unit: str = "s"):
+        self.value = value
+        self.unit = unit
+
+def time_per_call(func, inputs: list, min_seconds: float = 0.5) -> Result:
+    calls = 0
+    started = time.perf_counter()
+    while True:
+        for input in inputs:
+            func(input)
+        calls += len(inputs)
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_seconds:
+            return Result(elapsed / calls)
+
+def time_once(func, *args) -> tuple[float, object]:
+    started = time.perf_counter()
+    value = func(*args)
+    return (time.perf_counter() - started, value)
+
+def is_set_reminder(command: bg.CommandNode|None) -> bool:
+    return command is not None and bi.COMMAND_NAMES_INV.get(command.name.lower()) == bi.COMMAND_FUNCTIONS_INV[bi.set_reminder]
+
+def parse_set_reminder_args(input: str):
+    command = bg.parse_command(input, bi.COMMAND_PREFIX)
+    if is_set_reminder(command):
+        try:
+            bg.parse_set_reminder_args(command.args) # type: ignore
+        except Exception:
+            pass
+
+def clear_parse_caches():
+    bg.parse_duration.cache_clear()
+    bg.parse_repeat.cache_clear()
+    bg.parse_time.cache_clear()
+
+def uncached(func):
+    def run(input):
+        clear_parse_caches()
+        func(input)
+    return run
+
+def bench_parse(results: dict[str, Result]):
+    now = datetime.now(bt.UTC)
+    set_reminder_inputs = [command.args for input in COMMAND_CORPUS
+                           if is_set_reminder(command := bg.parse_command(input, bi.COMMAND_PREFIX))] # type: ignore
+    def parse_set_reminder(input: str):
+        try:
+            bi.parse_set_reminder(input, now, True, None, "bench")
+        except ValueError:
+            pass
+    def parse_start_str(input: str):
+        try:
+            bi.parse_start_str(input, now)
+        except ValueError:
+            pass
+
+    results['parse.reject_non_command'] = time_per_call(lambda input: bg.parse_command(input, bi.COMMAND_PREFIX), NON_COMMAND_CORPUS)
+    results['parse.command'] = time_per_call(lambda input: bg.parse_command(input, bi.COMMAND_PREFIX), COMMAND_CORPUS)
+    results['parse.set_reminder_args'] = time_per_call(parse_set_reminder_args, COMMAND_CORPUS)
+    results['parse.set_reminder_args_uncached'] = time_per_call(uncached(parse_set_reminder_args), COMMAND_CORPUS)
+    results['parse.set_reminder'] = time_per_call(parse_set_reminder, set_reminder_inputs)
+    results['parse.start_str'] = time_per_call(parse_start_str, START_TIME_CORPUS)
+    results['parse.start_str_uncached'] = time_per_call(uncached(parse_start_str), START_TIME_CORPUS)
+
+def bench_timing(results: dict[str, Result]):
+    start = datetime(2026, 1, 31, 9, 30, tzinfo=ZoneInfo("America/Winnipeg"))
+    increments = list(range(1, 101))
+    for name, interval_function in zip(bt.TIME_INTERVAL_NAMES, bt.TIME_INTERVAL_FUNCTIONS):
+        results[f'timing.{name}'] = time_per_call(lambda n: interval_function(start, n), increments)
+
+#fills the reminders table directly (much faster than going through the store), with DUE_FRACTION of them due now
+#month and year repeats that land on a day the target month doesn't have are moved back to its last day (never on into the
+#next month), and are counted from the start rather than from the previous repeat. checked before benchmarking, so a faster
+#interval function that gets these wrong can't pass as an improvement. (interval, start, n, expected)
+CALENDAR_CASES = [
+    ("month", datetime(2025, 1, 15, 9), 1, datetime(2025, 2, 15, 9)),
+    ("month", datetime(2025, 1, 31, 9), 1, datetime(2025, 2, 28, 9)),
+    ("month", datetime(2024, 1, 31, 9), 1, datetime(2024, 2, 29, 9)),
+    ("month", datetime(2025, 1, 31, 9), 2, datetime(2025, 3, 31, 9)),
+    ("month", datetime(2025, 12, 31, 9), 2, datetime(2026, 2, 28, 9)),
+    ("year", datetime(2024, 2, 29, 9), 1, datetime(2025, 2, 28, 9)),
+    ("year", datetime(2024, 2, 29, 9), 4, datetime(2028, 2, 29, 9)),
+]
+#(interval, start, increment, now, expected count)
+INCREMENT_COUNT_CASES = [
+    ("month", datetime(2025, 1, 31, 9, tzinfo=bt.UTC), 1, datetime(2025, 3, 1, 9, tzinfo=bt.UTC), 2), #28 feb has passed, 31 mar hasn't
+    ("year", datetime(2024, 2, 29, 9, tzinfo=bt.UTC), 1, datetime(2025, 3, 1, 9, tzinfo=bt.UTC), 2),
+]
+
+#returns a description of every case that came out wrong
+def check_calendar() -> list[str]:
+    errors = []
+    for interval, start, n, expected in CALENDAR_CASES:
+        try:
+            result = bt.TIME_INTERVAL_FUNCTIONS[bt.TIME_INTERVAL_NAMES_INV[interval]](start, n)
+        except ValueError as e:
+            result = f"an error ({e})"
+        if result != expected:
+            errors.append(f"{start} + {n} {interval}s is {result}, should be {expected}")
+    for interval, start, increment, now, expected in INCREMENT_COUNT_CASES:
+        try:
+            result = bt.first_increment_count_after(start, bt.TIME_INTERVAL_NAMES_INV[interval], increment, now)
+        except ValueError as e:
+            result = f"an error ({e})"
+        if result != expected:
+            errors.append(f"first repeat of {start} every {increment} {interval}s after {now} is {result}, should be {expected}")
+    return errors
+
+def populate(size: int, now_timestamp: int):
+    rng = random.Random(SEED)
+    rows = []
+    for i in range(size):
+        channel_id = 1000000000000000000 + i // 20
+        has_repeat = i % 2 == 0
+        next_timestamp = now_timestamp - rng.randrange(60) if i < size * DUE_FRACTION else now_timestamp + rng.randrange(1, 365 * 24 * 60 * 60)
+        rows.append((f"reminder {i}", channel_id, 900000000000000000 + (i // 2000 << 22), None, 300000000000000000 + i % 5000,
+                     next_timestamp, next_timestamp, has_repeat, 2 if has_repeat else None, 1 if has_repeat else None, 0 if has_repeat else None, None))
+    with bd.write_conn() as write:
+        cursor = write.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("DELETE FROM reminders")
+        cursor.executemany(f"""
+            INSERT INTO reminders ({bd.REMINDER_COLUMNS})
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+
+def bench_store(results: dict[str, Result], sizes: list[int]):
+    for size in sizes:
+        now = datetime.now()
+        populate(size, int(now.timestamp()))
+
+        seconds, _ = time_once(bst.load)
+        results[f'store.load[{size}]'] = Result(seconds / size)
+        count, memory = bst.get_memory_stats()
+        results[f'store.memory[{size}]'] = Result(memory / count, "bytes/reminder")
+        seconds, _ = time_once(bs.scheduler.load)
+        results[f'scheduler.load[{size}]'] = Result(seconds / size)
+
+        seconds, due = time_once(bs.scheduler.pop_due, now.timestamp())
+        results[f'scheduler.pop_due[{size}]'] = Result(seconds / len(due)) # type: ignore
+        singles, batch = due[:min(100, len(due) // 2)], due[min(100, len(due) // 2):] # type: ignore
+        seconds, (claimed, _) = time_once(bst.claim_reminders, batch, now) # type: ignore
+        results[f'store.claim_reminders[{size}]'] = Result(seconds / len(batch))
+        seconds, _ = time_once(bst.finish_deliveries, [(delivery, True) for delivery in claimed])
+        results[f'store.finish_deliveries[{size}]'] = Result(seconds / len(batch))
+        seconds, _ = time_once(bst.flush)
+        results[f'store.flush[{size}]'] = Result(seconds / len(batch))
+
+        started = time.perf_counter()
+        for name, channel_id in singles:
+            bst.claim_reminder(name, channel_id, now)
+        results[f'store.claim_reminder[{size}]'] = Result((time.perf_counter() - started) / len(singles))
+        bst.flush()
+
+    populate(0, 0) #so the rest of the benchmarks start empty
+    bst.load()
+    bs.scheduler.load()
+
+def bench_list(results: dict[str, Result], sizes: list[int]):
+    for size in sizes:
+        channel_id = 42
+        bst.remove_all_reminders(channel_id)
+        now = datetime.now(bt.UTC)
+        for i in range(size):
+            bst.set_reminder(f"reminder {i}", channel_id, None, 7, now + timedelta(minutes=i), 2 if i % 2 == 0 else None, 1 if i % 2 == 0 else None)
+        bst.flush()
+
+        async def list_reminders():
+            return await bi.list_reminders("", channel_id, None, 7, "bench", bp.get_admin(), None)
+        asyncio.run(list_reminders()) #first call fills the occurrence rings
+        seconds, _ = time_once(asyncio.run, list_reminders())
+        results[f'io.list_reminders[{size}]'] = Result(seconds)
+
+def bench_tick(results: dict[str, Result], sizes: list[tuple[int, int]]):
+    for due_count, channel_count in sizes:
+        now = datetime.now(bt.UTC)
+        bst.remove_channels_reminders(list(range(channel_count)))
+        due = []
+        for i in range(due_count):
+            bst.set_reminder(f"tick {i}", i % channel_count, None, 7, now - timedelta(seconds=1), 2 if i % 2 == 0 else None, 1 if i % 2 == 0 else None)
+            due.append((f"tick {i}", i % channel_count))
+        bst.flush()
+
+        client = bfd.FakeClient(bfd.FakeConfig(latency=0, jitter=0))
+        for channel_id in range(channel_count):
+            client.add_channel(channel_id, None)
+        seconds, _ = time_once(asyncio.run, bdv.deliver_reminders(client, due)) # type: ignore the fake client only has what delivery uses
+        results[f'delivery.tick[{due_count}x{channel_count}]'] = Result(seconds)
+
+#what logging costs the thread that logs; writing happens on the listener thread
+def bench_logging(results: dict[str, Result]):
+    def make_error(i: int) -> Exception:
+        try:
+            raise ValueError(f"bench error {i}")
+        except ValueError as e:
+            return e
+
+    bl.setup()
+    token = bl.set_context(channel_id=1234, command="bench")
+    results['log.info'] = time_per_call(lambda i: bl.log_info(f"bench message {i}", reminder="bench"), list(range(100)))
+    errors = [make_error(i) for i in range(bl.MAX_TRACKED_ERRORS - 1)] #different errors, so none are suppressed
+    seconds, _ = time_once(lambda: [bl.log_err(e) for e in errors])
+    results['log.error'] = Result(seconds / len(errors))
+    results['log.error_repeated'] = time_per_call(bl.log_err, errors[:1])
+    bl.reset_context(token)
+
+def run(store_sizes: list[int]) -> dict[str, Result]:
+    results: dict[str, Result] = {}
+    bench_parse(results)
+    bench_timing(results)
+    bench_store(results, store_sizes)
+    bench_list(results, LIST_SIZES)
+    bench_tick(results, TICK_SIZES)
+    bench_logging(results)
+    return results
+
+def to_json(results: dict[str, Result]) -> dict:
+    return {
+        'python' : sys.version,
+        'platform' : platform.platform(),
+        'time' : datetime.now(bt.UTC).isoformat(),
+        'results' : {name : {'value' : result.value, 'unit' : result.unit} for name, result in results.items()},
+    }
+
+def format_value(value: float, unit: str) -> str:
+    if unit != "s":
+        return f"{value:.1f} {unit}"
+    if value < 1e-3:
+        return f"{value * 1e6:.2f} us"
+    return f"{value * 1e3:.2f} ms"
+
+#prints every benchmark next to the baseline. returns whether any got slower by more than threshold
+def compare(results: dict[str, Result], baseline: dict, threshold: float) -> bool:
+    regressed = False
+    for name, result in results.items():
+        old = baseline['results'].get(name)
+        if old is None:
+            print(f"{name}: {format_value(result.value, result.unit)} (new)")
+            continue
+        change = result.value / old['value'] - 1 if old['value'] > 0 else 0.0
+        mark = ""
+        if change > threshold:
+            mark = "  REGRESSION"
+            regressed = True
+        print(f"{name}: {format_value(result.value, result.unit)} vs {format_value(old['value'], old['unit'])} ({change:+.1%}){mark}")
+    return regressed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks RemindBot's hot paths.")
+    parser.add_argument("--output", help="write the results to this json file")
+    parser.add_argument("--compare", help="compare against results saved with --output, exits with 1 on a regression")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD, help=f"slowdown that counts as a regression (default {REGRESSION_THRESHOLD})")
+    parser.add_argument("--sizes", type=int, nargs="+", default=STORE_SIZES, help=f"store sizes to benchmark (at least {MIN_STORE_SIZE})")
+    args = parser.parse_args()
+    if min(args.sizes) < MIN_STORE_SIZE:
+        parser.error(f"--sizes must be at least {MIN_STORE_SIZE}")
+
+    calendar_errors = check_calendar()
+    if len(calendar_errors) > 0:
+        for error in calendar_errors:
+            print(f"Calendar check failed: {error}", file=sys.stderr)
+        sys.exit(1)
+
+    results = run(args.sizes)
+    if args.output is not None:
+        with open(os.path.join(START_DIR, args.output), 'w') as f:
+            json.dump(to_json(results), f, indent=2)
+
+    if args.compare is not None:
+        with open(os.path.join(START_DIR, args.compare), 'r') as f:
+            baseline = json.load(f)
+        sys.exit(1 if compare(results, baseline, args.threshold) else 0)
+    for name, result in results.items():
+        print(f"{name}: {format_value(result.value, result.unit)}")
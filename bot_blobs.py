@@ -0,0 +1,166 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+import aiohttp
+import discord
+
+#custom messages are snapshotted when the reminder is set, so firing a reminder never has to refetch the original message
+#or redownload its attachments. attachments are stored on disk once per distinct content, named by their sha256.
+#bot_db keeps the reference counts and decides when a blob can be deleted
+BLOB_DIR = 'blobs'
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+MAX_BLOB_SIZE = 25 * 1024 * 1024 #larger attachments couldn't be sent again by the bot in most guilds anyway
+ORPHAN_BLOB_SECONDS = 60 * 60 #blob files are only deleted once they haven't been written for this long, since they may still be getting referenced
+
+class AttachmentSnapshot:
+    def __init__(self, blob_hash: str, size: int, filename: str, spoiler: bool, description: str|None):
+        self.blob_hash = blob_hash
+        self.size = size
+        self.filename = filename
+        self.spoiler = spoiler
+        self.description = description
+
+class MessageSnapshot:
+    def __init__(self, content: str, tts: bool, embeds: list[dict], sticker_ids: list[int], attachments: list[AttachmentSnapshot]):
+        self.content = content
+        self.tts = tts
+        self.embeds = embeds
+        self.sticker_ids = sticker_ids
+        self.attachments = attachments
+
+    def embeds_json(self) -> str:
+        return json.dumps(self.embeds)
+
+    def sticker_ids_json(self) -> str:
+        return json.dumps(self.sticker_ids)
+
+    #keyword arguments for channel.send. attachment files are opened here and streamed from disk by discord.py,
+    #which also closes them after sending
+    def make_send_kwargs(self) -> dict:
+        embeds = [discord.Embed.from_dict(embed) for embed in self.embeds]
+        files = [discord.File(blob_path(attachment.blob_hash), filename=attachment.filename, spoiler=attachment.spoiler,
+                              description=attachment.description)
+                 for attachment in self.attachments]
+        return {
+            'content' : self.content,
+            'tts' : self.tts,
+            'embeds' : embeds,
+            'files' : files,
+            'stickers' : [discord.Object(sticker_id) for sticker_id in self.sticker_ids],
+            'suppress_embeds' : len(embeds) == 0,
+        }
+
+class BlobMissingError(Exception):
+    pass
+class BlobTooLargeError(Exception):
+    pass
+
+def blob_path(blob_hash: str) -> str:
+    return os.path.join(BLOB_DIR, blob_hash[:2], blob_hash)
+
+def has_blob(blob_hash: str) -> bool:
+    return os.path.exists(blob_path(blob_hash))
+
+#whether the blob hasn't been downloaded for ORPHAN_BLOB_SECONDS. False if it's gone already
+def is_blob_stale(blob_hash: str) -> bool:
+    try:
+        return os.path.getmtime(blob_path(blob_hash)) < time.time() - ORPHAN_BLOB_SECONDS
+    except FileNotFoundError:
+        return False
+
+def delete_blob(blob_hash: str):
+    try:
+        os.remove(blob_path(blob_hash))
+    except FileNotFoundError:
+        pass
+
+session: aiohttp.ClientSession|None = None
+
+async def close_session():
+    global session
+    if session is not None:
+        await session.close()
+        session = None
+
+def open_tmp_file():
+    tmp_dir = os.path.join(BLOB_DIR, 'tmp')
+    os.makedirs(tmp_dir, exist_ok=True)
+    tmp_path = os.path.join(tmp_dir, f"{os.getpid()}-{time.monotonic_ns()}")
+    return (tmp_path, open(tmp_path, 'wb'))
+
+def write_chunk(f, sha256, chunk: bytes):
+    sha256.update(chunk)
+    f.write(chunk)
+
+def store_tmp_file(tmp_path: str, blob_hash: str):
+    path = blob_path(blob_hash)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    os.replace(tmp_path, path) #identical content just replaces the existing file
+
+def remove_tmp_file(tmp_path: str):
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+#streams an attachment to disk while hashing it, so memory use doesn't depend on the attachment's size. the file is written
+#on a worker thread, so a slow disk doesn't hold up the event loop. fails once more than max_size bytes have been read.
+#returns (sha256 hex digest, size)
+async def download_blob(url: str, max_size: int = MAX_BLOB_SIZE) -> tuple[str, int]:
+    global session
+    if session is None:
+        session = aiohttp.ClientSession()
+
+    tmp_path, f = await asyncio.to_thread(open_tmp_file)
+    sha256 = hashlib.sha256()
+    size = 0
+    try:
+        try:
+            async with session.get(url) as resp:
+                resp.raise_for_status()
+                async for chunk in resp.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > max_size:
+                        raise BlobTooLargeError(f"Attachment is larger than {max_size} bytes")
+                    await asyncio.to_thread(write_chunk, f, sha256, chunk)
+        finally:
+            await asyncio.to_thread(f.close)
+
+        blob_hash = sha256.hexdigest()
+        await asyncio.to_thread(store_tmp_file, tmp_path, blob_hash)
+        return (blob_hash, size)
+    finally:
+        await asyncio.to_thread(remove_tmp_file, tmp_path)
+
+async def snapshot_message(message: discord.Message) -> MessageSnapshot:
+    for attachment in message.attachments: #before downloading any of them
+        if attachment.size > MAX_BLOB_SIZE:
+            raise BlobTooLargeError(f"Attachment {attachment.filename} is larger than {MAX_BLOB_SIZE // 1024 // 1024} MiB")
+
+    attachments = []
+    for attachment in message.attachments:
+        blob_hash, size = await download_blob(attachment.url, attachment.size) #discord said how large it is, so more is wrong
+        attachments.append(AttachmentSnapshot(blob_hash, size, attachment.filename, attachment.is_spoiler(), attachment.description))
+
+    return MessageSnapshot(
+        content=message.content,
+        tts=message.tts,
+        embeds=[embed.to_dict() for embed in message.embeds],
+        sticker_ids=[sticker.id for sticker in message.stickers],
+        attachments=attachments
+    )
+
+#blob files that no database row knows about and that are old enough to not be mid-snapshot
+def find_orphan_blobs(known_hashes: set[str]) -> list[str]:
+    orphans = []
+    if not os.path.isdir(BLOB_DIR):
+        return orphans
+    cutoff = time.time() - ORPHAN_BLOB_SECONDS
+    for prefix in os.listdir(BLOB_DIR):
+        prefix_dir = os.path.join(BLOB_DIR, prefix)
+        if prefix == 'tmp' or not os.path.isdir(prefix_dir):
+            continue
+        for blob_hash in os.listdir(prefix_dir):
+            if blob_hash not in known_hashes and os.path.getmtime(os.path.join(prefix_dir, blob_hash)) < cutoff:
+                orphans.append(blob_hash)
+    return orphans
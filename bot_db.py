@@ -1,15 +1,50 @@
-from datetime import datetime
+from collections import OrderedDict
+import json
 import sqlite3
+import threading
+import time
 from zoneinfo import ZoneInfo
 import bot_timing as bt
-
-conn = sqlite3.connect('bot.db', isolation_level=None, check_same_thread=False)
-conn.execute("PRAGMA journal_mode=WAL;")
-with conn:
-    cursor = conn.cursor()
-    cursor.execute("BEGIN IMMEDIATE")
-
-    cursor.executescript("""
+import bot_blobs as bb
+import bot_metrics as bm
+
+DB_PATH = 'bot.db'
+
+#nothing is opened at import. connect is called while the bot starts, and otherwise the first query connects to DB_PATH
+db_path = DB_PATH
+conn: sqlite3.Connection|None = None
+connect_lock = threading.Lock()
+
+#opens the database, creating and migrating it if needed. only does anything the first time
+def connect(path: str = DB_PATH):
+    global conn, db_path
+    with connect_lock:
+        if conn is not None:
+            return
+        new_conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        new_conn.execute("PRAGMA journal_mode=WAL;")
+        migrate(new_conn)
+        db_path = path
+        conn = new_conn
+
+def write_conn() -> sqlite3.Connection:
+    if conn is None:
+        connect()
+    return conn # type: ignore set by connect
+
+#threads that only read can open their own read-only connection, so they never wait on writes (WAL)
+local = threading.local()
+
+def open_read_conn():
+    write_conn() #the file has to exist and be migrated first
+    local.conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, isolation_level=None, check_same_thread=False)
+
+def read_conn() -> sqlite3.Connection:
+    read = getattr(local, 'conn', None)
+    return read if read is not None else write_conn()
+
+def create_tables(cursor: sqlite3.Cursor):
+    cursor.execute("""
     CREATE TABLE IF NOT EXISTS reminders (
         name TEXT NOT NULL,
         channel_id INTEGER NOT NULL,
@@ -27,119 +62,452 @@ with conn:
         CHECK (NOT has_repeat OR repeat_interval_increment > 0),
         CHECK (NOT has_repeat OR repeat_increment_count IS NOT NULL),
         CHECK (NOT has_repeat OR repeat_increment_count >= 0)
-    );
-                
+    )
+    """)
+
+    cursor.execute("""
     CREATE TABLE IF NOT EXISTS users (
         id INTEGER PRIMARY KEY,
         timezone TEXT NOT NULL
-    );
+    )
+    """)
+
+#reminders are keyed by (channel_id, name) without a rowid, so the rows of a channel are stored together.
+#timestamps used to be stored as floats, so they are truncated to integers while copying
+def rebuild_reminders(cursor: sqlite3.Cursor):
+    cursor.execute("""
+    CREATE TABLE reminders_new (
+        name TEXT NOT NULL,
+        channel_id INTEGER NOT NULL,
+        reply_message_id INTEGER,
+        setter_user_id INTEGER NOT NULL,
+        start_timestamp INTEGER NOT NULL,
+        next_timestamp INTEGER NOT NULL,
+        has_repeat BOOLEAN NOT NULL,
+        repeat_interval_index INTEGER,
+        repeat_interval_increment INTEGER,
+        repeat_increment_count INTEGER,
+        PRIMARY KEY (channel_id, name),
+        CHECK (NOT has_repeat OR repeat_interval_index IS NOT NULL),
+        CHECK (NOT has_repeat OR repeat_interval_increment IS NOT NULL),
+        CHECK (NOT has_repeat OR repeat_interval_increment > 0),
+        CHECK (NOT has_repeat OR repeat_increment_count IS NOT NULL),
+        CHECK (NOT has_repeat OR repeat_increment_count >= 0)
+    ) WITHOUT ROWID
+    """)
+
+    cursor.execute("""
+    INSERT INTO reminders_new (name, channel_id, reply_message_id, setter_user_id, start_timestamp, next_timestamp,
+                        has_repeat, repeat_interval_index, repeat_interval_increment, repeat_increment_count)
+    SELECT name, channel_id, reply_message_id, setter_user_id, CAST(start_timestamp AS INTEGER), CAST(next_timestamp AS INTEGER),
+        has_repeat, repeat_interval_index, repeat_interval_increment, repeat_increment_count
+    FROM reminders
+    """)
+    cursor.execute("DROP TABLE reminders")
+    cursor.execute("ALTER TABLE reminders_new RENAME TO reminders")
+
+def add_next_timestamp_indexes(cursor: sqlite3.Cursor):
+    cursor.execute("CREATE INDEX reminders_by_next_timestamp ON reminders (next_timestamp)")
+    cursor.execute("CREATE INDEX reminders_by_channel_next_timestamp ON reminders (channel_id, next_timestamp)")
+
+#NULL means bt.DEFAULT_MISSED_POLICY
+def add_missed_policy(cursor: sqlite3.Cursor):
+    cursor.execute("ALTER TABLE reminders ADD COLUMN missed_policy INTEGER")
+
+#snapshots of custom messages, see bot_blobs. blob reference counts are kept by triggers,
+#so every way of deleting a reminder releases its attachments
+def add_message_snapshots(cursor: sqlite3.Cursor):
+    cursor.execute("""
+    CREATE TABLE blobs (
+        hash TEXT NOT NULL PRIMARY KEY,
+        size INTEGER NOT NULL,
+        refcount INTEGER NOT NULL
+    ) WITHOUT ROWID
+    """)
+
+    cursor.execute("""
+    CREATE TABLE reminder_messages (
+        name TEXT NOT NULL,
+        channel_id INTEGER NOT NULL,
+        content TEXT NOT NULL,
+        tts BOOLEAN NOT NULL,
+        embeds TEXT NOT NULL,
+        sticker_ids TEXT NOT NULL,
+        PRIMARY KEY (channel_id, name)
+    ) WITHOUT ROWID
     """)
 
-class ReminderAlreadyExistsError(Exception):
+    cursor.execute("""
+    CREATE TABLE reminder_attachments (
+        name TEXT NOT NULL,
+        channel_id INTEGER NOT NULL,
+        position INTEGER NOT NULL,
+        blob_hash TEXT NOT NULL,
+        filename TEXT NOT NULL,
+        spoiler BOOLEAN NOT NULL,
+        description TEXT,
+        PRIMARY KEY (channel_id, name, position)
+    ) WITHOUT ROWID
+    """)
+
+    cursor.execute("CREATE INDEX blobs_by_refcount ON blobs (refcount)")
+
+    cursor.execute("""
+    CREATE TRIGGER reminders_delete_message AFTER DELETE ON reminders BEGIN
+        DELETE FROM reminder_messages WHERE channel_id = OLD.channel_id AND name = OLD.name;
+        DELETE FROM reminder_attachments WHERE channel_id = OLD.channel_id AND name = OLD.name;
+    END
+    """)
+
+    cursor.execute("""
+    CREATE TRIGGER reminder_attachments_acquire AFTER INSERT ON reminder_attachments BEGIN
+        UPDATE blobs SET refcount = refcount + 1 WHERE hash = NEW.blob_hash;
+    END
+    """)
+
+    cursor.execute("""
+    CREATE TRIGGER reminder_attachments_release AFTER DELETE ON reminder_attachments BEGIN
+        UPDATE blobs SET refcount = refcount - 1 WHERE hash = OLD.blob_hash;
+    END
+    """)
+
+#NULL means a dm channel, or a reminder set before guild ids were stored (both belong to shard 0)
+def add_guild_id(cursor: sqlite3.Cursor):
+    cursor.execute("ALTER TABLE reminders ADD COLUMN guild_id INTEGER")
+
+#so the reminders of a guild the bot was removed from are deleted with one indexed statement
+def add_guild_id_index(cursor: sqlite3.Cursor):
+    cursor.execute("CREATE INDEX reminders_by_guild ON reminders (guild_id)")
+
+#reminders and timezones staged by bot_admin imports, applied by the bot (see bot_imports). data is a json array of the
+#row's values, and guild_id is only there so each process picks up its own shards' reminders
+def add_pending_imports(cursor: sqlite3.Cursor):
+    cursor.execute("""
+    CREATE TABLE pending_imports (
+        id INTEGER PRIMARY KEY,
+        kind INTEGER NOT NULL,
+        guild_id INTEGER,
+        data TEXT NOT NULL
+    )
+    """)
+
+#the outbox: a reminder is claimed into deliveries in the same transaction that advances it, and only sent once that is
+#on disk, so a crash can't advance it without sending it. one that was sent but not yet recorded as sent is sent again after
+#a crash, and it is add_delivery_batch_nonces that keeps discord from showing it twice. a reminder's deliveries go when it does
+def add_deliveries(cursor: sqlite3.Cursor):
+    cursor.execute("""
+    CREATE TABLE deliveries (
+        channel_id INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        repeat_increment_count INTEGER NOT NULL,
+        due_timestamp INTEGER NOT NULL,
+        state INTEGER NOT NULL,
+        attempts INTEGER NOT NULL,
+        updated_timestamp INTEGER NOT NULL,
+        PRIMARY KEY (channel_id, name, repeat_increment_count)
+    ) WITHOUT ROWID
+    """)
+
+    cursor.execute("""
+    CREATE TRIGGER reminders_delete_deliveries AFTER DELETE ON reminders BEGIN
+        DELETE FROM deliveries WHERE channel_id = OLD.channel_id AND name = OLD.name;
+    END
+    """)
+
+#the nonce of the message a delivery is sent in, stored before it is first sent. a delivery that is sent again (after a crash,
+#or a failed attempt) goes out in the same message with the same nonce, so discord drops it if the first one got through
+def add_delivery_batch_nonces(cursor: sqlite3.Cursor):
+    cursor.execute("ALTER TABLE deliveries ADD COLUMN batch_nonce TEXT")
+
+#MIGRATIONS[i] moves the database from user_version i to i + 1. only ever append to this list
+MIGRATIONS = [
+    create_tables,
+    rebuild_reminders,
+    add_next_timestamp_indexes,
+    add_missed_policy,
+    add_message_snapshots,
+    add_guild_id,
+    add_guild_id_index,
+    add_pending_imports,
+    add_deliveries,
+    add_delivery_batch_nonces,
+]
+
+class DatabaseTooNewError(Exception):
     pass
 
-def set_reminder(name: str, channel_id: int, reply_message_id: int|None, user_id: int,
-                 start_time: datetime, repeat_interval_index: int|None, repeat_interval_increment: int|None):
+def migrate(conn: sqlite3.Connection):
     with conn:
         cursor = conn.cursor()
         cursor.execute("BEGIN IMMEDIATE")
 
-        cursor.execute("""
-            SELECT 1 FROM reminders WHERE name = ? AND channel_id = ?
-        """, (name, channel_id))
-        
-        if cursor.fetchone() is not None:
-            raise ReminderAlreadyExistsError(f"Reminder with name '{name}' already exists in this channel")
+        cursor.execute("PRAGMA user_version")
+        version = cursor.fetchone()[0]
+        if version > len(MIGRATIONS):
+            raise DatabaseTooNewError(f"Database version is {version} but the newest known version is {len(MIGRATIONS)}")
+
+        for migration in MIGRATIONS[version:]:
+            migration(cursor)
+        cursor.execute(f"PRAGMA user_version = {len(MIGRATIONS)}")
+
+#(name, channel_id, guild_id, reply_message_id, setter_user_id, start_timestamp, next_timestamp,
+# has_repeat, repeat_interval_index, repeat_interval_increment, repeat_increment_count, missed_policy)
+ReminderRow = tuple[str, int, int|None, int|None, int, int, int, bool, int|None, int|None, int|None, int|None]
+REMINDER_COLUMNS = """name, channel_id, guild_id, reply_message_id, setter_user_id, start_timestamp, next_timestamp,
+                has_repeat, repeat_interval_index, repeat_interval_increment, repeat_increment_count, missed_policy"""
+
+#sqlite limits how many parameters a statement can have, so big IN lists are split up
+MAX_KEYS_PER_QUERY = 400
+
+def chunks(items: list, size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+#(channel_id, name, repeat_increment_count, due_timestamp, state, attempts, updated_timestamp, batch_nonce)
+DeliveryRow = tuple[int, str, int, int, int, int, int, str|None]
+
+#reminders are kept in memory by bot_store, and this is where its journal is written. applies one flush's changes
+#in one transaction. whole channels and guilds are purged first, since every other change is newer.
+#inserts replace any row with the same key (deleting it first releases its snapshot's blobs),
+#since a reminder can be removed and set again between flushes. deliveries come last, so they are never written
+#for a reminder that is deleted in the same flush
+def write_reminders(inserts: list[ReminderRow], updates: list[tuple[int, int, str, int]], deletes: list[tuple[str, int]],
+                    snapshots: dict[tuple[str, int], bb.MessageSnapshot], purged_channel_ids: list[int] = [], purged_guild_ids: list[int] = [],
+                    deliveries: list[DeliveryRow] = []):
+    with write_conn() as write:
+        cursor = write.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
 
-        start_timestamp = start_time.timestamp()
-        cursor.execute("""
-        INSERT INTO reminders (name, channel_id, reply_message_id, setter_user_id, start_timestamp, next_timestamp,
-                            has_repeat, repeat_interval_index, repeat_interval_increment, repeat_increment_count)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (name, 
-        channel_id,
-        reply_message_id,
-        user_id,
-        start_timestamp,
-        start_timestamp,
-        repeat_interval_index != None,
-        repeat_interval_index,
-        repeat_interval_increment,
-        0))
-
-class ReminderDoesntExistError(Exception):
-    pass
+        cursor.executemany("""
+            DELETE FROM reminders WHERE channel_id = ?
+        """, [(channel_id,) for channel_id in purged_channel_ids])
+        cursor.executemany("""
+            DELETE FROM reminders WHERE guild_id = ?
+        """, [(guild_id,) for guild_id in purged_guild_ids])
 
-def remove_reminder(name: str, channel_id: int):
-    with conn:
-        cursor = conn.cursor()
+        cursor.executemany("""
+            DELETE FROM reminders WHERE name = ? AND channel_id = ?
+        """, deletes + [(row[0], row[1]) for row in inserts])
+        cursor.executemany(f"""
+            INSERT INTO reminders ({REMINDER_COLUMNS})
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, inserts)
+        cursor.executemany("""
+            UPDATE reminders
+            SET next_timestamp = ?, repeat_increment_count = ?
+            WHERE name = ? AND channel_id = ?
+        """, updates)
+        for (name, channel_id), snapshot in snapshots.items():
+            insert_message_snapshot(cursor, name, channel_id, snapshot)
+        cursor.executemany("""
+            INSERT INTO deliveries (channel_id, name, repeat_increment_count, due_timestamp, state, attempts, updated_timestamp, batch_nonce)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (channel_id, name, repeat_increment_count)
+            DO UPDATE SET state = excluded.state, attempts = excluded.attempts, updated_timestamp = excluded.updated_timestamp,
+                          batch_nonce = excluded.batch_nonce
+        """, deliveries)
+
+#for reminders set before guild ids were stored
+def set_channel_guilds(channel_guilds: list[tuple[int, int]]):
+    with write_conn() as write:
+        cursor = write.cursor()
         cursor.execute("BEGIN IMMEDIATE")
 
-        # Check if the reminder exists and get the setter's user ID
+        cursor.executemany("""
+            UPDATE reminders SET guild_id = ? WHERE channel_id = ? AND guild_id IS NULL
+        """, [(guild_id, channel_id) for channel_id, guild_id in channel_guilds])
+
+#blob files are only deleted once they haven't been written for bot_blobs.ORPHAN_BLOB_SECONDS, and downloading a blob rewrites it,
+#so a file that exists here can't disappear before the snapshot is flushed, even if another process is collecting blobs
+def check_snapshot_blobs(snapshot: bb.MessageSnapshot):
+    for attachment in snapshot.attachments:
+        if not bb.has_blob(attachment.blob_hash):
+            raise bb.BlobMissingError(f"Attachment {attachment.filename} was deleted while being saved, try again")
+
+#caller must be in a write transaction
+def insert_message_snapshot(cursor: sqlite3.Cursor, name: str, channel_id: int, snapshot: bb.MessageSnapshot):
+    cursor.execute("""
+        INSERT INTO reminder_messages (name, channel_id, content, tts, embeds, sticker_ids)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, (name, channel_id, snapshot.content, snapshot.tts, snapshot.embeds_json(), snapshot.sticker_ids_json()))
+    cursor.executemany("""
+        INSERT OR IGNORE INTO blobs (hash, size, refcount) VALUES (?, ?, 0)
+    """, [(attachment.blob_hash, attachment.size) for attachment in snapshot.attachments])
+    cursor.executemany("""
+        INSERT INTO reminder_attachments (name, channel_id, position, blob_hash, filename, spoiler, description)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, [(name, channel_id, position, attachment.blob_hash, attachment.filename, attachment.spoiler, attachment.description)
+          for position, attachment in enumerate(snapshot.attachments)])
+
+def get_message_snapshot(name: str, channel_id: int) -> bb.MessageSnapshot|None:
+    with read_conn() as read:
+        cursor = read.cursor()
+
         cursor.execute("""
-            SELECT setter_user_id FROM reminders WHERE name = ? AND channel_id = ?
-        """, (name, channel_id))
-        
+            SELECT content, tts, embeds, sticker_ids FROM reminder_messages WHERE channel_id = ? AND name = ?
+        """, (channel_id, name))
         row = cursor.fetchone()
         if row is None:
-            raise ReminderDoesntExistError(f"Reminder with name '{name}' doesn't exist in this channel")
+            return None
+        content, tts, embeds, sticker_ids = row
 
-        # Perform the deletion
         cursor.execute("""
-            DELETE FROM reminders WHERE name = ? AND channel_id = ?
-        """, (name, channel_id))
-
-def remove_all_reminders(channel_id: int):
-    with conn:
-        cursor = conn.cursor()
+            SELECT reminder_attachments.blob_hash, blobs.size, filename, spoiler, description
+            FROM reminder_attachments JOIN blobs ON blobs.hash = reminder_attachments.blob_hash
+            WHERE channel_id = ? AND name = ?
+            ORDER BY position
+        """, (channel_id, name))
+        attachments = [bb.AttachmentSnapshot(*attachment_row) for attachment_row in cursor.fetchall()]
+        return bb.MessageSnapshot(content, bool(tts), json.loads(embeds), json.loads(sticker_ids), attachments)
+
+#deletes blobs no reminder references anymore. must run on the same thread as set_reminder (the writer).
+#the file of a blob that was downloaded again recently is kept, another process may be about to reference it. it is an orphan
+#once its row is gone, so it is deleted later if nothing does
+def collect_blobs() -> int:
+    with write_conn() as write:
+        cursor = write.cursor()
         cursor.execute("BEGIN IMMEDIATE")
 
-        cursor.execute("""
-            DELETE FROM reminders WHERE channel_id = ?
-        """, (channel_id,))
-
-def get_all_reminders(channel_id: int) -> list[tuple[str, int, int|None, int, int, int, bool, int|None, int|None, int|None]]:
-    with conn:
-        cursor = conn.cursor()
-
-        cursor.execute("""
-            SELECT name, channel_id, reply_message_id, setter_user_id, start_timestamp, next_timestamp,
-                has_repeat, repeat_interval_index, repeat_interval_increment, repeat_increment_count 
-            FROM reminders 
-            WHERE channel_id = ?
-        """, (channel_id,))
-        return cursor.fetchall()
+        cursor.execute("DELETE FROM blobs WHERE refcount <= 0 RETURNING hash")
+        unreferenced = [row[0] for row in cursor.fetchall()]
+        cursor.execute("SELECT hash FROM blobs")
+        known_hashes = {row[0] for row in cursor.fetchall()}
+
+    unreferenced = [blob_hash for blob_hash in unreferenced if bb.is_blob_stale(blob_hash)]
+    orphans = bb.find_orphan_blobs(known_hashes)
+    for blob_hash in unreferenced + orphans:
+        bb.delete_blob(blob_hash)
+    return len(unreferenced) + len(orphans)
+
+#user_id -> ZoneInfo, or None for users without a timezone (so UTC). kept up to date by every write to users from this process,
+#so commands and the scheduler almost never read users from disk. other processes (other shards, imports) write to users too,
+#so entries expire after TIMEZONE_CACHE_SECONDS, which is how long their changes can take to be seen here.
+#the version is bumped on every write, so a read that raced with a write doesn't cache what it read
+TIMEZONE_CACHE_SIZE = 10000
+TIMEZONE_CACHE_SECONDS = 60
+
+timezone_cache: OrderedDict[int, tuple[ZoneInfo|None, float]] = OrderedDict() #user_id -> (zoneinfo, time.monotonic() it expires at)
+timezone_cache_lock = threading.Lock()
+timezone_cache_version = 0
+timezone_cache_hits = 0
+timezone_cache_misses = 0
+
+def cache_user_zoneinfo(user_id: int, zoneinfo: ZoneInfo|None, version: int|None = None):
+    global timezone_cache_version
+    with timezone_cache_lock:
+        if version is None:
+            timezone_cache_version += 1
+        elif version != timezone_cache_version:
+            return
+        timezone_cache[user_id] = (zoneinfo, time.monotonic() + TIMEZONE_CACHE_SECONDS)
+        timezone_cache.move_to_end(user_id)
+        if len(timezone_cache) > TIMEZONE_CACHE_SIZE:
+            timezone_cache.popitem(last=False)
+
+#returns (whether the user is cached, their ZoneInfo) without touching the database
+def get_cached_user_zoneinfo(user_id: int) -> tuple[bool, ZoneInfo|None]:
+    global timezone_cache_hits
+    with timezone_cache_lock:
+        entry = timezone_cache.get(user_id)
+        if entry is None:
+            return (False, None)
+        zoneinfo, expires = entry
+        if expires <= time.monotonic():
+            del timezone_cache[user_id]
+            return (False, None)
+        timezone_cache_hits += 1
+        timezone_cache.move_to_end(user_id)
+        return (True, zoneinfo)
+
+#(hits, misses, size)
+def get_timezone_cache_stats() -> tuple[int, int, int]:
+    with timezone_cache_lock:
+        return (timezone_cache_hits, timezone_cache_misses, len(timezone_cache))
+bm.TIMEZONE_CACHE_HITS.function = lambda: get_timezone_cache_stats()[0]
+bm.TIMEZONE_CACHE_MISSES.function = lambda: get_timezone_cache_stats()[1]
+bm.TIMEZONE_CACHE_SIZE.function = lambda: get_timezone_cache_stats()[2]
+
+#(user_id, timezone) of every user, a chunk at a time
+def iter_users(chunk_size: int):
+    cursor = read_conn().cursor()
+    cursor.execute("SELECT id, timezone FROM users ORDER BY id")
+    while len(rows := cursor.fetchmany(chunk_size)) > 0:
+        yield from rows
 
 def set_user_timezone(user_id: int, timezone: str):
-    with conn:
-        cursor = conn.cursor()
+    with write_conn() as write:
+        cursor = write.cursor()
         cursor.execute("BEGIN IMMEDIATE")
 
         cursor.execute("""
         INSERT OR REPLACE INTO users (id, timezone)
         VALUES (?, ?)
     """, (user_id, timezone))
+    cache_user_zoneinfo(user_id, ZoneInfo(timezone))
+
+def set_user_timezones(users: list[tuple[int, str]]):
+    with write_conn() as write:
+        cursor = write.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+
+        cursor.executemany("""
+        INSERT OR REPLACE INTO users (id, timezone)
+        VALUES (?, ?)
+    """, users)
+    for user_id, timezone in users:
+        cache_user_zoneinfo(user_id, ZoneInfo(timezone))
 
 class UserNotInDatabaseError(Exception):
     pass
 
-def get_user_timezone(user_id: int) -> str:
-    with conn:
-        cursor = conn.cursor()
-
-        cursor.execute("SELECT timezone FROM users WHERE id = ?", (user_id,))
-        row = cursor.fetchone()
-        if row is not None:
-            return row[0]
+#None if the user hasn't set a timezone
+def get_user_zoneinfo(user_id: int) -> ZoneInfo|None:
+    return get_user_zoneinfos([user_id], read_conn().cursor())[user_id]
+
+#looks up many users at once, reading only the ones that aren't cached
+def get_user_zoneinfos(user_ids: list[int], cursor: sqlite3.Cursor) -> dict[int, ZoneInfo|None]:
+    global timezone_cache_misses
+    zoneinfos = {}
+    missing = []
+    for user_id in user_ids:
+        is_cached, zoneinfo = get_cached_user_zoneinfo(user_id)
+        if is_cached:
+            zoneinfos[user_id] = zoneinfo
         else:
-            raise UserNotInDatabaseError("User doesn't have a set timezone")
+            missing.append(user_id)
+    if len(missing) == 0:
+        return zoneinfos
+
+    with timezone_cache_lock:
+        timezone_cache_misses += len(missing)
+        version = timezone_cache_version
+
+    timezone_strings = {}
+    for chunk in chunks(missing, MAX_KEYS_PER_QUERY):
+        cursor.execute(f"""
+            SELECT id, timezone FROM users WHERE id IN ({", ".join(["?"] * len(chunk))})
+        """, chunk)
+        timezone_strings.update(cursor.fetchall())
+
+    for user_id in missing:
+        zoneinfo = ZoneInfo(timezone_strings[user_id]) if user_id in timezone_strings else None
+        cache_user_zoneinfo(user_id, zoneinfo, version)
+        zoneinfos[user_id] = zoneinfo
+    return zoneinfos
+
+def get_user_timezone(user_id: int) -> str:
+    zoneinfo = get_user_zoneinfo(user_id)
+    if zoneinfo is not None:
+        return zoneinfo.key
+    else:
+        raise UserNotInDatabaseError("User doesn't have a set timezone")
 
 class TimezoneDoesntExistError(Exception):
     pass
 
 def remove_user_timezone(user_id: int):
-    with conn:
-        cursor = conn.cursor()
+    with write_conn() as write:
+        cursor = write.cursor()
         cursor.execute("BEGIN IMMEDIATE")
 
         # Check if the reminder exists and get the setter's user ID
@@ -155,20 +523,92 @@ def remove_user_timezone(user_id: int):
         cursor.execute("""
             DELETE FROM users WHERE id = ?
         """, (user_id,))
+    cache_user_zoneinfo(user_id, None)
 
 
-def get_due_reminders(now: datetime) -> list[tuple[str, int, int|None, int, int, int, bool, int|None, int|None, int|None]]:
-    with conn:
-        cursor = conn.cursor()
+#every reminder, for bot_store to load. if shard_ids is given, only the reminders belonging to those shards (see bot_shards)
+def get_every_reminder(shard_count: int = 1, shard_ids: list[int]|None = None) -> list[ReminderRow]:
+    with read_conn() as read:
+        cursor = read.cursor()
+
+        cursor.execute(f"""
+            SELECT {REMINDER_COLUMNS} FROM reminders
+            WHERE {shard_condition(shard_ids)}
+        """, shard_parameters(shard_count, shard_ids))
+        return cursor.fetchall()
+
+#deliveries that were claimed but not finished, of reminders belonging to shard_ids, for bot_store to load
+def get_pending_deliveries(pending_state: int, shard_count: int = 1, shard_ids: list[int]|None = None) -> list[DeliveryRow]:
+    with read_conn() as read:
+        cursor = read.cursor()
+
+        cursor.execute(f"""
+            SELECT deliveries.channel_id, deliveries.name, deliveries.repeat_increment_count, due_timestamp, state, attempts, updated_timestamp,
+                   batch_nonce
+            FROM deliveries JOIN reminders ON reminders.channel_id = deliveries.channel_id AND reminders.name = deliveries.name
+            WHERE state = ? AND {shard_condition(shard_ids)}
+        """, (pending_state, *shard_parameters(shard_count, shard_ids)))
+        return cursor.fetchall()
+
+#finished deliveries are kept for a while as a record, then deleted. returns how many were
+def prune_deliveries(pending_state: int, before_timestamp: int) -> int:
+    with write_conn() as write:
+        cursor = write.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
 
         cursor.execute("""
-            SELECT name, channel_id, reply_message_id, setter_user_id, start_timestamp, next_timestamp,
-                has_repeat, repeat_interval_index, repeat_interval_increment, repeat_increment_count 
-            FROM reminders 
-            WHERE next_timestamp <= ?
-        """, (now.timestamp(),))
+            DELETE FROM deliveries WHERE state != ? AND updated_timestamp < ?
+        """, (pending_state, before_timestamp))
+        return cursor.rowcount
+
+#where clause matching rows whose guild_id belongs to shard_ids (bot_shards.owns), or every row if it's None
+def shard_condition(shard_ids: list[int]|None) -> str:
+    if shard_ids is None:
+        return "TRUE"
+    return f"(CASE WHEN guild_id IS NULL THEN 0 ELSE (guild_id >> 22) % ? END) IN ({", ".join(["?"] * len(shard_ids))})"
+
+def shard_parameters(shard_count: int, shard_ids: list[int]|None) -> tuple[int, ...]:
+    return (shard_count, *shard_ids) if shard_ids is not None else ()
+
+#every reminder on disk in (channel_id, name) order, a chunk at a time, for exports. reads what bot_store has flushed
+def iter_reminders(chunk_size: int):
+    cursor = read_conn().cursor()
+    cursor.execute(f"SELECT {REMINDER_COLUMNS} FROM reminders ORDER BY channel_id, name")
+    while len(rows := cursor.fetchmany(chunk_size)) > 0:
+        yield from rows
+
+#rows are (kind, guild_id, data). one transaction per call
+def add_pending_imports(rows: list[tuple[int, int|None, str]]):
+    with write_conn() as write:
+        cursor = write.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+
+        cursor.executemany("""
+            INSERT INTO pending_imports (kind, guild_id, data) VALUES (?, ?, ?)
+        """, rows)
+
+#(id, kind, data) of the oldest staged rows belonging to shard_ids
+def get_pending_imports(limit: int, shard_count: int = 1, shard_ids: list[int]|None = None) -> list[tuple[int, int, str]]:
+    with read_conn() as read:
+        cursor = read.cursor()
+
+        cursor.execute(f"""
+            SELECT id, kind, data FROM pending_imports
+            WHERE {shard_condition(shard_ids)}
+            ORDER BY id
+            LIMIT ?
+        """, (*shard_parameters(shard_count, shard_ids), limit))
         return cursor.fetchall()
 
+def delete_pending_imports(ids: list[int]):
+    with write_conn() as write:
+        cursor = write.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+
+        cursor.executemany("""
+            DELETE FROM pending_imports WHERE id = ?
+        """, [(pending_id,) for pending_id in ids])
+
 # def update_reminders(now: datetime):
 #     now_timestamp = now.timestamp()
 #     cursor.execute("""
@@ -204,43 +644,3 @@ def get_due_reminders(now: datetime) -> list[tuple[str, int, int|None, int, int,
 #             WHERE name = ? AND channel_id = ?;
 #         """, (next_time.timestamp(), new_repeat_interval_count, name, channel_id))
 #         conn.commit()
-
-def update_reminder(name: str, channel_id: int, now: datetime):
-    with conn:
-        cursor = conn.cursor()
-        cursor.execute("BEGIN IMMEDIATE")
-
-        now_timestamp = now.timestamp()
-
-        cursor.execute("""
-            SELECT name, channel_id, setter_user_id, start_timestamp, 
-                repeat_interval_index, repeat_interval_increment, repeat_increment_count
-            FROM reminders 
-            WHERE name == ? AND channel_id == ? AND next_timestamp <= ? AND has_repeat
-        """, (name, channel_id, now_timestamp))
-        repeating_reminder = cursor.fetchone()
-
-        if repeating_reminder is not None:
-            (name, channel_id, setter_user_id, start_timestamp, 
-                repeat_interval_index, repeat_interval_increment, repeat_increment_count) = repeating_reminder
-            new_repeat_interval_count = repeat_increment_count + 1
-
-            cursor.execute("""
-                SELECT timezone FROM users WHERE id = ?
-            """, (setter_user_id,))
-            timezone_row = cursor.fetchone()
-            timezone_string = timezone_row[0] if timezone_row is not None else 'UTC'
-            timezone = ZoneInfo(timezone_string)
-
-            start_time = datetime.fromtimestamp(start_timestamp, timezone)
-            next_time = bt.TIME_INTERVAL_FUNCTIONS[repeat_interval_index](start_time, repeat_interval_increment * new_repeat_interval_count)
-
-            cursor.execute("""
-                UPDATE reminders
-                SET next_timestamp = ?, repeat_increment_count = ?
-                WHERE name = ? AND channel_id = ?;
-            """, (next_time.timestamp(), new_repeat_interval_count, name, channel_id))
-        else: #reminder must not have repeat, so delete it
-            cursor.execute("""
-                DELETE FROM reminders WHERE name == ? AND channel_id == ? AND next_timestamp <= ? AND NOT has_repeat
-            """, (name, channel_id, now_timestamp))
@@ -0,0 +1,129 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import functools
+from zoneinfo import ZoneInfo
+import bot_db as bd
+import bot_store as bst
+import bot_imports as bim
+import bot_blobs as bb
+import bot_log as bl
+import bot_metrics as bm
+
+#async versions of the bot_db and bot_store functions, so sqlite never blocks the discord event loop.
+#every write goes through one writer thread (sqlite only allows one writer at a time anyway),
+#and reads are served by a few threads with their own read-only connections
+READ_THREADS = 4
+
+writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="bot_db_writer")
+readers = ThreadPoolExecutor(max_workers=READ_THREADS, thread_name_prefix="bot_db_reader", initializer=bd.open_read_conn)
+
+#each call is timed on its thread, so time spent waiting for a free thread isn't counted
+async def run_write(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(writer, functools.partial(bm.timed, bm.DB_CALL_DURATION, func.__name__, func, *args))
+
+async def run_read(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(readers, functools.partial(bm.timed, bm.DB_CALL_DURATION, func.__name__, func, *args))
+
+#reminders are changed in memory on the writer thread (so they stay ordered with flushes and blob collection), and the
+#first change after a flush arms a timer that flushes everything changed in the meantime as one transaction
+flush_task: asyncio.Task|None = None
+
+def request_flush(delay: float = bst.JOURNAL_FLUSH_SECONDS):
+    global flush_task
+    if flush_task is None:
+        flush_task = asyncio.get_running_loop().create_task(flush_later(delay))
+
+async def flush_later(delay: float):
+    global flush_task
+    await asyncio.sleep(delay)
+    flush_task = None
+    try:
+        await run_write(bst.flush)
+    except Exception as e:
+        bl.log_err(e)
+        request_flush(bst.JOURNAL_RETRY_SECONDS)
+
+async def run_store_write(func, *args):
+    try:
+        return await run_write(func, *args)
+    finally:
+        if bst.has_pending():
+            request_flush()
+
+async def set_reminder(name: str, channel_id: int, reply_message_id: int|None, user_id: int,
+                       start_time: datetime, repeat_interval_index: int|None, repeat_interval_increment: int|None,
+                       missed_policy: int|None = None, snapshot: bb.MessageSnapshot|None = None, guild_id: int|None = None):
+    await run_store_write(bst.set_reminder, name, channel_id, reply_message_id, user_id, start_time, repeat_interval_index, repeat_interval_increment,
+                    missed_policy, snapshot, guild_id)
+
+async def remove_reminder(name: str, channel_id: int):
+    await run_store_write(bst.remove_reminder, name, channel_id)
+
+async def remove_all_reminders(channel_id: int):
+    await run_store_write(bst.remove_all_reminders, channel_id)
+
+async def remove_channels_reminders(channel_ids: list[int]):
+    await run_store_write(bst.remove_channels_reminders, channel_ids)
+
+async def remove_guild_reminders(guild_id: int):
+    await run_store_write(bst.remove_guild_reminders, guild_id)
+
+async def set_channel_guilds(channel_guilds: list[tuple[int, int]]):
+    await run_write(bst.set_channel_guilds, channel_guilds)
+
+#reminders are read straight from memory
+async def get_reminder_page(channel_id: int, cursor: tuple[int, str]|None, before: bool, limit: int) -> tuple[list[bst.Reminder], int, int]:
+    return bst.get_reminder_page(channel_id, cursor, before, limit)
+
+#one batch of what bot_admin staged, see bot_imports
+async def apply_pending_imports() -> tuple[int, int, int, bool]:
+    return await run_store_write(bim.apply_pending_imports)
+
+async def set_user_timezone(user_id: int, timezone: str):
+    await run_write(bd.set_user_timezone, user_id, timezone)
+
+async def get_user_timezone(user_id: int) -> str:
+    is_cached, zoneinfo = bd.get_cached_user_zoneinfo(user_id)
+    if not is_cached:
+        return await run_read(bd.get_user_timezone, user_id)
+    if zoneinfo is None:
+        raise bd.UserNotInDatabaseError("User doesn't have a set timezone")
+    return zoneinfo.key
+
+#cache hits are answered without leaving the event loop
+async def get_user_zoneinfo(user_id: int) -> ZoneInfo|None:
+    is_cached, zoneinfo = bd.get_cached_user_zoneinfo(user_id)
+    if is_cached:
+        return zoneinfo
+    return await run_read(bd.get_user_zoneinfo, user_id)
+
+async def remove_user_timezone(user_id: int):
+    await run_write(bd.remove_user_timezone, user_id)
+
+async def get_reminder(name: str, channel_id: int) -> bst.Reminder|None:
+    return bst.get_reminder(name, channel_id)
+
+async def get_reminders(keys: list[tuple[str, int]]) -> list[bst.Reminder]:
+    return bst.get_reminders(keys)
+
+async def claim_reminders(keys: list[tuple[str, int]], now: datetime) -> tuple[list[bst.Delivery], int]:
+    return await run_store_write(bst.claim_reminders, keys, now)
+
+async def set_batch_nonces(batch_nonces: list[tuple[bst.Delivery, str]]):
+    await run_store_write(bst.set_batch_nonces, batch_nonces)
+
+async def finish_deliveries(results: list[tuple[bst.Delivery, bool]]) -> int:
+    return await run_store_write(bst.finish_deliveries, results)
+
+async def prune_deliveries() -> int:
+    return await run_write(bst.prune_deliveries)
+
+async def get_message_snapshot(name: str, channel_id: int) -> bb.MessageSnapshot|None:
+    is_pending, snapshot = bst.get_pending_snapshot(name, channel_id)
+    if is_pending:
+        return snapshot
+    return await run_read(bd.get_message_snapshot, name, channel_id)
+
+async def collect_blobs() -> int:
+    return await run_write(bst.collect_blobs)
@@ -0,0 +1,369 @@
+import asyncio
+from collections import OrderedDict
+from datetime import datetime
+import hashlib
+import json
+import secrets
+import time
+import discord
+import bot_store as bst
+import bot_db_async as bda
+import bot_scheduler as bs
+import bot_response as br
+import bot_log as bl
+import bot_metrics as bm
+
+#how many channels are delivered to at the same time. reminders in one channel are always sent one after another,
+#in the order they were due, so each channel's rate limit bucket only ever has one request waiting on it.
+#discord.py already waits out 429s per bucket, this just keeps a big tick from piling onto the global limit
+MAX_CONCURRENT_CHANNELS = 16
+RETRY_DELAY_SECONDS = 5 #for claiming again after an error, failed sends are retried by the outbox (bot_store.DELIVERY_RETRY_SECONDS)
+
+#channels the gateway doesn't have cached (mostly dms) are fetched once and kept in a small lru.
+#channels that turned out to be deleted or inaccessible are remembered for a while so they aren't fetched again
+CHANNEL_CACHE_SIZE = 1024
+DEAD_CHANNEL_SECONDS = 60 * 60
+UNKNOWN_CHANNEL_ERROR_CODE = 10003
+UNKNOWN_MESSAGE_ERROR_CODE = 10008
+
+fetched_channels: OrderedDict[int, discord.abc.Messageable] = OrderedDict()
+dead_channels: dict[int, float] = {} #channel_id -> time.monotonic() when it can be fetched again
+
+def forget_channel(channel_id: int):
+    fetched_channels.pop(channel_id, None)
+    if len(dead_channels) >= CHANNEL_CACHE_SIZE:
+        now = time.monotonic()
+        for dead_channel_id in [c for c, expiry in dead_channels.items() if expiry <= now]:
+            del dead_channels[dead_channel_id]
+    dead_channels[channel_id] = time.monotonic() + DEAD_CHANNEL_SECONDS
+
+#returns None if the channel was deleted or the bot can't access it anymore
+async def resolve_channel(client: discord.Client, channel_id: int) -> discord.abc.Messageable|None:
+    channel = client.get_channel(channel_id)
+    if channel is not None:
+        return channel # type: ignore any channel in the database must be messageable
+
+    channel = fetched_channels.get(channel_id)
+    if channel is not None:
+        fetched_channels.move_to_end(channel_id)
+        return channel
+
+    expiry = dead_channels.get(channel_id)
+    if expiry is not None and expiry > time.monotonic():
+        return None
+
+    try:
+        channel = await client.fetch_channel(channel_id)
+    except (discord.NotFound, discord.Forbidden):
+        forget_channel(channel_id)
+        return None
+
+    dead_channels.pop(channel_id, None)
+    fetched_channels[channel_id] = channel # type: ignore
+    if len(fetched_channels) > CHANNEL_CACHE_SIZE:
+        fetched_channels.popitem(last=False)
+    return channel # type: ignore
+
+async def copy_message(message):
+    message_files = [await attachment.to_file() for attachment in message.attachments]
+
+    return {
+        'content' : message.content,
+        'tts' : message.tts,
+        'embed' : message.embeds[0] if len(message.embeds) == 1 else None,
+        'embeds' : message.embeds if len(message.embeds) > 1 else None,
+        'file' : message_files[0] if len(message_files) == 1 else None,
+        'files' : message_files if len(message_files) > 1 else None,
+        'stickers' : message.stickers,
+        'reference' : message.reference,
+        'suppress_embeds' : len(message.embeds) == 0,
+        'poll' : message.poll
+    }
+
+#all the reminders due in a channel in one tick are sent as one message with one embed each, and everyone to remind
+#is mentioned in that message's content (allowed_mentions makes sure nothing else pings), so there is no ghost ping to delete.
+#discord allows at most 10 embeds and 6000 embed characters per message, bigger batches are split up
+MAX_EMBEDS_PER_MESSAGE = 10
+MAX_EMBED_CHARS_PER_MESSAGE = 6000
+REMINDER_ALLOWED_MENTIONS = discord.AllowedMentions(everyone=False, users=True, roles=False, replied_user=False)
+
+class TickStats:
+    def __init__(self):
+        self.due = 0
+        self.delivered = 0
+        self.failed = 0
+        self.given_up = 0
+        self.channels = 0
+        self.dead_channels = 0
+        self.api_calls = 0
+        self.duration = 0.0
+        self.last_lateness = 0.0 #seconds between the last delivered reminder being due and it being sent
+
+    def __str__(self) -> str:
+        throughput = self.delivered / self.duration if self.duration > 0 else 0.0
+        return (f"Delivered {self.delivered}/{self.due} reminders to {self.channels} channels in {self.duration:.3f}s " +
+                f"({throughput:.1f}/s, {self.api_calls} api calls, {self.failed} failed, {self.given_up} given up, " +
+                f"{self.dead_channels} dead channels, last was {self.last_lateness:.3f}s late).")
+
+last_tick = TickStats()
+tick_started: float|None = None #time.monotonic() when the running tick started, None between ticks
+
+def make_reminder_embed(reminder: bst.Reminder) -> discord.Embed:
+    return br.Response(
+        title=f"Reminder: {reminder.name}",
+        txt=f"<@!{reminder.setter_user_id}>"
+    ).make_embed()
+
+#discord drops a message whose nonce it already got from the bot in the last few minutes, so a delivery that is sent again
+#after a crash (before it was recorded as sent) doesn't show up twice. nonces are at most 25 characters.
+#a message of reminders gets a new nonce, which is stored with its deliveries before it is sent (bot_store.set_batch_nonces),
+#so sending them again sends the same message with the same nonce however the outbox looks by then
+def make_batch_nonce() -> str:
+    return secrets.token_hex(12)
+
+#a custom message only ever has one delivery, so its nonce is derived from it
+def make_message_nonce(delivery: bst.Delivery) -> str:
+    return hashlib.blake2b(f"{delivery.channel_id}\0{delivery.name}\0{delivery.repeat_increment_count}\0{delivery.due_timestamp}".encode(),
+                           digest_size=12).hexdigest()
+
+#discord only drops a message whose nonce it has seen when the request asks it to, which discord.py has no option for.
+#every message is sent with a nonce (discord.py makes up one if it isn't given), so every request asks
+def enforce_nonces(http: discord.http.HTTPClient):
+    send_message = http.send_message
+
+    def send_message_enforcing_nonce(channel_id: int, *, params: discord.http.MultipartParameters):
+        if params.payload is not None:
+            params.payload['enforce_nonce'] = True
+        elif len(params.multipart) > 0 and params.multipart[0]['name'] == 'payload_json': #sent with files
+            payload = json.loads(params.multipart[0]['value'])
+            payload['enforce_nonce'] = True
+            params.multipart[0]['value'] = json.dumps(payload)
+        return send_message(channel_id, params=params)
+    http.send_message = send_message_enforcing_nonce
+
+#splits a channel's deliveries into messages that fit discord's embed limits, keeping their order
+def compose_batches(deliveries: list[tuple[bst.Delivery, bst.Reminder]]) -> list[list[tuple[bst.Delivery, bst.Reminder, discord.Embed]]]:
+    batches = []
+    batch = []
+    batch_chars = 0
+    for delivery, reminder in deliveries:
+        embed = make_reminder_embed(reminder)
+        if len(batch) > 0 and (len(batch) >= MAX_EMBEDS_PER_MESSAGE or batch_chars + len(embed) > MAX_EMBED_CHARS_PER_MESSAGE):
+            batches.append(batch)
+            batch = []
+            batch_chars = 0
+        batch.append((delivery, reminder, embed))
+        batch_chars += len(embed)
+    if len(batch) > 0:
+        batches.append(batch)
+    return batches
+
+#a message of reminders, and its nonce
+ReminderBatch = tuple[str, list[tuple[bst.Delivery, bst.Reminder, discord.Embed]]]
+
+#the messages a channel's deliveries are sent in, in the order they were due. deliveries that were put in a message before
+#(and may have been sent in it) go out in that message again, and are never mixed with the rest, which are split into
+#new messages. returns the messages, and the nonces of the new ones that have to be stored before they are sent
+def make_channel_batches(deliveries: list[tuple[bst.Delivery, bst.Reminder]]) -> tuple[list[ReminderBatch], list[tuple[bst.Delivery, str]]]:
+    earlier: dict[str, list[tuple[bst.Delivery, bst.Reminder, discord.Embed]]] = {}
+    new = []
+    for delivery, reminder in deliveries:
+        if delivery.batch_nonce is not None:
+            earlier.setdefault(delivery.batch_nonce, []).append((delivery, reminder, make_reminder_embed(reminder)))
+        else:
+            new.append((delivery, reminder))
+
+    batches = list(earlier.items())
+    batch_nonces = []
+    for batch in compose_batches(new):
+        batch_nonce = make_batch_nonce()
+        batches.append((batch_nonce, batch))
+        batch_nonces += [(delivery, batch_nonce) for delivery, _, _ in batch]
+    batches.sort(key=lambda batch: (batch[1][0][0].due_timestamp, batch[1][0][0].name))
+    return (batches, batch_nonces)
+
+async def send_reminder_batch(channel: discord.abc.Messageable, batch_nonce: str, batch: list[tuple[bst.Delivery, bst.Reminder, discord.Embed]],
+                              stats: TickStats):
+    mentions = " ".join(dict.fromkeys([f"<@{reminder.setter_user_id}>" for _, reminder, _ in batch])) #each user once, in order
+    stats.api_calls += 1
+    await channel.send(content=mentions, embeds=[embed for _, _, embed in batch], allowed_mentions=REMINDER_ALLOWED_MENTIONS,
+                       nonce=batch_nonce)
+
+async def send_custom_message(channel: discord.abc.Messageable, delivery: bst.Delivery, reminder: bst.Reminder, stats: TickStats):
+    name, channel_id, reply_message_id = reminder.name, reminder.channel_id, reminder.reply_message_id
+    if reply_message_id is None:
+        return
+
+    reply_errs = []
+    reply_message = None
+    snapshot = await bda.get_message_snapshot(name, channel_id)
+    if snapshot is None: #set before custom messages were snapshotted
+        try:
+            stats.api_calls += 1
+            reply_message = await channel.fetch_message(reply_message_id)
+        except discord.NotFound as e:
+            if e.code != UNKNOWN_MESSAGE_ERROR_CODE: #the channel is gone, handled by deliver_channel
+                raise
+            reply_errs.append("The custom message for this reminder was deleted.")
+
+    if snapshot is not None or reply_message is not None:
+        try:
+            stats.api_calls += 1
+            await channel.send(**(snapshot.make_send_kwargs() if snapshot is not None else await copy_message(reply_message)),
+                               nonce=make_message_nonce(delivery))
+        except (discord.HTTPException, OSError) as e:
+            reply_errs.append("The custom message for this reminder cannot be copied.")
+
+    if len(reply_errs) > 0:
+        reply_err_msg = br.Response(
+            is_error=True,
+            title=f"Custom Message Failed for {name}:",
+            txt=f"{" ".join(reply_errs)}"
+        )
+        stats.api_calls += 1
+        await channel.send(embed=reply_err_msg.make_embed())
+
+#sends one channel's messages in order. returns (delivery, whether it was sent) for each delivery in them,
+#or None if the channel is gone and all its reminders should be removed
+async def deliver_channel(client: discord.Client, channel_id: int, batches: list[ReminderBatch],
+                          semaphore: asyncio.Semaphore, stats: TickStats) -> list[tuple[bst.Delivery, bool]]|None:
+    results = []
+    async with semaphore:
+        channel = await resolve_channel(client, channel_id)
+        if channel is None:
+            return None
+
+        for batch_nonce, batch in batches:
+            try:
+                await send_reminder_batch(channel, batch_nonce, batch, stats)
+            except Exception as e:
+                if isinstance(e, discord.NotFound) and e.code == UNKNOWN_CHANNEL_ERROR_CODE:
+                    forget_channel(channel_id) #deleted after it was cached
+                    return None
+                bl.log_err(e, channel_id=channel_id, reminders=[reminder.name for _, reminder, _ in batch]) #for truly odd errors
+                results += [(delivery, False) for delivery, _, _ in batch]
+                stats.failed += len(batch)
+                continue
+
+            for delivery, reminder, _ in batch:
+                results.append((delivery, True))
+                stats.delivered += 1
+                stats.last_lateness = time.time() - delivery.due_timestamp
+                bm.FIRING_LATENESS.observe(stats.last_lateness)
+                try:
+                    await send_custom_message(channel, delivery, reminder, stats)
+                except Exception as e:
+                    if isinstance(e, discord.NotFound) and e.code == UNKNOWN_CHANNEL_ERROR_CODE:
+                        forget_channel(channel_id) #deleted while its reminders were being sent
+                        return None
+                    bl.log_err(e, channel_id=channel_id, reminder=reminder.name) #the reminder itself was sent, so it still counts as delivered
+    return results
+
+#delivery is split in two stages around the outbox (see bot_store.claim_reminders). the scheduler hands due reminders to
+#claim_due, which claims and advances them in one transaction, and drain_forever sends whatever has been claimed, so the
+#scheduler can claim the next reminders while earlier ones are still being sent. every send is recorded in the outbox,
+#so a restart resends exactly the deliveries that weren't recorded as finished
+outbox_event: asyncio.Event|None = None #set when there may be something to send
+
+def wake_outbox():
+    if outbox_event is not None:
+        outbox_event.set()
+
+#called by the scheduler with the keys of every due reminder.
+#a repeating reminder that is still due after being advanced is handed back by the scheduler straight away
+async def claim_due(due: list[tuple[str, int]]):
+    try:
+        await bda.claim_reminders(due, datetime.now())
+    except Exception as e:
+        bl.log_err(e)
+        for reminder in await bda.get_reminders(due): #tried again later, reminders claimed before the error are skipped then
+            bs.scheduler.set(reminder.name, reminder.channel_id, max(reminder.next_timestamp, int(time.time()) + RETRY_DELAY_SECONDS))
+    wake_outbox()
+
+#sends every delivery that is ready as one tick: channels are delivered to concurrently, and how each delivery went is
+#recorded at the end. returns whether there was anything to send
+async def deliver_ready(client: discord.Client) -> bool:
+    global tick_started
+    ready = bst.take_ready_deliveries(time.time())
+    if len(ready) == 0:
+        return False
+    tick_started = time.monotonic()
+    try:
+        await deliver_tick(client, ready)
+    finally:
+        tick_started = None
+        released = bst.release_deliveries(ready) #none, unless the tick failed before finishing them
+        if released > 0:
+            bl.log_info(f"Released {released} deliveries that weren't finished, they will be sent again.")
+    return True
+
+async def deliver_tick(client: discord.Client, ready: list[tuple[bst.Delivery, bst.Reminder]]):
+    global last_tick
+    started = time.perf_counter()
+    stats = TickStats()
+
+    channel_deliveries: dict[int, list[tuple[bst.Delivery, bst.Reminder]]] = {}
+    for delivery, reminder in ready: #already in the order they were due
+        channel_deliveries.setdefault(delivery.channel_id, []).append((delivery, reminder))
+    stats.due = len(ready)
+    stats.channels = len(channel_deliveries)
+
+    channel_batches: dict[int, list[ReminderBatch]] = {}
+    batch_nonces = []
+    for channel_id, deliveries in channel_deliveries.items():
+        channel_batches[channel_id], new_batch_nonces = make_channel_batches(deliveries)
+        batch_nonces += new_batch_nonces
+    if len(batch_nonces) > 0:
+        await bda.set_batch_nonces(batch_nonces) #on disk before anything is sent with them
+
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_CHANNELS)
+    channel_ids = list(channel_deliveries.keys())
+    channel_results = await asyncio.gather(*[deliver_channel(client, channel_id, channel_batches[channel_id], semaphore, stats)
+                                             for channel_id in channel_ids], return_exceptions=True)
+    results = []
+    dead_channel_ids = []
+    for channel_id, channel_result in zip(channel_ids, channel_results):
+        if isinstance(channel_result, BaseException):
+            bl.log_err(channel_result, channel_id=channel_id) # type: ignore logged like any other error
+            stats.failed += len(channel_deliveries[channel_id])
+        elif channel_result is None:
+            dead_channel_ids.append(channel_id)
+        if not isinstance(channel_result, list): #failed, or gone (if purging fails they're tried again)
+            channel_result = [(delivery, False) for delivery, _ in channel_deliveries[channel_id]]
+        results += channel_result
+    stats.dead_channels = len(dead_channel_ids)
+
+    try:
+        await bda.remove_channels_reminders(dead_channel_ids) #reminders no longer applicable
+    except Exception as e:
+        bl.log_err(e, channel_ids=dead_channel_ids)
+    stats.given_up = await bda.finish_deliveries(results)
+
+    stats.duration = time.perf_counter() - started
+    last_tick = stats
+    bm.TICK_DURATION.observe(stats.duration)
+    bm.TICK_API_CALLS.set(stats.api_calls)
+    bl.log_info(str(stats), due=stats.due, delivered=stats.delivered, failed=stats.failed, duration=round(stats.duration, 6))
+
+#sends claimed deliveries as soon as they're on disk, and failed ones again once their retry time comes
+async def drain_forever(client: discord.Client):
+    global outbox_event
+    outbox_event = asyncio.Event()
+    while True:
+        outbox_event.clear()
+        try:
+            if await deliver_ready(client):
+                continue
+        except Exception as e:
+            bl.log_err(e)
+
+        try:
+            await asyncio.wait_for(outbox_event.wait(), bst.time_until_ready(time.time()))
+        except TimeoutError:
+            pass
+
+#claims and sends due reminders start to finish, for benchmarks and tests
+async def deliver_reminders(client: discord.Client, due: list[tuple[str, int]]):
+    await claim_due(due)
+    while await deliver_ready(client):
+        pass
@@ -0,0 +1,164 @@
+import asyncio
+import io
+import random
+import time
+import discord
+
+#a local stand-in for the parts of discord the bot uses (see bot_load for the driver). every rest call waits a configurable
+#latency, and can be made to hit a rate limit (waited out and retried, like discord.py does) or to fail with NotFound
+UNKNOWN_CHANNEL_ERROR_CODE = 10003
+UNKNOWN_MESSAGE_ERROR_CODE = 10008
+
+class FakeConfig:
+    def __init__(self, latency: float = 0.05, jitter: float = 0.02, rate_limit_rate: float = 0.0, retry_after: float = 1.0,
+                 not_found_rate: float = 0.0, seed: int = 1):
+        self.latency = latency #seconds every rest call takes
+        self.jitter = jitter #plus up to this much, uniformly
+        self.rate_limit_rate = rate_limit_rate #fraction of calls that get a 429 first
+        self.retry_after = retry_after
+        self.not_found_rate = not_found_rate #fraction of calls that fail with NotFound
+        self.seed = seed
+
+class FakeStats:
+    def __init__(self):
+        self.api_calls = 0
+        self.rate_limits = 0
+        self.not_founds = 0
+
+#discord.HTTPException only needs these from the http response
+class FakeResponse:
+    def __init__(self, status: int, reason: str):
+        self.status = status
+        self.reason = reason
+
+class FakeHttp:
+    def __init__(self, config: FakeConfig):
+        self.config = config
+        self.stats = FakeStats()
+        self.random = random.Random(config.seed)
+
+    async def request(self, not_found_code: int):
+        self.stats.api_calls += 1
+        await asyncio.sleep(self.config.latency + self.random.uniform(0, self.config.jitter))
+        if self.random.random() < self.config.rate_limit_rate:
+            self.stats.rate_limits += 1
+            await asyncio.sleep(self.config.retry_after)
+            await asyncio.sleep(self.config.latency + self.random.uniform(0, self.config.jitter))
+        if self.random.random() < self.config.not_found_rate:
+            self.stats.not_founds += 1
+            raise discord.NotFound(FakeResponse(404, "Not Found"), {'code' : not_found_code, 'message' : "Injected NotFound"}) # type: ignore
+
+class FakeUser:
+    def __init__(self, id: int, name: str):
+        self.id = id
+        self.name = name
+        self.mention = f"<@{id}>"
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, FakeUser) and other.id == self.id
+
+    def __hash__(self) -> int:
+        return hash(self.id)
+
+class FakeGuild:
+    def __init__(self, id: int):
+        self.id = id
+
+class FakeAttachment:
+    def __init__(self, filename: str, data: bytes, description: str|None = None, spoiler: bool = False):
+        self.filename = filename
+        self.data = data
+        self.description = description
+        self.spoiler = spoiler
+        self.url = f"https://fake.invalid/attachments/{filename}"
+        self.size = len(data)
+
+    def is_spoiler(self) -> bool:
+        return self.spoiler
+
+    async def to_file(self) -> discord.File:
+        return discord.File(io.BytesIO(self.data), filename=self.filename, spoiler=self.spoiler, description=self.description)
+
+class FakeMessage:
+    def __init__(self, id: int, channel: 'FakeTextChannel', author: FakeUser, content: str = "", embeds: list[discord.Embed]|None = None,
+                 attachments: list[FakeAttachment]|None = None, reference: discord.MessageReference|None = None):
+        self.id = id
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.content = content
+        self.embeds = embeds if embeds is not None else []
+        self.attachments = attachments if attachments is not None else []
+        self.reference = reference
+        self.tts = False
+        self.stickers = []
+        self.poll = None
+        self.created_at = time.time()
+
+    async def delete(self):
+        await self.channel.client.http.request(UNKNOWN_MESSAGE_ERROR_CODE)
+        self.channel.messages.pop(self.id, None)
+
+class FakeTextChannel:
+    def __init__(self, client: 'FakeClient', id: int, guild: FakeGuild|None):
+        self.client = client
+        self.id = id
+        self.guild = guild
+        self.messages: dict[int, FakeMessage] = {}
+        self.listeners = [] #called with every message the bot sends here
+
+    def permissions_for(self, member: FakeUser) -> discord.Permissions:
+        return discord.Permissions.all()
+
+    #what the bot sends. keyword arguments are the ones channel.send takes
+    async def send(self, content: str|None = None, *, embed: discord.Embed|None = None, embeds: list[discord.Embed]|None = None,
+                   **kwargs) -> FakeMessage:
+        await self.client.http.request(UNKNOWN_CHANNEL_ERROR_CODE)
+        message = FakeMessage(self.client.next_id(), self, self.client.user, content if content is not None else "",
+                              embeds if embeds is not None else [embed] if embed is not None else [])
+        self.messages[message.id] = message
+        for listener in self.listeners:
+            listener(message)
+        return message
+
+    async def fetch_message(self, id: int) -> FakeMessage:
+        await self.client.http.request(UNKNOWN_MESSAGE_ERROR_CODE)
+        message = self.messages.get(id)
+        if message is None:
+            raise discord.NotFound(FakeResponse(404, "Not Found"), {'code' : UNKNOWN_MESSAGE_ERROR_CODE, 'message' : "Unknown Message"}) # type: ignore
+        return message
+
+    #a message from a simulated user, as the gateway would deliver it
+    def receive(self, author: FakeUser, content: str, reference: discord.MessageReference|None = None) -> FakeMessage:
+        message = FakeMessage(self.client.next_id(), self, author, content, reference=reference)
+        self.messages[message.id] = message
+        return message
+
+class FakeClient:
+    def __init__(self, config: FakeConfig):
+        self.http = FakeHttp(config)
+        self.user = FakeUser(1, "RemindBot")
+        self.channels: dict[int, FakeTextChannel] = {}
+        self.cached_channel_ids: set[int] = set() #channels get_channel knows about, the rest have to be fetched
+        self.last_id = 1 << 22
+
+    def next_id(self) -> int:
+        self.last_id += 1
+        return self.last_id
+
+    def add_channel(self, id: int, guild: FakeGuild|None, cached: bool = True) -> FakeTextChannel:
+        channel = FakeTextChannel(self, id, guild)
+        self.channels[id] = channel
+        if cached:
+            self.cached_channel_ids.add(id)
+        return channel
+
+    def get_channel(self, id: int) -> FakeTextChannel|None:
+        return self.channels.get(id) if id in self.cached_channel_ids else None
+
+    async def fetch_channel(self, id: int) -> FakeTextChannel:
+        await self.http.request(UNKNOWN_CHANNEL_ERROR_CODE)
+        channel = self.channels.get(id)
+        if channel is None:
+            raise discord.NotFound(FakeResponse(404, "Not Found"), {'code' : UNKNOWN_CHANNEL_ERROR_CODE, 'message' : "Unknown Channel"}) # type: ignore
+        return channel
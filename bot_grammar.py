@@ -0,0 +1,136 @@
+import functools
+import re
+import bot_timing as bt
+
+#the command language, parsed in one pass into plain objects. nothing here depends on the clock or a user's timezone,
+#so time and repeat expressions are memoized (the same few like "1 day" or "9am" make up most commands);
+#bot_io resolves them against the current time
+PARSE_CACHE_SIZE = 4096
+
+COMMAND_RE = re.compile(r"\s*(\S+)\s*(.*)", re.DOTALL) #whitespace between the prefix and the name is allowed, like "!! help"
+
+class CommandNode:
+    __slots__ = ('name', 'args')
+
+    def __init__(self, name: str, args: str):
+        self.name = name #as typed, so not necessarily lowercase
+        self.args = args #everything after the name, without the whitespace in between
+
+#None if input isn't a command at all, which is the case for almost every message, so that is checked first
+def parse_command(input: str, prefix: str) -> CommandNode|None:
+    if not input.startswith(prefix):
+        return None
+    m = COMMAND_RE.match(input, len(prefix))
+    if m is None:
+        return None
+    return CommandNode(m[1], m[2])
+
+class InvalidTimeDurationStringError(Exception):
+    pass
+
+DURATION_RE = re.compile(r"\s*(\d+)\s*(mi|ho|da|we|mo|ye)\w*\s*", re.IGNORECASE)
+
+#(time_interval_index, n (like in n_months_later))
+@functools.lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_duration(duration_str: str) -> tuple[int, int]:
+    m = DURATION_RE.fullmatch(duration_str)
+    if m is None:
+        raise InvalidTimeDurationStringError("Failed to parse time duration string.")
+    return (bt.TIME_INTERVAL_ABBREVIATIONS_INV[m[2].lower()], int(m[1]))
+
+class InvalidRepeatStringError(Exception):
+    pass
+class ZeroRepeatTimeError(Exception):
+    pass
+
+@functools.lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_repeat(repeat_str: str) -> tuple[int, int]:
+    try:
+        time_interval_index, n = parse_duration(repeat_str)
+    except InvalidTimeDurationStringError:
+        raise InvalidRepeatStringError("Failed to parse repeat string.")
+    if n == 0:
+        raise ZeroRepeatTimeError("Repeat time is 0.")
+    return (time_interval_index, n)
+
+class RelativeTime:
+    __slots__ = ('interval_index', 'n')
+
+    def __init__(self, interval_index: int, n: int):
+        self.interval_index = interval_index
+        self.n = n
+
+#any part that wasn't given is None. hour and minute aren't range checked yet
+class AbsoluteTime:
+    __slots__ = ('day', 'month', 'year', 'hour', 'minute', 'ampm')
+
+    def __init__(self, day: int|None, month: int|None, year: int|None, hour: int, minute: int|None, ampm: str|None):
+        self.day = day
+        self.month = month #1-indexed, like datetime
+        self.year = year
+        self.hour = hour
+        self.minute = minute
+        self.ampm = ampm #'am', 'pm' or None for 24 hour time
+
+class InvalidStartTimeStringError(Exception):
+    pass
+
+#a relative time ("5 min") or an absolute one ("5 mar 2026 9:30 pm"), in one match
+TIME_RE = re.compile(
+    r"\s*(?:"
+    r"(?P<n>\d+)\s*(?P<unit>mi|ho|da|we|mo|ye)\w*"
+    r"|(?:(?P<day>\d+)\s*(?P<month>jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)\w*\s*(?P<year>\d\d\d\d)?)?"
+    r"\s*(?P<hour>\d?\d)\s*(?::\s*(?P<minute>\d\d))?\s*(?P<ampm>[ap]m)?"
+    r")\s*",
+    re.IGNORECASE
+)
+
+@functools.lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_time(time_str: str) -> RelativeTime|AbsoluteTime:
+    m = TIME_RE.fullmatch(time_str)
+    if m is None:
+        raise InvalidStartTimeStringError("Failed to parse start time string (format of start time given is invalid).")
+    if m['unit'] is not None:
+        return RelativeTime(bt.TIME_INTERVAL_ABBREVIATIONS_INV[m['unit'].lower()], int(m['n']))
+    return AbsoluteTime(
+        int(m['day']) if m['day'] is not None else None,
+        bt.MONTH_ABBRS_INV[m['month'].lower()] + 1 if m['month'] is not None else None,
+        int(m['year']) if m['year'] is not None else None,
+        int(m['hour']),
+        int(m['minute']) if m['minute'] is not None else None,
+        m['ampm'].lower() if m['ampm'] is not None else None
+    )
+
+START_TIME_ARG = "time:"
+REPEAT_ARG = "repeat:"
+MISSED_ARG = "missed:"
+SET_REMINDER_ARG_RE = re.compile(f"({"|".join(re.escape(arg) for arg in [START_TIME_ARG, REPEAT_ARG, MISSED_ARG])})", re.IGNORECASE)
+
+class SetReminderArgs:
+    __slots__ = ('name', 'start', 'repeat', 'missed')
+
+    def __init__(self, name: str, start: RelativeTime|AbsoluteTime|None, repeat: tuple[int, int]|None, missed: str|None):
+        self.name = name
+        self.start = start
+        self.repeat = repeat #(time_interval_index, n)
+        self.missed = missed #policy name as typed
+
+class DuplicateArgumentError(Exception):
+    pass
+
+#[name] time: [time] repeat: [repeat] missed: [missed policy], with the arguments optional and in any order
+def parse_set_reminder_args(args_str: str) -> SetReminderArgs:
+    parts = SET_REMINDER_ARG_RE.split(args_str) #name, then alternating argument names and their text
+    args = {}
+    for i in range(1, len(parts), 2):
+        arg_name = parts[i].lower()
+        if arg_name in args:
+            raise DuplicateArgumentError(f"`{arg_name}` is given more than once.")
+        args[arg_name] = parts[i + 1]
+
+    return SetReminderArgs(
+        parts[0].strip(),
+        parse_time(args[START_TIME_ARG]) if START_TIME_ARG in args else None,
+        parse_repeat(args[REPEAT_ARG].strip()) if REPEAT_ARG in args else None,
+        args.get(MISSED_ARG)
+    )
@@ -0,0 +1,169 @@
+from datetime import datetime
+import json
+import bot_timing as bt
+import bot_db as bd
+import bot_store as bst
+import bot_shards as bsh
+
+#bulk imports of reminders and user timezones. bot_admin validates records and stages them in the pending_imports table,
+#and the bot applies staged rows to its store in batches, whether it was running during the import or starts later.
+#applying is idempotent: reminders whose name is already taken in their channel are skipped, and rows are only deleted
+#once what they added has been flushed
+IMPORT_REMINDER = 0
+IMPORT_USER = 1
+APPLY_BATCH_SIZE = 5000
+APPLY_POLL_SECONDS = 5
+MAX_NAME_LENGTH = 64
+
+#fields of an exported or imported record, in bd.ReminderRow order
+REMINDER_FIELDS = ["name", "channel_id", "guild_id", "reply_message_id", "setter_user_id", "start_timestamp", "next_timestamp",
+                   "has_repeat", "repeat_interval_index", "repeat_interval_increment", "repeat_increment_count", "missed_policy"]
+USER_FIELDS = ["id", "timezone"]
+
+class InvalidRecordError(Exception):
+    pass
+class StoreFullError(Exception):
+    pass
+
+#None for a missing field, a json null or an empty csv cell
+def get_field(record: dict, field: str) -> object:
+    value = record.get(field)
+    return None if value == "" else value
+
+#json records have numbers, csv records have strings, and snowflakes often come as strings in both
+def parse_int(value: object, field: str, minimum: int|None = None) -> int:
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise InvalidRecordError(f"{field} must be an integer")
+    try:
+        number = int(value)
+    except ValueError:
+        raise InvalidRecordError(f"{field} must be an integer, not {value!r}")
+    if minimum is not None and number < minimum:
+        raise InvalidRecordError(f"{field} must be at least {minimum}, not {number}")
+    return number
+
+def parse_required_int(record: dict, field: str, minimum: int|None = None) -> int:
+    value = get_field(record, field)
+    if value is None:
+        raise InvalidRecordError(f"{field} is missing")
+    return parse_int(value, field, minimum)
+
+def parse_optional_int(record: dict, field: str, minimum: int|None = None) -> int|None:
+    value = get_field(record, field)
+    return parse_int(value, field, minimum) if value is not None else None
+
+#an index into names, or one of the names (or abbreviations) themselves
+def parse_index(value: object, field: str, names: list[str], *names_invs: dict[str, int]) -> int:
+    if isinstance(value, str) and not value.lstrip("-").isdigit():
+        for names_inv in names_invs:
+            if value.lower() in names_inv:
+                return names_inv[value.lower()]
+        raise InvalidRecordError(f"{field} must be one of {", ".join(names)}, not {value!r}")
+    index = parse_int(value, field)
+    if not 0 <= index < len(names):
+        raise InvalidRecordError(f"{field} must be between 0 and {len(names) - 1}, not {index}")
+    return index
+
+def parse_timestamp(record: dict, field: str) -> int:
+    timestamp = parse_required_int(record, field)
+    try:
+        datetime.fromtimestamp(timestamp, bt.UTC)
+    except (OverflowError, ValueError, OSError):
+        raise InvalidRecordError(f"{field} {timestamp} is out of range")
+    return timestamp
+
+#a record with the REMINDER_FIELDS (only name, channel_id, setter_user_id and start_timestamp are required).
+#a reminder without next_timestamp is a new one, due at its start. intervals can be given by index or by name
+def parse_reminder(record: dict) -> bd.ReminderRow:
+    name = get_field(record, "name")
+    if not isinstance(name, str) or len(name) == 0:
+        raise InvalidRecordError("name is missing")
+    if len(name) > MAX_NAME_LENGTH:
+        raise InvalidRecordError(f"name is {len(name)} characters long, the most is {MAX_NAME_LENGTH}")
+
+    channel_id = parse_required_int(record, "channel_id", 1)
+    guild_id = parse_optional_int(record, "guild_id", 1)
+    reply_message_id = parse_optional_int(record, "reply_message_id", 1)
+    setter_user_id = parse_required_int(record, "setter_user_id", 1)
+    start_timestamp = parse_timestamp(record, "start_timestamp")
+    next_timestamp = parse_timestamp(record, "next_timestamp") if get_field(record, "next_timestamp") is not None else start_timestamp
+    if next_timestamp < start_timestamp:
+        raise InvalidRecordError("next_timestamp is before start_timestamp")
+
+    interval_value = get_field(record, "repeat_interval_index")
+    repeat_interval_index = (parse_index(interval_value, "repeat_interval_index", bt.TIME_INTERVAL_NAMES,
+                                         bt.TIME_INTERVAL_NAMES_INV, bt.TIME_INTERVAL_ABBREVIATIONS_INV)
+                             if interval_value is not None else None)
+    has_repeat = repeat_interval_index is not None
+    has_repeat_value = get_field(record, "has_repeat")
+    if has_repeat_value is not None and (has_repeat_value if isinstance(has_repeat_value, bool) else parse_int(has_repeat_value, "has_repeat")) != has_repeat:
+        raise InvalidRecordError("has_repeat doesn't match repeat_interval_index")
+
+    repeat_interval_increment = None
+    repeat_increment_count = 0
+    if has_repeat:
+        repeat_interval_increment = parse_required_int(record, "repeat_interval_increment", 1)
+        repeat_increment_count = parse_optional_int(record, "repeat_increment_count", 0) or 0
+        #the repeat after the current one has to be representable, or completing the reminder would fail
+        try:
+            bt.TIME_INTERVAL_FUNCTIONS[repeat_interval_index](datetime.fromtimestamp(start_timestamp, bt.UTC), # type: ignore has_repeat
+                                                              repeat_interval_increment * (repeat_increment_count + 1))
+        except (OverflowError, ValueError):
+            raise InvalidRecordError("repeats go past the largest time that can be represented")
+
+    missed_value = get_field(record, "missed_policy")
+    missed_policy = (parse_index(missed_value, "missed_policy", bt.MISSED_POLICY_NAMES, bt.MISSED_POLICY_NAMES_INV)
+                     if missed_value is not None else None)
+
+    return (name, channel_id, guild_id, reply_message_id, setter_user_id, start_timestamp, next_timestamp,
+            has_repeat, repeat_interval_index, repeat_interval_increment, repeat_increment_count, missed_policy)
+
+#a record with the USER_FIELDS. timezone names are matched like set_timezone matches them
+def parse_user(record: dict) -> tuple[int, str]:
+    user_id = parse_required_int(record, "id", 1)
+    timezone = get_field(record, "timezone")
+    if not isinstance(timezone, str):
+        raise InvalidRecordError("timezone is missing")
+    tz_name = bt.get_timezones_lowercase().get(timezone.lower())
+    if tz_name is None:
+        raise InvalidRecordError(f"{timezone!r} is not a valid timezone name")
+    return (user_id, tz_name)
+
+#reminders are staged with their guild, so every process only applies the reminders of its own shards.
+#users have no guild, so they are applied by the process running shard 0
+def make_pending_reminder(row: bd.ReminderRow) -> tuple[int, int|None, str]:
+    return (IMPORT_REMINDER, row[2], json.dumps(row))
+
+def make_pending_user(user: tuple[int, str]) -> tuple[int, int|None, str]:
+    return (IMPORT_USER, None, json.dumps(user))
+
+#applies one batch of staged rows. must run on the bot_db_async writer thread.
+#returns (rows applied, reminders added, timezones set, whether the store is full). fewer than APPLY_BATCH_SIZE rows applied
+#means there are none left, or that the rest are waiting for room in the store: once a reminder doesn't fit under
+#bot_store.MAX_REMINDERS, it and every row after it stay staged and are applied by a later batch.
+#other processes see the imported timezones within bot_db.TIMEZONE_CACHE_SECONDS
+def apply_pending_imports(limit: int = APPLY_BATCH_SIZE) -> tuple[int, int, int, bool]:
+    rows = bd.get_pending_imports(limit, bsh.shard_count, bsh.shard_ids)
+    if len(rows) == 0:
+        return (0, 0, 0, False)
+
+    new_reminders = [bst.Reminder(*json.loads(data)) for _, kind, data in rows if kind == IMPORT_REMINDER]
+    done, added = bst.import_reminders(new_reminders)
+    full = done < len(new_reminders)
+    if full:
+        rows = rows[:[i for i, (_, kind, _) in enumerate(rows) if kind == IMPORT_REMINDER][done]]
+    users = [tuple(json.loads(data)) for _, kind, data in rows if kind == IMPORT_USER]
+    bst.flush()
+    if len(users) > 0:
+        bd.set_user_timezones(users) # type: ignore always pairs
+    bd.delete_pending_imports([pending_id for pending_id, _, _ in rows])
+    return (len(rows), added, len(users), full)
+
+#logged while staged reminders are waiting for room. the message doesn't change, so bot_log only logs it every so often
+def make_store_full_error() -> StoreFullError:
+    return StoreFullError(f"The store has {bst.MAX_REMINDERS} reminders, imported reminders will be added once some are removed")
+
+def format_applied(rows: int, added: int, users: int, seconds: float) -> str:
+    skipped = rows - added - users
+    return (f"Imported {added} reminders{f" ({skipped} skipped, their names were taken)" if skipped > 0 else ""} and {users} timezones "
+            f"in {seconds:.2f}s ({rows / max(seconds, 1e-9):.0f} rows/s).")
@@ -1,42 +1,19 @@
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
-import re
 import calendar
+import time
 import discord
 import bot_timing as bt
-import bot_db as bd
+import bot_grammar as bg
+import bot_store as bst
+import bot_db_async as bda
+import bot_blobs as bb
+import bot_occurrences as bo
 import bot_response as br
 import bot_permissions as bp
+import bot_metrics as bm
+import bot_log as bl
 
-class InvalidTimeDurationStringError(Exception):
-    pass
-
-TIME_DURATION_RE = re.compile(r"\s*(\d*)\s*(mi|ho|da|we|mo|ye)\w*\s*")
-#tuple of (time_interval_index, n (like in n_months_later))
-def parse_time_duration_str(time_duration_str: str) -> tuple[int, int]:
-    m = re.fullmatch(TIME_DURATION_RE, time_duration_str.lower())
-    if m is None:
-        raise InvalidTimeDurationStringError("Failed to parse time duration string.")
-    n = int(m[1])
-    time_interval_index = bt.TIME_INTERVAL_ABBREVIATIONS_INV[m[2]]
-    return (time_interval_index, n)
-
-class InvalidRepeatStringError(Exception):
-    pass
-class ZeroRepeatTimeError(Exception):
-    pass
-
-def parse_repeat_str(repeat_str: str) -> tuple[int, int]:
-    try:
-        time_interval_index, n = parse_time_duration_str(repeat_str)
-        if n == 0:
-            raise ZeroRepeatTimeError("Repeat time is 0.")
-        return time_interval_index, n
-    except InvalidTimeDurationStringError:
-        raise InvalidRepeatStringError("Failed to parse repeat string.")
-
-class InvalidStartTimeStringError(Exception):
-    pass
 class ZeroDayValueError(Exception):
     pass
 class TooLargeDayValueError(Exception):
@@ -54,34 +31,22 @@ class TooLarge12HourValueError(TooLargeHourValueError):
 class TooLarge24HourValueError(TooLargeHourValueError):
     pass
 
-ABSOLUTE_TIME_RE = re.compile(
-    r'\s*(?:(\d+)\s*(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)\w*\s*(\d\d\d\d)?)?\s*(\d?\d)\s*(?::\s*(\d\d))?\s*([ap]m)?\s*'
-)
 #returns tuple of (start_time, is_12_hr)
 def parse_start_str(start_str: str, now: datetime) -> tuple[datetime, bool]:
-    m = re.fullmatch(ABSOLUTE_TIME_RE, start_str.lower())
-    if m is None:
-        try:
-            time_interval_index, n = parse_time_duration_str(start_str)
-            return (bt.TIME_INTERVAL_FUNCTIONS[time_interval_index](now, n), True)
-        except Exception:
-            raise InvalidStartTimeStringError("Failed to parse start time string (format of start time given is invalid).")
-    
-    day_str = m[1]
-    month_abbr_str = m[2]
-    year_str = m[3]
-    hour_str = m[4]
-    min_str = m[5]
-    ampm_str = m[6]
+    return resolve_start_time(bg.parse_time(start_str), now)
+
+def resolve_start_time(time: bg.RelativeTime|bg.AbsoluteTime, now: datetime) -> tuple[datetime, bool]:
+    if isinstance(time, bg.RelativeTime):
+        return (bt.TIME_INTERVAL_FUNCTIONS[time.interval_index](now, time.n), True)
 
     #read in date
     start = None
-    if day_str is None: #only time provided
+    if time.day is None: #only time provided
         start = datetime(now.year, now.month, now.day, tzinfo=now.tzinfo)
     else:
-        year = int(year_str) if year_str is not None else now.year
-        month = bt.MONTH_ABBRS_INV[month_abbr_str] + 1 #datetime expects 1-indexed
-        day = int(day_str)
+        year = time.year if time.year is not None else now.year
+        month = time.month
+        day = time.day
         _, days_in_month = calendar.monthrange(year, month)
         if day == 0:
             raise ZeroDayValueError("Start time day value is 0.")
@@ -93,18 +58,18 @@ def parse_start_str(start_str: str, now: datetime) -> tuple[datetime, bool]:
             raise InvalidDateError("Date is invalid.")
     
     #read in time
-    hour = int(hour_str)
-    min = int(min_str) if min_str is not None else 0
+    hour = time.hour
+    min = time.minute if time.minute is not None else 0
     if min > 59:
         raise TooLargeMinuteValueError(f"Minute value is too large (minute value is {min} and highest allowed minute is 59).")
-    is_12_hr = ampm_str is not None
+    is_12_hr = time.ampm is not None
     if is_12_hr:
         if hour == 0:
             raise ZeroHourValueError("Hour value is 0 in 12 hour time (lowest allowed hour value is 1).")
         if hour > 12:
             raise TooLarge12HourValueError(f"Hour value is too large for 12 hour time (hour value is {hour} and highest allowed hour value is 12).")
 
-        am = ampm_str.lower()[0] == 'a'
+        am = time.ampm == 'am'
         if am:
             if hour == 12:
                 hour = 0
@@ -118,7 +83,7 @@ def parse_start_str(start_str: str, now: datetime) -> tuple[datetime, bool]:
     start = start.replace(hour=hour, minute=min, second=0, microsecond=0)
 
     if start < now:
-        if day_str is None: #so you can specify a time in the next day without an annoying error
+        if time.day is None: #so you can specify a time in the next day without an annoying error
             start += timedelta(days=1)
     if start < now:
         raise ValueError(f"Start is before the current time (current time is {bt.format_datetime(now, is_12_hr)} and start time is {bt.format_datetime(start, is_12_hr)}).")
@@ -140,47 +105,33 @@ def format_local_and_UTC_time(time: datetime, is_12_hr: bool, user_has_tz: bool)
     return (f"{bt.format_datetime(time, is_12_hr)} {"local time" if user_has_tz else "UTC"}" + 
             f"{f" ({bt.format_datetime(bt.to_utc(time), is_12_hr)} UTC)" if user_has_tz else ""}")
 
-# tuple of (start_time, time_interval_index, n (like in n_months_later), name, response)
-# expects string in the format start [datetime] name [name] repeat [repeat] (optional)
-def parse_set_reminder(input: str, now: datetime, user_has_tz: bool, reply_message_id: int|None, user_name: str) -> tuple[datetime, int|None, int|None, str, br.Response]:
-    input_lower = input.lower()
+class InvalidMissedPolicyStringError(Exception):
+    pass
+
+def parse_missed_str(missed_str: str) -> int:
+    try:
+        return bt.MISSED_POLICY_NAMES_INV[missed_str.strip().lower()]
+    except KeyError:
+        raise InvalidMissedPolicyStringError(f"Failed to parse missed string (it must be one of {", ".join(bt.MISSED_POLICY_NAMES)}).")
 
-    start_time_arg = "time:"
-    repeat_arg = "repeat:"
+# tuple of (start_time, time_interval_index, n (like in n_months_later), missed_policy, name, response)
+# expects string in the format start [datetime] name [name] repeat [repeat] (optional) missed [missed policy] (optional)
+def parse_set_reminder(input: str, now: datetime, user_has_tz: bool, reply_message_id: int|None, user_name: str) -> tuple[datetime, int|None, int|None, int|None, str, br.Response]:
+    args = bg.parse_set_reminder_args(input)
+    name = args.name
 
-    start_time_index = input_lower.find(start_time_arg)
-    repeat_index = input_lower.find(repeat_arg)
+    start_time, is_12_hr = now, False
+    if args.start is not None:
+        start_time, is_12_hr = resolve_start_time(args.start, now)
 
-    name = ""
-    start_time, is_12_hr = None, None
     repeat_interval_index = None
     n = None
-    if start_time_index == -1 and repeat_index == -1:
-        name = input.strip()
-        start_time = now
-        is_12_hr = False
-    elif start_time_index == -1 and repeat_index != -1:
-        name = input[:repeat_index].strip()
-        start_time = now
-        is_12_hr = False
-        repeat_str = input[repeat_index + len(repeat_arg):].strip()
-        repeat_interval_index, n = parse_repeat_str(repeat_str)
-    elif start_time_index != -1 and repeat_index == -1:
-        name = input[:start_time_index].strip()
-        start_time_str = input[start_time_index + len(start_time_arg):]
-        start_time, is_12_hr = parse_start_str(start_time_str, now)
-    else:
-        name = input[:min(start_time_index, repeat_index)].strip()
-        start_time_str = None
-        repeat_str = None
-        if start_time_index < repeat_index:
-            start_time_str = input[start_time_index + len(start_time_arg):repeat_index]
-            repeat_str = input[repeat_index + len(repeat_arg):]
-        else:
-            start_time_str = input[start_time_index + len(start_time_arg):]
-            repeat_str = input[repeat_index + len(repeat_arg):start_time_index]
-        start_time, is_12_hr = parse_start_str(start_time_str, now)
-        repeat_interval_index, n = parse_repeat_str(repeat_str)
+    if args.repeat is not None:
+        repeat_interval_index, n = args.repeat
+
+    missed_policy = None
+    if args.missed is not None:
+        missed_policy = parse_missed_str(args.missed)
 
     if len(name) == 0:
         raise ZeroLengthNameError("No name given.")
@@ -194,6 +145,10 @@ def parse_set_reminder(input: str, now: datetime, user_has_tz: bool, reply_messa
     response.txt += "."
     if repeat_interval_index is not None: #has repeat
         response.txt += f"\n**Repeat:** Every {format_repeat(repeat_interval_index, n)}." # type: ignore n can't be null at this point
+        if missed_policy is not None:
+            response.txt += f"\n**Missed repeats:** {bt.MISSED_POLICY_DESCRIPTIONS[missed_policy].capitalize()}."
+    elif missed_policy is not None:
+        response.warnings.append(f"Reminder doesn't repeat, so `{bg.MISSED_ARG}` has no effect.")
 
     if repeat_interval_index == bt.TIME_INTERVAL_NAMES_INV["month"] and start_time.day > 28: #month
         response.warnings.append(f"Reminder is set to repeat per month, but some months have less than {start_time.day} days." +
@@ -203,28 +158,24 @@ def parse_set_reminder(input: str, now: datetime, user_has_tz: bool, reply_messa
         response.notes.append(f"You ({user_name}) have not set your timezone, so UTC is assumed. Consider setting your timezone with" +
                               f" `{COMMAND_PREFIX}{COMMAND_NAMES[COMMAND_FUNCTIONS_INV[set_timezone]][0]}`.")
 
-    return (start_time, repeat_interval_index, n, name, response)
+    return (start_time, repeat_interval_index, n, missed_policy, name, response)
 
-def set_reminder(input: str, channel_id: int, user_id: int, user_name: str, user_perms: discord.Permissions, reply_message_id: int|None) -> br.Response:
+async def set_reminder(input: str, channel_id: int, guild_id: int|None, user_id: int, user_name: str, user_perms: discord.Permissions, reply_message: discord.Message|None) -> br.Response:
     if not user_perms >= bp.EDIT_REMINDERS:
         return bp.make_lacking_perms_response(f"`{COMMAND_PREFIX}{COMMAND_NAMES[COMMAND_FUNCTIONS_INV[set_reminder]][0]}`",
                                               user_name,
                                               bp.EDIT_REMINDERS)
 
-    user_tz = bt.UTC
-    user_has_tz = False
-    try:
-        user_tz_str = bd.get_user_timezone(user_id)
-        user_tz = ZoneInfo(user_tz_str)
-        user_has_tz = True
-    except:
-        pass
+    user_zoneinfo = await bda.get_user_zoneinfo(user_id)
+    user_tz = user_zoneinfo if user_zoneinfo is not None else bt.UTC
+    user_has_tz = user_zoneinfo is not None
 
     now = datetime.now(user_tz)
+    reply_message_id = reply_message.id if reply_message is not None else None
 
-    start_time, repeat_interval_index, repeat_interval_increment, name, response = None, None, None, None, None
+    start_time, repeat_interval_index, repeat_interval_increment, missed_policy, name, response = None, None, None, None, None, None
     try:
-        start_time, repeat_interval_index, repeat_interval_increment, name, response = parse_set_reminder(input, now, user_has_tz, reply_message_id, user_name)
+        start_time, repeat_interval_index, repeat_interval_increment, missed_policy, name, response = parse_set_reminder(input, now, user_has_tz, reply_message_id, user_name)
     except Exception as e:
         return br.Response(
             is_error = True,
@@ -234,10 +185,14 @@ def set_reminder(input: str, channel_id: int, user_id: int, user_name: str, user
         )
     
     try:
-        bd.set_reminder(name, channel_id, reply_message_id, user_id, start_time, repeat_interval_index, repeat_interval_increment)
+        snapshot = None
+        if reply_message is not None:
+            snapshot = await bb.snapshot_message(reply_message)
+        await bda.set_reminder(name, channel_id, reply_message_id, user_id, start_time, repeat_interval_index, repeat_interval_increment,
+                               missed_policy, snapshot, guild_id)
     except Exception as e:
         notes = [USE_HELP_COMMAND_NOTES[COMMAND_FUNCTIONS_INV[set_reminder]]]
-        if isinstance(e, bd.ReminderAlreadyExistsError):
+        if isinstance(e, bst.ReminderAlreadyExistsError):
             notes.append(f"Note: You can remove a reminder using `{COMMAND_PREFIX}{COMMAND_NAMES[COMMAND_FUNCTIONS_INV[remove_reminder]][0]}`.")
 
         return br.Response(
@@ -249,7 +204,7 @@ def set_reminder(input: str, channel_id: int, user_id: int, user_name: str, user
     
     return response
 
-def remove_reminder(input: str, channel_id: int, user_id: int, user_name: str, user_perms: discord.Permissions, reply_message_id: int|None) -> br.Response:
+async def remove_reminder(input: str, channel_id: int, guild_id: int|None, user_id: int, user_name: str, user_perms: discord.Permissions, reply_message: discord.Message|None) -> br.Response:
     if not user_perms >= bp.EDIT_REMINDERS:
         return bp.make_lacking_perms_response(f"`{COMMAND_PREFIX}{COMMAND_NAMES[COMMAND_FUNCTIONS_INV[remove_reminder]][0]}`",
                                               user_name,
@@ -258,7 +213,7 @@ def remove_reminder(input: str, channel_id: int, user_id: int, user_name: str, u
     name = input.strip()
 
     try:
-        bd.remove_reminder(name, channel_id)
+        await bda.remove_reminder(name, channel_id)
     except Exception as e:
         return br.Response(
             is_error = True,
@@ -272,14 +227,14 @@ def remove_reminder(input: str, channel_id: int, user_id: int, user_name: str, u
         title=f"Removed reminder `{name}`."
     )
 
-def remove_all_reminders(input: str, channel_id: int, user_id: int, user_name: str, user_perms: discord.Permissions, reply_message_id: int|None) -> br.Response:
+async def remove_all_reminders(input: str, channel_id: int, guild_id: int|None, user_id: int, user_name: str, user_perms: discord.Permissions, reply_message: discord.Message|None) -> br.Response:
     if not user_perms >= bp.EDIT_REMINDERS:
         return bp.make_lacking_perms_response(f"`{COMMAND_PREFIX}{COMMAND_NAMES[COMMAND_FUNCTIONS_INV[remove_all_reminders]][0]}`",
                                               user_name,
                                               bp.EDIT_REMINDERS)
     
     try:
-        bd.remove_all_reminders(channel_id)
+        await bda.remove_all_reminders(channel_id)
     except Exception as e:
         return br.Response(
             is_error = True,
@@ -292,37 +247,85 @@ def remove_all_reminders(input: str, channel_id: int, user_id: int, user_name: s
         title=f"Removed all reminders from this channel."
     )
 
-def format_reminder(row: tuple[str, int, int|None, int, int, int, bool, int|None, int|None, int|None], user_tz: ZoneInfo) -> str:
-    #i looooove f-strings
-    return (f"`{row[0]}`: {bt.format_datetime(datetime.fromtimestamp(row[4], user_tz))}" +
-            f"{(f" | Repeats every {format_repeat(row[7], row[8])}" # type: ignore (relevant row values can't be null at this point)
-                f" | Next repeat: {bt.format_datetime(datetime.fromtimestamp(row[5], user_tz))}") if row[6] else ""}")
+UPCOMING_REPEATS_SHOWN = 2 #repeats listed after the next one
 
-def list_reminders(input: str, channel_id: int, user_id: int, user_name: str, user_perms: discord.Permissions, reply_message_id: int|None) -> br.Response:
-    reminders = bd.get_all_reminders(channel_id)
-    if len(reminders) == 0:
-        return br.Response(
-            title="There are no reminders in this channel."
-        )
-    
-    user_tz = bt.UTC
+#upcoming is the timestamps of the repeats after the next one
+def format_reminder(reminder: bst.Reminder, user_tz: ZoneInfo, upcoming: list[int]) -> str:
+    #i looooove f-strings
+    return (f"`{reminder.name}`: {bt.format_datetime(datetime.fromtimestamp(reminder.start_timestamp, user_tz))}" +
+            f"{(f" | Repeats every {format_repeat(reminder.repeat_interval_index, reminder.repeat_interval_increment)}" # type: ignore (relevant values can't be null at this point)
+                f" | Next repeat: {bt.format_datetime(datetime.fromtimestamp(reminder.next_timestamp, user_tz))}" +
+                f"{f" | Then: {", ".join([bt.format_datetime(datetime.fromtimestamp(t, user_tz)) for t in upcoming])}" if len(upcoming) > 0 else ""}") if reminder.has_repeat else ""}")
+
+#upcoming repeats come from the precomputed occurrences, which are in the setter's timezone
+async def get_upcoming_repeats(reminder: bst.Reminder) -> list[int]:
+    if not reminder.has_repeat:
+        return []
+    setter_zoneinfo = await bda.get_user_zoneinfo(reminder.setter_user_id)
+    return bo.get_upcoming(reminder.name, reminder.channel_id, reminder.start_timestamp, reminder.repeat_interval_index, # type: ignore (repeat values can't be null here)
+                           reminder.repeat_interval_increment, setter_zoneinfo, reminder.repeat_increment_count, UPCOMING_REPEATS_SHOWN) # type: ignore
+
+NO_REMINDERS_RESPONSE = br.StaticResponse(title="There are no reminders in this channel.")
+
+#list_reminders shows this many at a time, in the order they are due. the previous/next buttons carry a cursor (the first or
+#last reminder shown) in their custom_id, so paging needs no state and works on any old list message
+LIST_PAGE_SIZE = 10
+LIST_PAGE_CUSTOM_ID_PREFIX = "lr"
+LIST_PAGE_NEXT = "n"
+LIST_PAGE_PREVIOUS = "p"
+
+def make_list_page_custom_id(direction: str, reminder: bst.Reminder) -> str:
+    return f"{LIST_PAGE_CUSTOM_ID_PREFIX}:{direction}:{reminder.next_timestamp}:{reminder.name}" #names are at most 64 characters, so this fits in 100
+
+#(cursor, before) or None if custom_id isn't a list page button
+def parse_list_page_custom_id(custom_id: str) -> tuple[tuple[int, str], bool]|None:
+    parts = custom_id.split(":", 3)
+    if len(parts) != 4 or parts[0] != LIST_PAGE_CUSTOM_ID_PREFIX or parts[1] not in (LIST_PAGE_NEXT, LIST_PAGE_PREVIOUS):
+        return None
     try:
-        user_tz_str = bd.get_user_timezone(user_id)
-        user_tz = ZoneInfo(user_tz_str)
-    except:
-        pass
-
-    reminder_strs = [format_reminder(r, user_tz) for r in reminders]
+        next_timestamp = int(parts[2]) #reminders can be due before 1970
+    except ValueError:
+        return None
+    return ((next_timestamp, parts[3]), parts[1] == LIST_PAGE_PREVIOUS)
+
+def make_list_page_view(reminders: list[bst.Reminder], has_previous: bool, has_next: bool) -> discord.ui.View:
+    view = discord.ui.View(timeout=None)
+    view.add_item(discord.ui.Button(label="Previous", style=discord.ButtonStyle.secondary, disabled=not has_previous,
+                                    custom_id=make_list_page_custom_id(LIST_PAGE_PREVIOUS, reminders[0])))
+    view.add_item(discord.ui.Button(label="Next", style=discord.ButtonStyle.secondary, disabled=not has_next,
+                                    custom_id=make_list_page_custom_id(LIST_PAGE_NEXT, reminders[-1])))
+    view.stop() #clicks are handled by the on_interaction event, so discord.py doesn't need to keep the view around
+    return view
+
+async def list_reminders_page(channel_id: int, user_id: int, cursor: tuple[int, str]|None, before: bool) -> br.Response:
+    reminders, start, count = await bda.get_reminder_page(channel_id, cursor, before, LIST_PAGE_SIZE)
+    if count == 0:
+        return NO_REMINDERS_RESPONSE
+    if len(reminders) == 0: #everything past the cursor was removed since the page was shown
+        reminders, start, count = await bda.get_reminder_page(channel_id, None, not before, LIST_PAGE_SIZE)
+
+    user_zoneinfo = await bda.get_user_zoneinfo(user_id)
+    user_tz = user_zoneinfo if user_zoneinfo is not None else bt.UTC
+
+    reminder_strs = [format_reminder(r, user_tz, await get_upcoming_repeats(r)) for r in reminders]
+    has_previous = start > 0
+    has_next = start + len(reminders) < count
     return br.Response(
-        title=f"There are {len(reminders)} reminders in this channel:" if len(reminders) > 1 else "There is 1 reminder in this channel:",
-        txt="\n".join(reminder_strs)
+        title=(f"There are {count} reminders in this channel" + (f" (showing {start + 1}-{start + len(reminders)})" if has_previous or has_next else "") + ":"
+               if count > 1 else "There is 1 reminder in this channel:"),
+        txt="\n".join(reminder_strs),
+        view=make_list_page_view(reminders, has_previous, has_next) if has_previous or has_next else None
     )
 
-def set_timezone(input: str, channel_id: int, user_id: int, user_name: str, user_perms: discord.Permissions, reply_message_id: int|None) -> br.Response:
+async def list_reminders(input: str, channel_id: int, guild_id: int|None, user_id: int, user_name: str, user_perms: discord.Permissions, reply_message: discord.Message|None) -> br.Response:
+    return await list_reminders_page(channel_id, user_id, None, False)
+
+async def set_timezone(input: str, channel_id: int, guild_id: int|None, user_id: int, user_name: str, user_perms: discord.Permissions, reply_message: discord.Message|None) -> br.Response:
     tz_name_input = input.strip()
     tz_name_lower = tz_name_input.lower()
 
-    if tz_name_lower not in bt.TIMEZONES_LOWERCASE:
+    tz_name = bt.get_timezones_lowercase().get(tz_name_lower)
+    if tz_name is None:
         return br.Response(
             is_error = True,
             title=f"Setting timezone for user `{user_name}` failed:",
@@ -330,17 +333,15 @@ def set_timezone(input: str, channel_id: int, user_id: int, user_name: str, user
             notes=[USE_HELP_COMMAND_NOTES[COMMAND_FUNCTIONS_INV[set_timezone]]]
         )
 
-    tz_name = bt.TIMEZONES_LOWERCASE[tz_name_lower]
-
-    bd.set_user_timezone(user_id, tz_name)
+    await bda.set_user_timezone(user_id, tz_name)
     return br.Response(
         title=f"Set timezone for user `{user_name}` to {tz_name}."
     )
 
-def get_timezone(input: str, channel_id: int, user_id: int, user_name: str, user_perms: discord.Permissions, reply_message_id: int|None) -> br.Response:
+async def get_timezone(input: str, channel_id: int, guild_id: int|None, user_id: int, user_name: str, user_perms: discord.Permissions, reply_message: discord.Message|None) -> br.Response:
     try:
         return br.Response(
-            title=f"Timezone for user `{user_name}` is {bd.get_user_timezone(user_id)}."
+            title=f"Timezone for user `{user_name}` is {await bda.get_user_timezone(user_id)}."
         )
     except Exception as e:
         return br.Response(
@@ -351,9 +352,9 @@ def get_timezone(input: str, channel_id: int, user_id: int, user_name: str, user
                    f"Consider setting your timezone with {COMMAND_PREFIX}{COMMAND_NAMES[COMMAND_FUNCTIONS_INV[set_timezone]][0]}"]
         )
 
-def remove_timezone(input: str, channel_id: int, user_id: int, user_name: str, user_perms: discord.Permissions, reply_message_id: int|None) -> br.Response:
+async def remove_timezone(input: str, channel_id: int, guild_id: int|None, user_id: int, user_name: str, user_perms: discord.Permissions, reply_message: discord.Message|None) -> br.Response:
     try:
-        bd.remove_user_timezone(user_id)
+        await bda.remove_user_timezone(user_id)
     except Exception as e:
         return br.Response(
             is_error=True,
@@ -364,136 +365,71 @@ def remove_timezone(input: str, channel_id: int, user_id: int, user_name: str, u
     
     return br.Response(title=f"Timezone for user `{user_name}` removed.")
 
-def current_time(input: str, channel_id: int, user_id: int, user_name: str, user_perms: discord.Permissions, reply_message_id: int|None) -> br.Response:
-    user_tz = bt.UTC
-    user_has_tz = False
-    try:
-        user_tz_str = bd.get_user_timezone(user_id)
-        user_tz = ZoneInfo(user_tz_str)
-        user_has_tz = True
-    except:
-        pass
+async def current_time(input: str, channel_id: int, guild_id: int|None, user_id: int, user_name: str, user_perms: discord.Permissions, reply_message: discord.Message|None) -> br.Response:
+    user_zoneinfo = await bda.get_user_zoneinfo(user_id)
+    user_tz = user_zoneinfo if user_zoneinfo is not None else bt.UTC
+    user_has_tz = user_zoneinfo is not None
 
     return br.Response(
         title=f"Current time for user `{user_name}`:",
         txt=f"{format_local_and_UTC_time(datetime.now(user_tz), True, user_has_tz)}."
     )
 
-def help(input: str, channel_id: int, user_id: int, user_name: str, user_perms: discord.Permissions, reply_message_id: int|None) -> br.Response|None:
+async def help(input: str, channel_id: int, guild_id: int|None, user_id: int, user_name: str, user_perms: discord.Permissions, reply_message: discord.Message|None) -> br.Response|None:
     command_name = input.strip()
-    command_name_lower = command_name.lower()
-    if command_name_lower == '':
-        commands = [f"`{COMMAND_PREFIX}{COMMAND_NAMES[i][0]}`" for i in range(len(COMMAND_NAMES))]
-        return br.Response(
-            title="Help:",
-            txt=f"All available commands: \n{"\n".join(commands)}\n\n" +
-                f"To view detailed help for a command, use `{COMMAND_PREFIX}{COMMAND_NAMES[COMMAND_FUNCTIONS_INV[help]][0]} [your command]`",
-            warnings=[f"This bot is currently in early development. Things may change unexpectedly. Do not yet trust this bot for important reminders."]
-        )
-    if command_name_lower in COMMAND_NAMES[COMMAND_FUNCTIONS_INV[set_reminder]]:
-        return br.Response(
-            title=f"Help for {COMMAND_NAMES[COMMAND_FUNCTIONS_INV[set_reminder]][0]}:",
-            txt="This command adds a reminder to the current channel, with an optional custom message.\n\n" +
-                "To use this command, use the format " +
-                f"`{COMMAND_PREFIX}{COMMAND_NAMES[COMMAND_FUNCTIONS_INV[set_reminder]][0]} [name of reminder] time: [time of reminder] repeat: [repeat interval of reminder]`\n\n" +
-                "Time can be specified as either absolute or relative. The format for absolute is `[dd] [month name] [yyyy] [hh:mm] [am/pm]`, " +
-                "and the format for relative is `[integer number] [unit of time]`, where the unit of time can be minute, hour, day, week, month, or year.\n" +
-                "The format for repeat is also `[integer number] [unit of time]`." +
-                "Time and repeat are both optional arguments, and their formats are extremely flexible. " +
-                "For example, most of the parts of the absolute time format can be omitted and inferred from the current time.\n\n" +
-                f"To add a custom message to your reminder, send the custom message and then reply to it when sending `{COMMAND_PREFIX}{COMMAND_NAMES[COMMAND_FUNCTIONS_INV[set_reminder]][0]}`.\n\n" +
-                f"Aliases of this command: `{", ".join(COMMAND_NAMES[COMMAND_FUNCTIONS_INV[set_reminder]][1:])}`",
-            notes=[f"You must have the following permissions to use this command: {bp.make_permissions_list(bp.EDIT_REMINDERS)}",
-                   f"You can remove a reminder with `{COMMAND_NAMES[COMMAND_FUNCTIONS_INV[remove_reminder]][0]}`"]
-        )
-    if command_name_lower in COMMAND_NAMES[COMMAND_FUNCTIONS_INV[remove_reminder]]:
+    if command_name == '':
+        return HELP_OVERVIEW_RESPONSE
+    command_index = COMMAND_NAMES_INV.get(command_name.lower())
+    if command_index is None:
         return br.Response(
-            title=f"Help for {COMMAND_NAMES[COMMAND_FUNCTIONS_INV[remove_reminder]][0]}:",
-            txt="This command removes a reminder from the current channel.\n\n" +
-                "To use this command, use the format " +
-                f"`{COMMAND_PREFIX}{COMMAND_NAMES[COMMAND_FUNCTIONS_INV[remove_reminder]][0]} [name of reminder].`\n\n" +
-                f"Aliases of this command: `{", ".join(COMMAND_NAMES[COMMAND_FUNCTIONS_INV[remove_reminder]][1:])}`",
-            notes=[f"You must have the following permissions to use this command: {bp.make_permissions_list(bp.EDIT_REMINDERS)}."]
-        )
-    if command_name_lower in COMMAND_NAMES[COMMAND_FUNCTIONS_INV[remove_all_reminders]]:
-        return br.Response(
-            title=f"Help for {COMMAND_NAMES[COMMAND_FUNCTIONS_INV[remove_all_reminders]][0]}:",
-            txt="This command removes all reminders from the current channel.\n\n" +
-                f"To use this command, use `{COMMAND_PREFIX}{COMMAND_NAMES[COMMAND_FUNCTIONS_INV[remove_all_reminders]][0]}`.",
-            notes=[f"You must have the following permissions to use this command: {bp.make_permissions_list(bp.EDIT_REMINDERS)}."]
-        )
-    if command_name_lower in COMMAND_NAMES[COMMAND_FUNCTIONS_INV[list_reminders]]:
-        return br.Response(
-            title=f"Help for {COMMAND_NAMES[COMMAND_FUNCTIONS_INV[list_reminders]][0]}:",
-            txt="This command lists the names and details of all reminders in this channel.\n\n" +
-                f"To use this command, use `{COMMAND_PREFIX}{COMMAND_NAMES[COMMAND_FUNCTIONS_INV[list_reminders]][0]}`.\n\n" +
-                f"Aliases of this command: `{", ".join(COMMAND_NAMES[COMMAND_FUNCTIONS_INV[list_reminders]][1:])}`",
-        )
-    if command_name_lower in COMMAND_NAMES[COMMAND_FUNCTIONS_INV[set_timezone]]:
-        return br.Response(
-            title=f"Help for {COMMAND_NAMES[COMMAND_FUNCTIONS_INV[set_timezone]][0]}:",
-            txt="This command sets your timezone, which will be used for all future reminders you add.\n\n"
-                "To use this command, use the format " +
-                f"`{COMMAND_PREFIX}{COMMAND_NAMES[COMMAND_FUNCTIONS_INV[set_timezone]][0]} [TZ identifier].` " +
-                "You can find your TZ identifier [here](https://en.wikipedia.org/wiki/List_of_tz_database_time_zones#Time_zone_abbreviations).\n" +
-                "For example, your TZ identifier could be `America/Winnipeg` or `Europe/Kiev` or `Kwajalein`\n\n" +
-                f"Aliases of this command: `{", ".join(COMMAND_NAMES[COMMAND_FUNCTIONS_INV[set_timezone]][1:])}`",
-            notes=[f"You can get your current timezone with `{COMMAND_NAMES[COMMAND_FUNCTIONS_INV[get_timezone]][0]}` " +
-                   f"and remove your timezone with `{COMMAND_NAMES[COMMAND_FUNCTIONS_INV[remove_timezone]][0]}`."]
-        )
-    if command_name_lower in COMMAND_NAMES[COMMAND_FUNCTIONS_INV[get_timezone]]:
-        return br.Response(
-            title=f"Help for {COMMAND_NAMES[COMMAND_FUNCTIONS_INV[get_timezone]][0]}:",
-            txt=f"This command gets your timezone, as set by `{COMMAND_NAMES[COMMAND_FUNCTIONS_INV[set_timezone]][0]}`.\n\n" +
-                f"To use this command, use `{COMMAND_PREFIX}{COMMAND_NAMES[COMMAND_FUNCTIONS_INV[get_timezone]][0]}`.\n\n" +
-                f"Aliases of this command: `{", ".join(COMMAND_NAMES[COMMAND_FUNCTIONS_INV[get_timezone]][1:])}`",
-            notes=[f"You can remove your timezone with {COMMAND_NAMES[COMMAND_FUNCTIONS_INV[remove_timezone]][0]}."]
-        )
-    if command_name_lower in COMMAND_NAMES[COMMAND_FUNCTIONS_INV[remove_timezone]]:
-        return br.Response(
-            title=f"Help for {COMMAND_NAMES[COMMAND_FUNCTIONS_INV[remove_timezone]][0]}:",
-            txt=f"This command removes your timezone, as set by `{COMMAND_NAMES[COMMAND_FUNCTIONS_INV[set_timezone]][0]}`.\n\n" +
-                f"To use this command, use `{COMMAND_PREFIX}{COMMAND_NAMES[COMMAND_FUNCTIONS_INV[remove_timezone]][0]}`.\n\n" +
-                f"Aliases of this command: `{", ".join(COMMAND_NAMES[COMMAND_FUNCTIONS_INV[remove_timezone]][1:])}`"
-        )
-    if command_name_lower in COMMAND_NAMES[COMMAND_FUNCTIONS_INV[current_time]]:
-        return br.Response(
-            title=f"Help for {COMMAND_NAMES[COMMAND_FUNCTIONS_INV[current_time]][0]}:",
-            txt=f"This command gets your current time, according to the timezone set by `{COMMAND_NAMES[COMMAND_FUNCTIONS_INV[set_timezone]][0]}`.\n\n" +
-                f"To use this command, use `{COMMAND_PREFIX}{COMMAND_NAMES[COMMAND_FUNCTIONS_INV[current_time]][0]}`.\n\n" +
-                f"Aliases of this command: `{", ".join(COMMAND_NAMES[COMMAND_FUNCTIONS_INV[current_time]][1:])}`",
-            notes=[f"You can remove your timezone with {COMMAND_NAMES[COMMAND_FUNCTIONS_INV[remove_timezone]][0]}."]
+            is_error=True,
+            title=f"Help failed: Command {command_name} does not exist.",
+            notes=[USE_HELP_NOTE]
         )
-    if command_name_lower in COMMAND_NAMES[COMMAND_FUNCTIONS_INV[help]]:
-        return br.Response(
-            title=f"Help for {COMMAND_NAMES[COMMAND_FUNCTIONS_INV[help]][0]}:",
-            txt="This is the help command."
-        )
-    return br.Response(
-        is_error=True,
-        title=f"Help failed: Command {command_name} does not exist.",
-        notes=[USE_HELP_NOTE]
-    )
-
-def parse_command(input: str, channel_id: int, user_id: int, user_name: str, user_perms: discord.Permissions, reply_message_id: int|None) -> br.Response|None:
-    if input[:len(COMMAND_PREFIX)] != COMMAND_PREFIX:
-        return 
-    
-    command_name = input[len(COMMAND_PREFIX):].split(maxsplit=1)[0]
-    command_name_lower = command_name.lower()
-    command_index = None
-    try:
-        command_index = COMMAND_NAMES_INV[command_name_lower]
-    except:
+    return HELP_RESPONSES[command_index]
+
+async def parse_command(input: str, channel_id: int, guild_id: int|None, user_id: int, user_name: str, user_perms: discord.Permissions, reply_message: discord.Message|None) -> br.Response|None:
+    command = bg.parse_command(input, COMMAND_PREFIX)
+    if command is None:
+        return
+    return await run_command(command, channel_id, guild_id, user_id, user_name, user_perms, reply_message)
+
+#the canonical name of the command called name, or None if there isn't one
+def get_canonical_name(name: str) -> str|None:
+    command_index = COMMAND_NAMES_INV.get(name.lower())
+    return COMMAND_NAMES[command_index][0] if command_index is not None else None
+
+async def run_command(command: bg.CommandNode, channel_id: int, guild_id: int|None, user_id: int, user_name: str, user_perms: discord.Permissions, reply_message: discord.Message|None) -> br.Response:
+    command_index = COMMAND_NAMES_INV.get(command.name.lower())
+    if command_index is None:
         return br.Response(
             is_error=True,
-            title=f"Command {command_name} does not exist.",
+            title=f"Command {command.name} does not exist.",
             notes=[USE_HELP_NOTE]
         )
-    
-    args_index = input.find(command_name) + len(command_name)
-    command_args = input[args_index:]
-    return COMMAND_FUNCTIONS[command_index](command_args, channel_id, user_id, user_name, user_perms, reply_message_id)
+
+    canonical_name = COMMAND_NAMES[command_index][0]
+    started = time.perf_counter()
+    log_context = bl.set_context(command=canonical_name, channel_id=channel_id, guild_id=guild_id, user_id=user_id)
+    try:
+        response = await COMMAND_FUNCTIONS[command_index](command.args, channel_id, guild_id, user_id, user_name, user_perms, reply_message)
+    except Exception:
+        bm.COMMAND_ERRORS.inc(canonical_name)
+        raise
+    finally:
+        bl.reset_context(log_context)
+        bm.COMMAND_DURATION.observe(time.perf_counter() - started, canonical_name)
+    if response is not None and response.is_error:
+        bm.COMMAND_ERRORS.inc(canonical_name)
+    return response
+
+#a button on one of the bot's messages was clicked. returns the response to replace that message with, or None if the button isn't the bot's
+async def handle_component(custom_id: str, channel_id: int, user_id: int) -> br.Response|None:
+    list_page = parse_list_page_custom_id(custom_id)
+    if list_page is None:
+        return None
+    cursor, before = list_page
+    return await list_reminders_page(channel_id, user_id, cursor, before)
 
 COMMAND_PREFIX = "!!"
 COMMAND_NAMES = [ #1st is canonical name, rest are aliases
@@ -523,4 +459,103 @@ COMMAND_FUNCTIONS_INV = {c: i for i, c in enumerate(COMMAND_FUNCTIONS)}
 
 USE_HELP_NOTE = f"Use `{COMMAND_PREFIX}{COMMAND_NAMES[COMMAND_FUNCTIONS_INV[help]][0]}` to see the list of available commands."
 USE_HELP_COMMAND_NOTES = [f"Use `{COMMAND_PREFIX}{COMMAND_NAMES[COMMAND_FUNCTIONS_INV[help]][0]} {COMMAND_NAMES[i][0]}` to learn how to use {COMMAND_NAMES[i][0]}." 
-                          for i in range(len(COMMAND_NAMES))]
\ No newline at end of file
+                          for i in range(len(COMMAND_NAMES))]
+
+#what help says about each command. the responses are built from this once, when the module is loaded
+class CommandHelp:
+    __slots__ = ('description', 'usage', 'details', 'perms', 'notes')
+
+    def __init__(self, description: str, usage: str|None = None, details: str|None = None, perms: discord.Permissions|None = None,
+                 notes: list[str]|None = None):
+        self.description = description
+        self.usage = usage #arguments after the command name, None if it doesn't take any
+        self.details = details
+        self.perms = perms #needed to use the command
+        self.notes = notes if notes is not None else []
+
+def canonical_name(command_function) -> str:
+    return COMMAND_NAMES[COMMAND_FUNCTIONS_INV[command_function]][0]
+
+COMMAND_HELP = {
+    set_reminder: CommandHelp(
+        "This command adds a reminder to the current channel, with an optional custom message.",
+        usage="[name of reminder] time: [time of reminder] repeat: [repeat interval of reminder]",
+        details="Time can be specified as either absolute or relative. The format for absolute is `[dd] [month name] [yyyy] [hh:mm] [am/pm]`, " +
+                "and the format for relative is `[integer number] [unit of time]`, where the unit of time can be minute, hour, day, week, month, or year.\n" +
+                "The format for repeat is also `[integer number] [unit of time]`. " +
+                "Time and repeat are both optional arguments, and their formats are extremely flexible. " +
+                "For example, most of the parts of the absolute time format can be omitted and inferred from the current time.\n\n" +
+                "For repeating reminders, you can also add `missed: [policy]` to choose what happens to repeats that were missed while the bot was offline: " +
+                f"{", ".join([f"`{name}` to {description}" for name, description in zip(bt.MISSED_POLICY_NAMES, bt.MISSED_POLICY_DESCRIPTIONS)])}. " +
+                f"The default is `{bt.MISSED_POLICY_NAMES[bt.DEFAULT_MISSED_POLICY]}`.\n\n" +
+                f"To add a custom message to your reminder, send the custom message and then reply to it when sending `{COMMAND_PREFIX}{canonical_name(set_reminder)}`.",
+        perms=bp.EDIT_REMINDERS,
+        notes=[f"You can remove a reminder with `{canonical_name(remove_reminder)}`"]
+    ),
+    remove_reminder: CommandHelp(
+        "This command removes a reminder from the current channel.",
+        usage="[name of reminder]",
+        perms=bp.EDIT_REMINDERS
+    ),
+    remove_all_reminders: CommandHelp(
+        "This command removes all reminders from the current channel.",
+        perms=bp.EDIT_REMINDERS
+    ),
+    list_reminders: CommandHelp(
+        "This command lists the names and details of the reminders in this channel, in the order they are due.",
+        details=f"Reminders are shown {LIST_PAGE_SIZE} at a time, use the Previous and Next buttons to page through the rest."
+    ),
+    set_timezone: CommandHelp(
+        "This command sets your timezone, which will be used for all future reminders you add.",
+        usage="[TZ identifier]",
+        details="You can find your TZ identifier [here](https://en.wikipedia.org/wiki/List_of_tz_database_time_zones#Time_zone_abbreviations).\n" +
+                "For example, your TZ identifier could be `America/Winnipeg` or `Europe/Kiev` or `Kwajalein`",
+        notes=[f"You can get your current timezone with `{canonical_name(get_timezone)}` " +
+               f"and remove your timezone with `{canonical_name(remove_timezone)}`."]
+    ),
+    get_timezone: CommandHelp(
+        f"This command gets your timezone, as set by `{canonical_name(set_timezone)}`.",
+        notes=[f"You can remove your timezone with {canonical_name(remove_timezone)}."]
+    ),
+    remove_timezone: CommandHelp(
+        f"This command removes your timezone, as set by `{canonical_name(set_timezone)}`."
+    ),
+    current_time: CommandHelp(
+        f"This command gets your current time, according to the timezone set by `{canonical_name(set_timezone)}`.",
+        notes=[f"You can remove your timezone with {canonical_name(remove_timezone)}."]
+    ),
+    help: CommandHelp(
+        "This is the help command. Without a command name it lists every command.",
+        usage="[command name]"
+    ),
+}
+
+def make_help_response(command_index: int) -> br.StaticResponse:
+    names = COMMAND_NAMES[command_index]
+    command_help = COMMAND_HELP[COMMAND_FUNCTIONS[command_index]]
+    paragraphs = [command_help.description]
+    if command_help.usage is not None:
+        paragraphs.append(f"To use this command, use the format `{COMMAND_PREFIX}{names[0]} {command_help.usage}`.")
+    else:
+        paragraphs.append(f"To use this command, use `{COMMAND_PREFIX}{names[0]}`.")
+    if command_help.details is not None:
+        paragraphs.append(command_help.details)
+    if len(names) > 1:
+        paragraphs.append(f"Aliases of this command: `{", ".join(names[1:])}`")
+
+    notes = []
+    if command_help.perms is not None:
+        notes.append(f"You must have the following permissions to use this command: {bp.make_permissions_list(command_help.perms)}.")
+    return br.StaticResponse(
+        title=f"Help for {names[0]}:",
+        txt="\n\n".join(paragraphs),
+        notes=notes + command_help.notes
+    )
+
+HELP_RESPONSES = [make_help_response(i) for i in range(len(COMMAND_NAMES))]
+HELP_OVERVIEW_RESPONSE = br.StaticResponse(
+    title="Help:",
+    txt=f"All available commands: \n{"\n".join(f"`{COMMAND_PREFIX}{names[0]}`" for names in COMMAND_NAMES)}\n\n" +
+        f"To view detailed help for a command, use `{COMMAND_PREFIX}{canonical_name(help)} [your command]`",
+    warnings=[f"This bot is currently in early development. Things may change unexpectedly. Do not yet trust this bot for important reminders."]
+)
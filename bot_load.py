@@ -0,0 +1,171 @@
+import argparse
+import asyncio
+import contextvars
+import os
+import random
+import tempfile
+import time
+
+#end to end load test against bot_fake_discord: simulated users send commands through bot.handle_message while the
+#scheduler fires their reminders, then command round trip and firing lateness percentiles are printed.
+#runs in a scratch directory, so the bot's own database is never touched.
+#  python bot_load.py --users 2000 --duration 30 --latency 0.05 --rate-limit 0.01
+os.chdir(tempfile.mkdtemp(prefix="remindbot-load-"))
+
+import bot
+import bot_io as bi
+import bot_store as bst
+import bot_fake_discord as bfd
+import bot_log as bl
+import bot_metrics as bm
+
+PERCENTILES = [50, 90, 99]
+
+#(weight, canonical command name)
+COMMAND_MIX = [
+    (50, "set_reminder"),
+    (20, "list_reminders"),
+    (10, "current_time"),
+    (10, "set_timezone"),
+    (5, "help"),
+    (5, "remove_reminder"),
+]
+TIMEZONES = ["America/Winnipeg", "Europe/Berlin", "Asia/Tokyo", "Australia/Sydney", "UTC"]
+
+current_command = contextvars.ContextVar('current_command', default=None)
+
+def percentile(sorted_values: list[float], p: float) -> float:
+    if len(sorted_values) == 0:
+        return float('nan')
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))]
+
+def format_distribution(values: list[float]) -> str:
+    values = sorted(values)
+    return (f"n={len(values)} " + " ".join(f"p{p}={percentile(values, p) * 1000:.1f}ms" for p in PERCENTILES) +
+            f" max={(values[-1] if len(values) > 0 else float('nan')) * 1000:.1f}ms")
+
+class LoadResults:
+    def __init__(self):
+        self.round_trips: dict[str, list[float]] = {}
+        self.errors: dict[str, int] = {}
+        self.lateness: list[float] = []
+        self.expected: dict[tuple[str, int], int] = {} #(name, channel_id) -> next_timestamp, for reminders that haven't fired yet
+        self.unexpected_fires = 0
+
+    #reminder listener for bot_store, so reminders that fire before the command's reply is sent are still expected
+    def on_reminder_changed(self, name: str|None, channel_id: int, next_timestamp: int|None):
+        if name is None:
+            for key in [key for key in self.expected if key[1] == channel_id]:
+                del self.expected[key]
+        elif next_timestamp is None:
+            self.expected.pop((name, channel_id), None)
+        else:
+            self.expected[(name, channel_id)] = next_timestamp
+
+    def on_bot_message(self, message: bfd.FakeMessage):
+        command = current_command.get()
+        if command is not None: #a reply to a command, sent from that user's task
+            if any(embed.title is not None and embed.title.startswith("Error:") for embed in message.embeds):
+                self.errors[command] = self.errors.get(command, 0) + 1
+            return
+
+        now = time.time()
+        for embed in message.embeds:
+            if embed.title is None or not embed.title.startswith("Reminder: "):
+                continue
+            next_timestamp = self.expected.pop((embed.title[len("Reminder: "):], message.channel.id), None)
+            if next_timestamp is None:
+                self.unexpected_fires += 1
+            else:
+                self.lateness.append(now - next_timestamp)
+
+async def simulate_user(client: bfd.FakeClient, results: LoadResults, rng: random.Random, index: int, channel: bfd.FakeTextChannel,
+                        commands: int, duration: float, delay_minutes: int):
+    user = bfd.FakeUser(1000000 + index, f"user{index}")
+    names = []
+    weights = [weight for weight, _ in COMMAND_MIX]
+    for i in range(commands):
+        await asyncio.sleep(rng.uniform(0, 2 * duration / commands))
+        command = rng.choices([command for _, command in COMMAND_MIX], weights)[0]
+
+        content = None
+        name = f"load {index}-{i}"
+        if command == "set_reminder":
+            content = f"!!sr {name}" + (f" time: {delay_minutes} mi" if delay_minutes > 0 else "")
+        elif command == "remove_reminder":
+            if len(names) == 0:
+                continue
+            name = names.pop(rng.randrange(len(names)))
+            content = f"!!rr {name}"
+        elif command == "set_timezone":
+            content = f"!!st {rng.choice(TIMEZONES)}"
+        elif command == "help":
+            content = f"!!help {rng.choice(bi.COMMAND_NAMES)[0]}"
+        else:
+            content = f"!!{command}"
+
+        message = channel.receive(user, content)
+        token = current_command.set(command)
+        started = time.perf_counter()
+        try:
+            await bot.handle_message(client, message) # type: ignore the fake has everything handle_message uses
+        finally:
+            current_command.reset(token)
+        results.round_trips.setdefault(command, []).append(time.perf_counter() - started)
+
+        if command == "set_reminder":
+            names.append(name)
+
+async def run(args) -> tuple[LoadResults, bfd.FakeStats]:
+    config = bfd.FakeConfig(latency=args.latency, jitter=args.jitter, rate_limit_rate=args.rate_limit, retry_after=args.retry_after,
+                            not_found_rate=args.not_found, seed=args.seed)
+    client = bfd.FakeClient(config)
+    results = LoadResults()
+    rng = random.Random(args.seed)
+
+    channels = []
+    for i in range(args.channels):
+        guild = bfd.FakeGuild((i % args.guilds + 1) << 22)
+        channel = client.add_channel(10000 + i, guild, cached=i % 10 != 0) #some channels aren't cached, so delivery fetches them
+        channel.listeners.append(results.on_bot_message)
+        channels.append(channel)
+
+    bl.setup()
+    bst.load()
+    bst.reminder_listeners.insert(0, results.on_reminder_changed) #before the scheduler can fire anything
+    bot.start_background_tasks(client) # type: ignore
+    await asyncio.gather(*[simulate_user(client, results, rng, i, channels[i % len(channels)], args.commands, args.duration, args.delay_minutes)
+                           for i in range(args.users)])
+
+    deadline = time.time() + args.delay_minutes * 60 + args.drain
+    while len(results.expected) > 0 and time.time() < deadline:
+        await asyncio.sleep(0.1)
+    return (results, client.http.stats)
+
+def report(results: LoadResults, client_stats: bfd.FakeStats):
+    print("Command round trip:")
+    for command, round_trips in sorted(results.round_trips.items()):
+        print(f"  {command}: {format_distribution(round_trips)} errors={results.errors.get(command, 0)}")
+    print(f"Firing lateness: {format_distribution(results.lateness)}")
+    print(f"  never fired={len(results.expected)} fired after being removed={results.unexpected_fires}")
+    print(f"Throttled: {", ".join(f"{reason[0]}={count:.0f}" for reason, count in bm.COMMANDS_THROTTLED.values.items()) or "none"}")
+    print(f"Fake discord: api calls={client_stats.api_calls} rate limits={client_stats.rate_limits} not found={client_stats.not_founds}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load tests RemindBot against a fake discord.")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--commands", type=int, default=5, help="commands per user")
+    parser.add_argument("--duration", type=float, default=30, help="seconds the commands are spread over")
+    parser.add_argument("--channels", type=int, default=100)
+    parser.add_argument("--guilds", type=int, default=20)
+    parser.add_argument("--delay-minutes", type=int, default=1, help="reminders are set this far ahead (0 fires them straight away)")
+    parser.add_argument("--drain", type=float, default=30, help="extra seconds to wait for reminders to fire")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per rest call")
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="fraction of rest calls that hit a 429 first")
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--not-found", type=float, default=0.0, help="fraction of rest calls that fail with NotFound")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    report(*asyncio.run(run(args)))
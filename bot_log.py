@@ -1,9 +1,134 @@
+import atexit
+import contextvars
+from datetime import datetime, timezone
+import json
 import logging
+import logging.handlers
+import queue
+import threading
+import time
+import traceback
+
+#records are put on a queue by whichever thread logs them and written by a listener thread, so logging never waits on the disk.
+#each line of the log is one json object, with whatever context (channel, reminder, command, ...) was set when it was logged
+LOG_PATH = "errlog.txt"
+LOG_LEVEL = logging.DEBUG
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+
+#an error identical to one logged less than this long ago (same type, message and place) is only counted,
+#and the count is logged along with the next one after the window
+ERROR_REPEAT_SECONDS = 60
+MAX_TRACKED_ERRORS = 1024
 
-logging.basicConfig(filename="errlog.txt", encoding="utf-8", format="%(asctime)s %(message)s", level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-logger.info("Logging session started.")
+context: contextvars.ContextVar[dict[str, object]] = contextvars.ContextVar('log_context', default={})
+
+#adds fields to everything logged from the current task (and tasks it starts) until reset_context is called with the token
+def set_context(**fields) -> contextvars.Token:
+    return context.set(context.get() | fields)
+
+def reset_context(token: contextvars.Token):
+    context.reset(token)
+
+class RepeatedErrorFilter(logging.Filter):
+    def __init__(self):
+        super().__init__()
+        self.lock = threading.Lock()
+        self.errors: dict[tuple, tuple[float, int]] = {} #key -> (time.monotonic() when it was last logged, times suppressed since)
+
+    @staticmethod
+    def error_key(record: logging.LogRecord) -> tuple:
+        if record.exc_info is None or record.exc_info[1] is None:
+            return (record.pathname, record.lineno, record.getMessage())
+        err = record.exc_info[1]
+        tb = err.__traceback__
+        while tb is not None and tb.tb_next is not None:
+            tb = tb.tb_next
+        return (type(err), str(err), tb.tb_frame.f_code.co_filename if tb is not None else None, tb.tb_lineno if tb is not None else None)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.ERROR:
+            return True
+        key = self.error_key(record)
+        now = time.monotonic()
+        with self.lock:
+            last = self.errors.get(key)
+            if last is not None and now - last[0] < ERROR_REPEAT_SECONDS:
+                self.errors[key] = (last[0], last[1] + 1)
+                return False
+            if last is not None and last[1] > 0:
+                record.repeated = last[1] #type: ignore
+            if len(self.errors) >= MAX_TRACKED_ERRORS: #that many different errors at once, so forgetting some counts doesn't matter
+                self.errors.clear()
+            self.errors[key] = (now, 0)
+        return True
+
+#only does what has to happen on the logging thread: the message is formatted and the context (plus any fields given to
+#log_err/log_info) is captured. the traceback and the json are left for the listener thread
+class ContextQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        record.context = context.get() | getattr(record, 'fields', {}) #type: ignore
+        return record
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time' : datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level' : record.levelname,
+            'logger' : record.name,
+            'message' : record.getMessage(),
+        }
+        entry |= getattr(record, 'context', {})
+        repeated = getattr(record, 'repeated', None)
+        if repeated is not None:
+            entry['suppressed_repeats'] = repeated
+        if record.exc_info is not None and record.exc_text is None: #the rotating handler formats every record twice
+            record.exc_text = "".join(traceback.format_exception(*record.exc_info)).rstrip()
+        if record.exc_text is not None:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+listener: logging.handlers.QueueListener|None = None
+queue_handler: ContextQueueHandler|None = None
+
+#routes every logger (discord.py's too) through the queue. called while the bot starts, before that errors only go to stderr.
+#only does anything the first time
+def setup(path: str = LOG_PATH, level: int = LOG_LEVEL):
+    global listener, queue_handler
+    if listener is not None:
+        return
+
+    file_handler = logging.handlers.RotatingFileHandler(path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8")
+    file_handler.setFormatter(JsonFormatter())
+    log_queue = queue.SimpleQueue()
+    queue_handler = ContextQueueHandler(log_queue)
+    queue_handler.addFilter(RepeatedErrorFilter())
+
+    root = logging.getLogger()
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    listener = logging.handlers.QueueListener(log_queue, file_handler)
+    listener.start()
+    atexit.register(stop)
+
+    logger.info("Logging session started.")
+
+#writes everything still queued
+def stop():
+    global listener, queue_handler
+    if listener is not None:
+        logging.getLogger().removeHandler(queue_handler) # type: ignore set along with listener
+        listener.stop()
+        listener = None
+        queue_handler = None
+
+def log_err(err: Exception, **fields):
+    logger.error(err, exc_info=err, extra={'fields' : fields} if len(fields) > 0 else None)
+
+def log_info(msg: str, **fields):
+    logger.info(msg, extra={'fields' : fields} if len(fields) > 0 else None)
 
-def log_err(err: Exception):
-    logger.exception(err)
\ No newline at end of file
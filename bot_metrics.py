@@ -0,0 +1,159 @@
+import bisect
+import math
+import threading
+import time
+from typing import TYPE_CHECKING, Callable
+if TYPE_CHECKING: #aiohttp.web is slow to import, so it is only imported once the server is started
+    from aiohttp import web
+
+#a small metrics registry, served on a local port in prometheus' text format (GET /metrics).
+#metrics are updated from the event loop and the database threads, so each one has its own lock
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 9464
+
+LATENCY_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+LATENESS_BUCKETS = [0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60, 300, 900, 3600]
+
+def escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def format_labels(label_names: tuple[str, ...], label_values: tuple[str, ...], extra: str = "") -> str:
+    labels = [f'{name}="{escape_label_value(value)}"' for name, value in zip(label_names, label_values)]
+    if extra != "":
+        labels.append(extra)
+    return f"{{{",".join(labels)}}}" if len(labels) > 0 else ""
+
+def format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str, label_names: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.lock = threading.Lock()
+
+    def render_samples(self) -> list[str]:
+        return []
+
+    def render(self) -> str:
+        return "\n".join([f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"] + self.render_samples())
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, label_names: tuple[str, ...] = ()):
+        super().__init__(name, help, label_names)
+        self.values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render_samples(self) -> list[str]:
+        with self.lock:
+            return [f"{self.name}{format_labels(self.label_names, label_values)} {format_value(value)}"
+                    for label_values, value in self.values.items()]
+
+#either set directly, or read from a function every time it is scraped
+class Gauge(Metric):
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, label_names: tuple[str, ...] = (), function: Callable[[], float]|None = None):
+        super().__init__(name, help, label_names)
+        self.values: dict[tuple[str, ...], float] = {}
+        self.function = function
+
+    def set(self, value: float, *label_values: str):
+        with self.lock:
+            self.values[label_values] = value
+
+    def render_samples(self) -> list[str]:
+        if self.function is not None:
+            return [f"{self.name} {format_value(self.function())}"]
+        with self.lock:
+            return [f"{self.name}{format_labels(self.label_names, label_values)} {format_value(value)}"
+                    for label_values, value in self.values.items()]
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, label_names: tuple[str, ...] = (), buckets: list[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, label_names)
+        self.buckets = buckets
+        self.counts: dict[tuple[str, ...], list[int]] = {} #per bucket, not cumulative, plus one for +Inf
+        self.sums: dict[tuple[str, ...], float] = {}
+
+    def observe(self, value: float, *label_values: str):
+        with self.lock:
+            counts = self.counts.get(label_values)
+            if counts is None:
+                counts = [0] * (len(self.buckets) + 1)
+                self.counts[label_values] = counts
+                self.sums[label_values] = 0.0
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.sums[label_values] += value
+
+    def render_samples(self) -> list[str]:
+        samples = []
+        with self.lock:
+            for label_values, counts in self.counts.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets + [math.inf], counts):
+                    cumulative += count
+                    samples.append(f"{self.name}_bucket{format_labels(self.label_names, label_values, f'le="{format_value(bound)}"')} {cumulative}")
+                samples.append(f"{self.name}_sum{format_labels(self.label_names, label_values)} {format_value(self.sums[label_values])}")
+                samples.append(f"{self.name}_count{format_labels(self.label_names, label_values)} {cumulative}")
+        return samples
+
+registry: list[Metric] = []
+
+def register[M: Metric](metric: M) -> M:
+    registry.append(metric)
+    return metric
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in registry) + "\n"
+
+#metrics kept by the rest of the bot. gauges that read other modules' state get their function set by those modules
+FIRING_LATENESS = register(Histogram("remindbot_firing_lateness_seconds", "How late reminders were sent, after they were due.",
+                                     buckets=LATENESS_BUCKETS))
+TICK_DURATION = register(Histogram("remindbot_tick_duration_seconds", "How long delivering one batch of due reminders took."))
+DB_CALL_DURATION = register(Histogram("remindbot_db_call_seconds", "Time spent running each database function on its thread.",
+                                      ("function",)))
+COMMAND_DURATION = register(Histogram("remindbot_command_seconds", "How long each command took to handle.", ("command",)))
+COMMAND_ERRORS = register(Counter("remindbot_command_errors_total", "Commands that replied with an error or raised.", ("command",)))
+COMMANDS_THROTTLED = register(Counter("remindbot_commands_throttled_total", "Commands turned away by bot_throttle before running.", ("reason",)))
+REMINDERS = register(Gauge("remindbot_reminders", "Reminders in the store."))
+DUE_BACKLOG = register(Gauge("remindbot_due_backlog", "Reminders that are due but haven't been handed to delivery yet."))
+OUTBOX = register(Gauge("remindbot_outbox_deliveries", "Reminders claimed for delivery that haven't been sent yet."))
+DELIVERIES_FINISHED = register(Counter("remindbot_deliveries_finished_total", "Deliveries taken out of the outbox, by how they ended.", ("state",)))
+TICK_API_CALLS = register(Gauge("remindbot_tick_api_calls", "Discord api calls made by the last delivery tick."))
+TIMEZONE_CACHE_HITS = register(Gauge("remindbot_timezone_cache_hits", "User timezone lookups answered from the cache since startup."))
+TIMEZONE_CACHE_MISSES = register(Gauge("remindbot_timezone_cache_misses", "User timezone lookups that had to read the database since startup."))
+TIMEZONE_CACHE_SIZE = register(Gauge("remindbot_timezone_cache_users", "Users whose timezone is cached."))
+
+#calls func, recording how long it took in histogram
+def timed(histogram: Histogram, label_value: str, func, *args):
+    started = time.perf_counter()
+    try:
+        return func(*args)
+    finally:
+        histogram.observe(time.perf_counter() - started, label_value)
+
+async def handle_metrics(request: 'web.Request') -> 'web.Response':
+    from aiohttp import web
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8", headers={"X-Content-Type-Options" : "nosniff"})
+
+async def start_server(port: int = METRICS_PORT, host: str = METRICS_HOST) -> 'web.AppRunner':
+    from aiohttp import web
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
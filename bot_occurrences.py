@@ -0,0 +1,122 @@
+import asyncio
+from collections import OrderedDict, deque
+from datetime import datetime
+import threading
+from zoneinfo import ZoneInfo
+import bot_timing as bt
+
+#the next few repeats of each repeating reminder, worked out ahead of time in the setter's timezone.
+#completing a reminder takes its next repeat from here instead of doing timezone math in the write transaction,
+#and listing reminders can show upcoming repeats for free. rings running low are refilled in the background
+OCCURRENCES_AHEAD = 8
+REFILL_BELOW = 2
+REFILL_BATCH_SIZE = 256
+REFILL_INTERVAL_SECONDS = 1
+MAX_RINGS = 100000
+
+class Occurrences:
+    def __init__(self, start_timestamp: int, interval_index: int, increment: int, zoneinfo: ZoneInfo|None, count: int):
+        self.start_timestamp = start_timestamp
+        self.interval_index = interval_index
+        self.increment = increment
+        self.zoneinfo = zoneinfo
+        self.count = count #repeat_increment_count the reminder is currently at
+        self.upcoming: deque[tuple[int, int]] = deque() #(repeat_increment_count, next_timestamp) of repeats after count
+
+    def matches(self, start_timestamp: int, interval_index: int, increment: int, zoneinfo: ZoneInfo|None) -> bool:
+        return (self.start_timestamp == start_timestamp and self.interval_index == interval_index and
+                self.increment == increment and self.zoneinfo == zoneinfo)
+
+    def move_to(self, count: int):
+        self.count = count
+        while len(self.upcoming) > 0 and self.upcoming[0][0] <= count:
+            self.upcoming.popleft()
+
+    #makes sure at least `ahead` repeats after count are known
+    def fill(self, ahead: int):
+        if len(self.upcoming) >= ahead:
+            return
+
+        start_time = datetime.fromtimestamp(self.start_timestamp, self.zoneinfo if self.zoneinfo is not None else bt.UTC)
+        next_count = self.upcoming[-1][0] + 1 if len(self.upcoming) > 0 else self.count + 1
+        interval_function = bt.TIME_INTERVAL_FUNCTIONS[self.interval_index]
+        while len(self.upcoming) < max(ahead, OCCURRENCES_AHEAD):
+            self.upcoming.append((next_count, int(interval_function(start_time, self.increment * next_count).timestamp())))
+            next_count += 1
+
+rings: OrderedDict[tuple[str, int], Occurrences] = OrderedDict()
+channel_names: dict[int, set[str]] = {}
+low_rings: set[tuple[str, int]] = set()
+lock = threading.Lock() #completions run on the bot_db_async writer thread
+
+#caller must hold lock
+def get_ring(name: str, channel_id: int, start_timestamp: int, interval_index: int, increment: int, zoneinfo: ZoneInfo|None,
+             count: int) -> Occurrences:
+    key = (name, channel_id)
+    ring = rings.get(key)
+    if ring is None or not ring.matches(start_timestamp, interval_index, increment, zoneinfo):
+        ring = Occurrences(start_timestamp, interval_index, increment, zoneinfo, count)
+        rings[key] = ring
+        channel_names.setdefault(channel_id, set()).add(name)
+        if len(rings) > MAX_RINGS:
+            forget(*next(iter(rings)))
+    rings.move_to_end(key)
+    ring.move_to(count)
+    if len(ring.upcoming) < REFILL_BELOW:
+        low_rings.add(key)
+    return ring
+
+#(new count, next_timestamp) for the repeat after `count`, if it is precomputed and not already in the past.
+#otherwise None, and the caller works it out and reports it back with moved_to
+def take_next(name: str, channel_id: int, start_timestamp: int, interval_index: int, increment: int, zoneinfo: ZoneInfo|None,
+              count: int, now_timestamp: int) -> tuple[int, int]|None:
+    with lock:
+        ring = get_ring(name, channel_id, start_timestamp, interval_index, increment, zoneinfo, count)
+        if len(ring.upcoming) == 0 or ring.upcoming[0][0] != count + 1 or ring.upcoming[0][1] <= now_timestamp:
+            return None
+        next_count, next_timestamp = ring.upcoming[0]
+        ring.move_to(next_count)
+        if len(ring.upcoming) < REFILL_BELOW:
+            low_rings.add((name, channel_id))
+        return (next_count, next_timestamp)
+
+def moved_to(name: str, channel_id: int, start_timestamp: int, interval_index: int, increment: int, zoneinfo: ZoneInfo|None, count: int):
+    with lock:
+        get_ring(name, channel_id, start_timestamp, interval_index, increment, zoneinfo, count)
+
+#timestamps of the n repeats after `count`, computing any that aren't known yet
+def get_upcoming(name: str, channel_id: int, start_timestamp: int, interval_index: int, increment: int, zoneinfo: ZoneInfo|None,
+                 count: int, n: int) -> list[int]:
+    with lock:
+        ring = get_ring(name, channel_id, start_timestamp, interval_index, increment, zoneinfo, count)
+        ring.fill(n)
+        return [timestamp for _, timestamp in list(ring.upcoming)[:n]]
+
+#caller must hold lock
+def forget(name: str, channel_id: int):
+    rings.pop((name, channel_id), None)
+    low_rings.discard((name, channel_id))
+    names = channel_names.get(channel_id)
+    if names is not None:
+        names.discard(name)
+        if len(names) == 0:
+            del channel_names[channel_id]
+
+#reminder listener for bot_store
+def on_reminder_changed(name: str|None, channel_id: int, next_timestamp: int|None):
+    if next_timestamp is not None:
+        return
+    with lock:
+        for removed_name in ([name] if name is not None else list(channel_names.get(channel_id, set()))):
+            forget(removed_name, channel_id)
+
+async def refill_forever():
+    while True:
+        await asyncio.sleep(REFILL_INTERVAL_SECONDS)
+        while len(low_rings) > 0:
+            with lock:
+                for _ in range(min(REFILL_BATCH_SIZE, len(low_rings))):
+                    ring = rings.get(low_rings.pop())
+                    if ring is not None:
+                        ring.fill(OCCURRENCES_AHEAD)
+            await asyncio.sleep(0) #let everything else run between batches
@@ -1,3 +1,4 @@
+import functools
 import bot_response as br
 import discord
 
@@ -15,9 +16,10 @@ def make_lacking_perms_response(command_name: str, user_name: str, perms_needed:
 EDIT_REMINDERS = discord.Permissions(
     manage_messages = True
 )
-def make_admin():
+#every permission, for dm channels. built on first use
+@functools.cache
+def get_admin() -> discord.Permissions:
     admin = discord.Permissions()
     for name, _ in admin:
         setattr(admin, name, True)
-    return admin
-ADMIN = make_admin()
\ No newline at end of file
+    return admin
\ No newline at end of file
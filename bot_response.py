@@ -5,12 +5,14 @@ EMBED_COLOR_WARNING = 0xe3c714
 EMBED_COLOR_GOOD = 0x22e314
 
 class Response:
-    def __init__(self, title: str, txt: str = '', is_error: bool = False, notes: list[str]|None = None, warnings: list[str]|None = None):
+    def __init__(self, title: str, txt: str = '', is_error: bool = False, notes: list[str]|None = None, warnings: list[str]|None = None,
+                 view: discord.ui.View|None = None):
         self.title = title
         self.txt = txt
         self.is_error = is_error
         self.notes = notes if notes is not None else []
         self.warnings = warnings if warnings is not None else []
+        self.view = view #buttons sent along with the embed
 
     def make_embed(self) -> discord.embeds.Embed:
         title = f"Error: {self.title}" if self.is_error else self.title
@@ -29,4 +31,16 @@ class Response:
         embed=discord.Embed(title=title[:256], #slice because title cannot be longer than 64 chars
                             description=txt[:4096], #title cannot be longer than 4096 chars
                             color=color)
-        return embed
\ No newline at end of file
+        return embed
+
+#a response that is the same every time (help, "no reminders"), so its embed is built once and the same one is sent every time.
+#discord.py only reads embeds while sending, but nothing may change one after it was built
+class StaticResponse(Response):
+    def __init__(self, title: str, txt: str = '', is_error: bool = False, notes: list[str]|None = None, warnings: list[str]|None = None):
+        super().__init__(title, txt, is_error, notes, warnings)
+        self.embed: discord.embeds.Embed|None = None
+
+    def make_embed(self) -> discord.embeds.Embed:
+        if self.embed is None:
+            self.embed = super().make_embed()
+        return self.embed
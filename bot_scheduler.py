@@ -0,0 +1,155 @@
+import asyncio
+import heapq
+import threading
+import time
+from typing import Awaitable, Callable
+import bot_store as bst
+import bot_metrics as bm
+
+#keeps a min-heap of (next_timestamp, name, channel_id) and sleeps until the earliest one is due.
+#entries are never removed from the heap directly; an entry is stale if it doesn't match deadlines[(name, channel_id)]
+class Scheduler:
+    def __init__(self):
+        self.heap: list[tuple[int, str, int]] = []
+        self.deadlines: dict[tuple[str, int], int] = {}
+        self.channel_names: dict[int, set[str]] = {}
+        self.lock = threading.Lock() #store listeners can be called from other threads
+        self.loop: asyncio.AbstractEventLoop|None = None
+        self.wake_event: asyncio.Event|None = None
+
+    def load(self):
+        with self.lock:
+            self.heap.clear()
+            self.deadlines.clear()
+            self.channel_names.clear()
+            for next_timestamp, name, channel_id in bst.get_schedule():
+                self.deadlines[(name, channel_id)] = next_timestamp
+                self.channel_names.setdefault(channel_id, set()).add(name)
+                self.heap.append((next_timestamp, name, channel_id))
+            heapq.heapify(self.heap)
+        self.wake()
+
+    def wake(self):
+        if self.loop is None or self.wake_event is None:
+            return
+        try:
+            if self.loop is asyncio.get_running_loop():
+                self.wake_event.set()
+                return
+        except RuntimeError:
+            pass
+        self.loop.call_soon_threadsafe(self.wake_event.set)
+
+    #caller must hold self.lock
+    def _earliest(self) -> int|None:
+        while len(self.heap) > 0:
+            next_timestamp, name, channel_id = self.heap[0]
+            if self.deadlines.get((name, channel_id)) == next_timestamp:
+                return next_timestamp
+            heapq.heappop(self.heap) #stale
+        return None
+
+    #caller must hold self.lock
+    def _compact(self):
+        if len(self.heap) > 2 * len(self.deadlines) + 64:
+            self.heap = [(t, name, channel_id) for (name, channel_id), t in self.deadlines.items()]
+            heapq.heapify(self.heap)
+
+    def set(self, name: str, channel_id: int, next_timestamp: int):
+        with self.lock:
+            earliest = self._earliest()
+            self.deadlines[(name, channel_id)] = next_timestamp
+            self.channel_names.setdefault(channel_id, set()).add(name)
+            heapq.heappush(self.heap, (next_timestamp, name, channel_id))
+            self._compact()
+        if earliest is None or next_timestamp < earliest:
+            self.wake()
+
+    def remove(self, name: str, channel_id: int):
+        with self.lock:
+            earliest = self._earliest()
+            next_timestamp = self.deadlines.pop((name, channel_id), None)
+            names = self.channel_names.get(channel_id)
+            if names is not None:
+                names.discard(name)
+                if len(names) == 0:
+                    del self.channel_names[channel_id]
+            self._compact()
+        if next_timestamp is not None and next_timestamp == earliest:
+            self.wake()
+
+    def remove_channel(self, channel_id: int):
+        with self.lock:
+            earliest = self._earliest()
+            removed = [self.deadlines.pop((name, channel_id)) for name in self.channel_names.pop(channel_id, set())]
+            self._compact()
+        if earliest in removed:
+            self.wake()
+
+    #reminder listener for bot_store, name is None when every reminder in the channel was removed
+    def on_reminder_changed(self, name: str|None, channel_id: int, next_timestamp: int|None):
+        if name is None:
+            self.remove_channel(channel_id)
+        elif next_timestamp is None:
+            self.remove(name, channel_id)
+        else:
+            self.set(name, channel_id, next_timestamp)
+
+    #removes and returns the keys of every reminder due at or before now
+    def pop_due(self, now: float) -> list[tuple[str, int]]:
+        due = []
+        with self.lock:
+            while True:
+                earliest = self._earliest()
+                if earliest is None or earliest > now:
+                    break
+                _, name, channel_id = heapq.heappop(self.heap)
+                del self.deadlines[(name, channel_id)]
+                names = self.channel_names[channel_id]
+                names.discard(name)
+                if len(names) == 0:
+                    del self.channel_names[channel_id]
+                due.append((name, channel_id))
+        return due
+
+    #how many reminders are due at or before now but haven't been popped, without popping them.
+    #only the part of the heap at or before now is walked (a child is never earlier than its parent)
+    def count_due(self, now: float) -> int:
+        count = 0
+        with self.lock:
+            to_visit = [0]
+            while len(to_visit) > 0:
+                i = to_visit.pop()
+                if i >= len(self.heap) or self.heap[i][0] > now:
+                    continue
+                next_timestamp, name, channel_id = self.heap[i]
+                if self.deadlines.get((name, channel_id)) == next_timestamp:
+                    count += 1
+                to_visit += [2 * i + 1, 2 * i + 2]
+        return count
+
+    def time_until_next(self, now: float) -> float|None:
+        with self.lock:
+            earliest = self._earliest()
+        return None if earliest is None else max(0.0, earliest - now)
+
+    #runs forever, calling deliver with the keys of due reminders. sleeps without polling while nothing is due
+    async def run(self, deliver: Callable[[list[tuple[str, int]]], Awaitable[None]]):
+        self.loop = asyncio.get_running_loop()
+        self.wake_event = asyncio.Event()
+        while True:
+            self.wake_event.clear()
+            due = self.pop_due(time.time())
+            if len(due) > 0:
+                await deliver(due)
+                continue
+
+            delay = self.time_until_next(time.time())
+            try:
+                await asyncio.wait_for(self.wake_event.wait(), delay)
+            except TimeoutError:
+                pass
+
+scheduler = Scheduler()
+bst.reminder_listeners.append(scheduler.on_reminder_changed)
+bm.DUE_BACKLOG.function = lambda: scheduler.count_due(time.time())
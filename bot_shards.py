@@ -0,0 +1,18 @@
+#which discord shards this process runs. every reminder belongs to the shard of its guild, and reminders in dms
+#(no guild) belong to shard 0, which is the shard discord sends dms to. a process only loads and fires the reminders
+#of its own shards, so running one process per group of shards never fires a reminder twice
+shard_count = 1
+shard_ids: list[int]|None = None #None means every shard
+
+def configure(count: int, ids: list[int]|None):
+    global shard_count, shard_ids
+    shard_count = count
+    shard_ids = ids
+
+def shard_for(guild_id: int|None) -> int:
+    if guild_id is None:
+        return 0
+    return (guild_id >> 22) % shard_count #how discord assigns guilds to shards
+
+def owns(guild_id: int|None) -> bool:
+    return shard_ids is None or shard_for(guild_id) in shard_ids
@@ -0,0 +1,592 @@
+import bisect
+from datetime import datetime
+import sys
+import threading
+import time
+from typing import Callable
+import bot_timing as bt
+import bot_db as bd
+import bot_blobs as bb
+import bot_occurrences as bo
+import bot_shards as bsh
+import bot_metrics as bm
+
+#every reminder of this process's shards lives in memory, and that copy is the authoritative one: commands and deliveries
+#read it without touching disk. sqlite is a write-behind journal, changes are only queued here and group committed
+#by flush() every few milliseconds (bot_db_async arms the timer). on startup load() reads the journal back.
+#a crash can lose at most the changes made since the last flush
+JOURNAL_FLUSH_SECONDS = 0.005
+JOURNAL_RETRY_SECONDS = 1
+MAX_REMINDERS = 1000000 #new reminders are refused past this, so memory stays bounded
+
+class Reminder:
+    __slots__ = ('name', 'channel_id', 'guild_id', 'reply_message_id', 'setter_user_id', 'start_timestamp', 'next_timestamp',
+                 'has_repeat', 'repeat_interval_index', 'repeat_interval_increment', 'repeat_increment_count', 'missed_policy')
+
+    def __init__(self, name: str, channel_id: int, guild_id: int|None, reply_message_id: int|None, setter_user_id: int,
+                 start_timestamp: int, next_timestamp: int, has_repeat: bool, repeat_interval_index: int|None,
+                 repeat_interval_increment: int|None, repeat_increment_count: int|None, missed_policy: int|None):
+        self.name = name
+        self.channel_id = channel_id
+        self.guild_id = guild_id
+        self.reply_message_id = reply_message_id
+        self.setter_user_id = setter_user_id
+        self.start_timestamp = start_timestamp
+        self.next_timestamp = next_timestamp
+        self.has_repeat = has_repeat
+        self.repeat_interval_index = repeat_interval_index
+        self.repeat_interval_increment = repeat_interval_increment
+        self.repeat_increment_count = repeat_increment_count
+        self.missed_policy = missed_policy
+
+    #records are never changed once stored (they are handed out to other threads), updates store a moved copy instead
+    def moved_to(self, next_timestamp: int, repeat_increment_count: int) -> 'Reminder':
+        return Reminder(self.name, self.channel_id, self.guild_id, self.reply_message_id, self.setter_user_id,
+                        self.start_timestamp, next_timestamp, self.has_repeat, self.repeat_interval_index,
+                        self.repeat_interval_increment, repeat_increment_count, self.missed_policy)
+
+    def with_guild(self, guild_id: int) -> 'Reminder':
+        return Reminder(self.name, self.channel_id, guild_id, self.reply_message_id, self.setter_user_id, self.start_timestamp,
+                        self.next_timestamp, self.has_repeat, self.repeat_interval_index, self.repeat_interval_increment,
+                        self.repeat_increment_count, self.missed_policy)
+
+    def to_row(self) -> bd.ReminderRow:
+        return (self.name, self.channel_id, self.guild_id, self.reply_message_id, self.setter_user_id, self.start_timestamp,
+                self.next_timestamp, self.has_repeat, self.repeat_interval_index, self.repeat_interval_increment,
+                self.repeat_increment_count, self.missed_policy)
+
+#a reminder claimed for sending, see claim_reminders. one-off reminders stay in the store until theirs is finished,
+#and repeating ones are advanced when they are claimed
+DELIVERY_PENDING = 0
+DELIVERY_SENT = 1
+DELIVERY_FAILED = 2 #gave up after MAX_DELIVERY_ATTEMPTS
+DELIVERY_STATE_NAMES = ["pending", "sent", "failed"]
+MAX_DELIVERY_ATTEMPTS = 12
+DELIVERY_RETRY_SECONDS = 5
+DELIVERY_RETENTION_SECONDS = 24 * 60 * 60 #finished deliveries are kept on disk this long
+
+class Delivery:
+    __slots__ = ('name', 'channel_id', 'repeat_increment_count', 'due_timestamp', 'state', 'attempts', 'retry_at', 'durable', 'sending',
+                 'batch_nonce')
+
+    def __init__(self, name: str, channel_id: int, repeat_increment_count: int, due_timestamp: int, state: int = DELIVERY_PENDING,
+                 attempts: int = 0, durable: bool = False, batch_nonce: str|None = None):
+        self.name = name
+        self.channel_id = channel_id
+        self.repeat_increment_count = repeat_increment_count #with (name, channel_id), what makes the delivery idempotent
+        self.due_timestamp = due_timestamp
+        self.state = state
+        self.attempts = attempts
+        self.retry_at = 0.0 #time.time() before which it isn't sent again
+        self.durable = durable #whether its claim has been flushed. nothing is sent before that
+        self.sending = False
+        self.batch_nonce = batch_nonce #of the message it is sent in, None until it has been put in one (see set_batch_nonces)
+
+    def to_row(self) -> bd.DeliveryRow:
+        return (self.channel_id, self.name, self.repeat_increment_count, self.due_timestamp, self.state, self.attempts, int(time.time()),
+                self.batch_nonce)
+
+reminders: dict[tuple[int, str], Reminder] = {} #(channel_id, name) -> reminder
+channel_reminders: dict[int, dict[str, Reminder]] = {} #channel_id -> name -> reminder
+channel_order: dict[int, list[tuple[int, str]]] = {} #channel_id -> sorted (next_timestamp, name), for paging through a channel
+guild_channels: dict[int, set[int]] = {} #guild_id -> channels with reminders, for purging a guild the bot left
+outbox: dict[tuple[int, str], dict[int, Delivery]] = {} #(channel_id, name) -> repeat_increment_count -> pending delivery
+lock = threading.Lock() #records are read on the event loop and changed on the bot_db_async writer thread
+bm.REMINDERS.function = lambda: len(reminders)
+bm.OUTBOX.function = lambda: sum(len(deliveries) for deliveries in outbox.values())
+
+#what has to be written for a key at the next flush. an insert replaces whatever row the key had on disk
+JOURNAL_INSERT = 0
+JOURNAL_UPDATE = 1
+JOURNAL_DELETE = 2
+
+pending: dict[tuple[int, str], int] = {}
+pending_snapshots: dict[tuple[int, str], bb.MessageSnapshot] = {}
+#whole channels and guilds to delete at the next flush, before any of the ops above (which are all newer)
+purged_channels: set[int] = set()
+purged_guilds: dict[int, set[int]] = {} #guild_id -> the channels it had
+pending_deliveries: dict[tuple[int, str], dict[int, Delivery]] = {} #deliveries whose state has to be written, keyed like outbox
+flush_lock = threading.Lock() #flush is also called on shutdown, outside the writer thread
+
+#the op that writes both older and then newer. a row inserted and then updated before being flushed still needs inserting
+def merge_journal_ops(older: int, newer: int) -> int:
+    if older == JOURNAL_INSERT and newer == JOURNAL_UPDATE:
+        return JOURNAL_INSERT
+    return newer
+
+#caller must hold lock
+def journal(key: tuple[int, str], op: int):
+    pending[key] = merge_journal_ops(pending[key], op) if key in pending else op
+    if op == JOURNAL_DELETE:
+        pending_snapshots.pop(key, None)
+
+#caller must hold lock
+def journal_delivery(delivery: Delivery):
+    pending_deliveries.setdefault((delivery.channel_id, delivery.name), {})[delivery.repeat_increment_count] = delivery
+
+#caller must hold lock
+def forget_deliveries(key: tuple[int, str]):
+    outbox.pop(key, None)
+    pending_deliveries.pop(key, None)
+
+def has_pending() -> bool:
+    return len(pending) > 0 or len(purged_channels) > 0 or len(purged_guilds) > 0 or len(pending_deliveries) > 0
+
+#caller must hold lock
+def is_purge_pending(channel_id: int) -> bool:
+    return channel_id in purged_channels or any(channel_id in channel_ids for channel_ids in purged_guilds.values())
+
+#writes everything queued since the last flush in one transaction. must run on the bot_db_async writer thread
+def flush():
+    with flush_lock:
+        with lock:
+            batch = pending.copy()
+            batch_snapshots = pending_snapshots.copy()
+            batch_purged_channels = purged_channels.copy()
+            batch_purged_guilds = purged_guilds.copy()
+            batch_deliveries = [delivery for deliveries in pending_deliveries.values() for delivery in deliveries.values()]
+            pending.clear()
+            pending_snapshots.clear()
+            purged_channels.clear()
+            purged_guilds.clear()
+            pending_deliveries.clear()
+            inserts = [reminders[key].to_row() for key, op in batch.items() if op == JOURNAL_INSERT]
+            updates = [(reminders[key].next_timestamp, reminders[key].repeat_increment_count, key[1], key[0])
+                       for key, op in batch.items() if op == JOURNAL_UPDATE]
+            deletes = [(key[1], key[0]) for key, op in batch.items() if op == JOURNAL_DELETE]
+            delivery_rows = [delivery.to_row() for delivery in batch_deliveries]
+        if len(batch) == 0 and len(batch_purged_channels) == 0 and len(batch_purged_guilds) == 0 and len(batch_deliveries) == 0:
+            return
+
+        try:
+            bd.write_reminders(inserts, updates, deletes, {(key[1], key[0]) : snapshot for key, snapshot in batch_snapshots.items()},
+                               list(batch_purged_channels), list(batch_purged_guilds), delivery_rows)
+        except Exception:
+            with lock: #put the batch back in front of whatever was queued since
+                for key, op in batch.items():
+                    if is_purge_pending(key[0]): #purged since, which is written first anyway
+                        continue
+                    pending[key] = merge_journal_ops(op, pending[key]) if key in pending else op
+                    if key in batch_snapshots and pending[key] == JOURNAL_INSERT and key not in pending_snapshots:
+                        pending_snapshots[key] = batch_snapshots[key]
+                purged_channels.update(batch_purged_channels)
+                for guild_id, channel_ids in batch_purged_guilds.items():
+                    purged_guilds.setdefault(guild_id, set()).update(channel_ids)
+                for delivery in batch_deliveries:
+                    key = (delivery.channel_id, delivery.name)
+                    if key in reminders and delivery.repeat_increment_count not in pending_deliveries.get(key, {}): #not removed or changed since
+                        journal_delivery(delivery)
+            raise
+
+        with lock:
+            for delivery in batch_deliveries:
+                delivery.durable = True
+
+#the snapshot of a reminder that was set since the last flush. (whether it is pending, the snapshot)
+def get_pending_snapshot(name: str, channel_id: int) -> tuple[bool, bb.MessageSnapshot|None]:
+    with lock:
+        key = (channel_id, name)
+        if pending.get(key) != JOURNAL_INSERT:
+            return (False, None)
+        return (True, pending_snapshots.get(key))
+
+#called with (name, channel_id, next_timestamp) after a reminder changes in memory.
+#next_timestamp is None if the reminder was removed, and name is None if every reminder in the channel was removed
+reminder_listeners: list[Callable[[str|None, int, int|None], None]] = [bo.on_reminder_changed]
+
+def notify_reminder_changed(name: str|None, channel_id: int, next_timestamp: int|None):
+    for listener in reminder_listeners:
+        listener(name, channel_id, next_timestamp)
+
+#caller must hold lock
+def store(reminder: Reminder):
+    key = (reminder.channel_id, reminder.name)
+    old = reminders.get(key)
+    reminders[key] = reminder
+    channel_reminders.setdefault(reminder.channel_id, {})[reminder.name] = reminder
+    if reminder.guild_id is not None:
+        guild_channels.setdefault(reminder.guild_id, set()).add(reminder.channel_id)
+    order = channel_order.setdefault(reminder.channel_id, [])
+    if old is not None:
+        del order[bisect.bisect_left(order, (old.next_timestamp, old.name))]
+    bisect.insort(order, (reminder.next_timestamp, reminder.name))
+
+#caller must hold lock
+def unstore(name: str, channel_id: int):
+    reminder = reminders.pop((channel_id, name))
+    forget_deliveries((channel_id, name))
+    names = channel_reminders[channel_id]
+    del names[name]
+    order = channel_order[channel_id]
+    del order[bisect.bisect_left(order, (reminder.next_timestamp, name))]
+    if len(names) == 0:
+        del channel_reminders[channel_id]
+        del channel_order[channel_id]
+        forget_guild_channel(reminder.guild_id, channel_id)
+
+#caller must hold lock
+def forget_guild_channel(guild_id: int|None, channel_id: int):
+    channel_ids = guild_channels.get(guild_id) if guild_id is not None else None
+    if channel_ids is not None:
+        channel_ids.discard(channel_id)
+        if len(channel_ids) == 0:
+            del guild_channels[guild_id] # type: ignore guild_id can't be None here
+
+#removes every reminder in the channel from memory and drops their queued writes, the caller queues the purge.
+#caller must hold lock
+def unstore_channel(channel_id: int):
+    names = channel_reminders.pop(channel_id, None)
+    if names is None:
+        return
+    del channel_order[channel_id]
+    for name, reminder in names.items():
+        del reminders[(channel_id, name)]
+        forget_deliveries((channel_id, name))
+        pending.pop((channel_id, name), None)
+        pending_snapshots.pop((channel_id, name), None)
+        forget_guild_channel(reminder.guild_id, channel_id)
+
+def load():
+    rows = bd.get_every_reminder(bsh.shard_count, bsh.shard_ids)
+    delivery_rows = bd.get_pending_deliveries(DELIVERY_PENDING, bsh.shard_count, bsh.shard_ids)
+    with lock:
+        reminders.clear()
+        channel_reminders.clear()
+        channel_order.clear()
+        guild_channels.clear()
+        pending.clear()
+        pending_snapshots.clear()
+        purged_channels.clear()
+        purged_guilds.clear()
+        outbox.clear()
+        pending_deliveries.clear()
+        for row in rows: #sorted once at the end instead of inserted in order
+            reminder = Reminder(*row)
+            reminders[(reminder.channel_id, reminder.name)] = reminder
+            channel_reminders.setdefault(reminder.channel_id, {})[reminder.name] = reminder
+            channel_order.setdefault(reminder.channel_id, []).append((reminder.next_timestamp, reminder.name))
+            if reminder.guild_id is not None:
+                guild_channels.setdefault(reminder.guild_id, set()).add(reminder.channel_id)
+        for order in channel_order.values():
+            order.sort()
+        for channel_id, name, repeat_increment_count, due_timestamp, state, attempts, _, batch_nonce in delivery_rows: #claimed before a restart
+            outbox.setdefault((channel_id, name), {})[repeat_increment_count] = Delivery(name, channel_id, repeat_increment_count, due_timestamp,
+                                                                                          state, attempts, True, batch_nonce)
+
+class ReminderAlreadyExistsError(Exception):
+    pass
+class TooManyRemindersError(Exception):
+    pass
+
+#must run on the bot_db_async writer thread, like collect_blobs, so a snapshot's blobs can't be collected before it is flushed
+def set_reminder(name: str, channel_id: int, reply_message_id: int|None, user_id: int,
+                 start_time: datetime, repeat_interval_index: int|None, repeat_interval_increment: int|None,
+                 missed_policy: int|None = None, snapshot: bb.MessageSnapshot|None = None, guild_id: int|None = None):
+    if snapshot is not None:
+        bd.check_snapshot_blobs(snapshot)
+
+    start_timestamp = int(start_time.timestamp())
+    with lock:
+        if (channel_id, name) in reminders:
+            raise ReminderAlreadyExistsError(f"Reminder with name '{name}' already exists in this channel")
+        if len(reminders) >= MAX_REMINDERS:
+            raise TooManyRemindersError("The bot has too many reminders to add another one")
+
+        store(Reminder(name, channel_id, guild_id, reply_message_id, user_id, start_timestamp, start_timestamp,
+                       repeat_interval_index is not None, repeat_interval_index, repeat_interval_increment, 0, missed_policy))
+        journal((channel_id, name), JOURNAL_INSERT)
+        if snapshot is not None:
+            pending_snapshots[(channel_id, name)] = snapshot
+    notify_reminder_changed(name, channel_id, start_timestamp)
+
+#for bulk imports (see bot_imports). reminders whose key is already taken are skipped, and it stops at the first one that doesn't
+#fit under MAX_REMINDERS. the channels they go into are sorted once at the end instead of inserted into one at a time.
+#returns (how many were gone through, skipped or added, before the store was full, how many were added)
+def import_reminders(new_reminders: list[Reminder]) -> tuple[int, int]:
+    added = []
+    done = 0
+    with lock:
+        touched_orders = set()
+        for reminder in new_reminders:
+            key = (reminder.channel_id, reminder.name)
+            if key in reminders:
+                done += 1
+                continue
+            if len(reminders) >= MAX_REMINDERS:
+                break
+            done += 1
+            reminders[key] = reminder
+            channel_reminders.setdefault(reminder.channel_id, {})[reminder.name] = reminder
+            if reminder.guild_id is not None:
+                guild_channels.setdefault(reminder.guild_id, set()).add(reminder.channel_id)
+            channel_order.setdefault(reminder.channel_id, []).append((reminder.next_timestamp, reminder.name))
+            touched_orders.add(reminder.channel_id)
+            journal(key, JOURNAL_INSERT)
+            added.append(reminder)
+        for channel_id in touched_orders:
+            channel_order[channel_id].sort()
+
+    for reminder in added:
+        notify_reminder_changed(reminder.name, reminder.channel_id, reminder.next_timestamp)
+    return (done, len(added))
+
+class ReminderDoesntExistError(Exception):
+    pass
+
+def remove_reminder(name: str, channel_id: int):
+    with lock:
+        if (channel_id, name) not in reminders:
+            raise ReminderDoesntExistError(f"Reminder with name '{name}' doesn't exist in this channel")
+        unstore(name, channel_id)
+        journal((channel_id, name), JOURNAL_DELETE)
+    notify_reminder_changed(name, channel_id, None)
+
+def remove_all_reminders(channel_id: int):
+    remove_channels_reminders([channel_id])
+
+#the channels' rows are deleted with one statement each at the next flush
+def remove_channels_reminders(channel_ids: list[int]):
+    with lock:
+        for channel_id in channel_ids:
+            unstore_channel(channel_id)
+            purged_channels.add(channel_id)
+    for channel_id in channel_ids:
+        notify_reminder_changed(None, channel_id, None)
+
+#for a guild the bot was removed from. its rows are deleted with one statement (by the guild_id index) at the next flush.
+#reminders set before guild ids were stored aren't found this way until reconciliation has filled in their guild
+def remove_guild_reminders(guild_id: int):
+    with lock:
+        channel_ids = guild_channels.pop(guild_id, set())
+        for channel_id in channel_ids:
+            unstore_channel(channel_id)
+        purged_guilds.setdefault(guild_id, set()).update(channel_ids)
+    for channel_id in channel_ids:
+        notify_reminder_changed(None, channel_id, None)
+
+#(channel_id, guild_id) of every channel with reminders. guild_id is None in dms (and for reminders set before guild ids were stored)
+def get_channels() -> list[tuple[int, int|None]]:
+    with lock:
+        return [(channel_id, next(iter(names.values())).guild_id) for channel_id, names in channel_reminders.items()]
+
+#fills in the guild of reminders set before guild ids were stored, once reconciliation has found their channel.
+#written straight away rather than journaled, since the journal only updates timestamps. must run on the writer thread
+def set_channel_guilds(channel_guilds: list[tuple[int, int]]):
+    with lock:
+        for channel_id, guild_id in channel_guilds:
+            names = channel_reminders.get(channel_id)
+            if names is None:
+                continue
+            for name, reminder in list(names.items()):
+                if reminder.guild_id is None:
+                    names[name] = reminders[(channel_id, name)] = reminder.with_guild(guild_id)
+            guild_channels.setdefault(guild_id, set()).add(channel_id)
+    bd.set_channel_guilds(channel_guilds)
+
+def get_reminder(name: str, channel_id: int) -> Reminder|None:
+    return reminders.get((channel_id, name))
+
+#reminders removed since are left out
+def get_reminders(keys: list[tuple[str, int]]) -> list[Reminder]:
+    with lock:
+        return [reminder for name, channel_id in keys if (reminder := reminders.get((channel_id, name))) is not None]
+
+def count_reminders(channel_id: int) -> int:
+    return len(channel_reminders.get(channel_id, {}))
+
+#one page of a channel's reminders in (next_timestamp, name) order: the first limit after cursor (from the start if it's None),
+#or with before, the last limit before it (up to the end if it's None). cursor is a (next_timestamp, name) that doesn't have
+#to exist anymore. returns (reminders, index of the first one in the channel, reminders in the channel)
+def get_reminder_page(channel_id: int, cursor: tuple[int, str]|None, before: bool, limit: int) -> tuple[list[Reminder], int, int]:
+    with lock:
+        order = channel_order.get(channel_id, [])
+        if before:
+            end = bisect.bisect_left(order, cursor) if cursor is not None else len(order)
+            start = max(0, end - limit)
+        else:
+            start = bisect.bisect_right(order, cursor) if cursor is not None else 0
+            end = min(len(order), start + limit)
+        names = channel_reminders.get(channel_id, {})
+        return ([names[name] for _, name in order[start:end]], start, len(order))
+
+#(next_timestamp, name, channel_id) of every reminder, for the scheduler
+def get_schedule() -> list[tuple[int, str, int]]:
+    with lock:
+        return [(reminder.next_timestamp, reminder.name, reminder.channel_id) for reminder in reminders.values()]
+
+#claims every due reminder for delivery and advances it, in one transaction: each gets a pending delivery keyed by
+#(name, channel_id, repeat_increment_count) in the outbox, repeating reminders move to their next repeat (skipping missed
+#repeats as their missed policy says) and one-off reminders stay until their delivery is finished. repeats missed under the
+#skip policy are advanced without a delivery. keys are (name, channel_id). runs on the writer thread, since users' timezones
+#may have to be read from disk, and flushes before returning so nothing claimed is sent before the claim is on disk.
+#returns (deliveries claimed, repeats skipped)
+def claim_reminders(keys: list[tuple[str, int]], now: datetime) -> tuple[list[Delivery], int]:
+    now_timestamp = int(now.timestamp())
+    due = [reminder for reminder in get_reminders(keys) if reminder.next_timestamp <= now_timestamp]
+    zoneinfos = bd.get_user_zoneinfos(list({reminder.setter_user_id for reminder in due if reminder.has_repeat}), bd.read_conn().cursor())
+
+    moved = []
+    for reminder in due:
+        if not reminder.has_repeat:
+            continue
+        zoneinfo = zoneinfos[reminder.setter_user_id]
+        precomputed = bo.take_next(reminder.name, reminder.channel_id, reminder.start_timestamp, reminder.repeat_interval_index,
+                                   reminder.repeat_interval_increment, zoneinfo, reminder.repeat_increment_count, now_timestamp) # type: ignore (repeat values can't be null here)
+        if precomputed is not None:
+            new_repeat_interval_count, next_timestamp = precomputed
+            moved.append(reminder.moved_to(next_timestamp, new_repeat_interval_count))
+            continue
+
+        #repeats were missed (or nothing was precomputed yet)
+        start_time = datetime.fromtimestamp(reminder.start_timestamp, zoneinfo if zoneinfo is not None else bt.UTC)
+        new_repeat_interval_count = bt.next_increment_count(start_time, reminder.repeat_interval_index, reminder.repeat_interval_increment, # type: ignore
+                                                            reminder.repeat_increment_count, now, # type: ignore
+                                                            reminder.missed_policy if reminder.missed_policy is not None else bt.DEFAULT_MISSED_POLICY)
+        next_time = bt.TIME_INTERVAL_FUNCTIONS[reminder.repeat_interval_index](start_time, reminder.repeat_interval_increment * new_repeat_interval_count) # type: ignore
+        moved.append(reminder.moved_to(int(next_time.timestamp()), new_repeat_interval_count))
+        bo.moved_to(reminder.name, reminder.channel_id, reminder.start_timestamp, reminder.repeat_interval_index, # type: ignore
+                    reminder.repeat_interval_increment, zoneinfo, new_repeat_interval_count) # type: ignore
+
+    moved_by_key = {(reminder.channel_id, reminder.name) : reminder for reminder in moved}
+    claimed = []
+    skipped = 0
+    changed = []
+    with lock:
+        for reminder in due:
+            key = (reminder.channel_id, reminder.name)
+            if reminders.get(key) is not reminder: #removed or set again while this was worked out
+                continue
+            count = reminder.repeat_increment_count if reminder.repeat_increment_count is not None else 0
+            if count in outbox.get(key, {}): #claimed before a restart, the outbox still has it
+                continue
+
+            missed_policy = reminder.missed_policy if reminder.missed_policy is not None else bt.DEFAULT_MISSED_POLICY
+            if reminder.has_repeat and missed_policy == bt.MISSED_SKIP and now_timestamp - reminder.next_timestamp > bt.MISSED_GRACE_SECONDS:
+                skipped += 1 #missed while the bot was down
+            else:
+                delivery = Delivery(reminder.name, reminder.channel_id, count, reminder.next_timestamp)
+                outbox.setdefault(key, {})[count] = delivery
+                journal_delivery(delivery)
+                claimed.append(delivery)
+
+            if key in moved_by_key:
+                store(moved_by_key[key])
+                journal(key, JOURNAL_UPDATE)
+                changed.append((reminder.name, reminder.channel_id, moved_by_key[key].next_timestamp))
+
+    for name, channel_id, next_timestamp in changed:
+        notify_reminder_changed(name, channel_id, next_timestamp)
+    flush()
+    return (claimed, skipped)
+
+def claim_reminder(name: str, channel_id: int, now: datetime) -> tuple[list[Delivery], int]:
+    return claim_reminders([(name, channel_id)], now)
+
+#durable deliveries that aren't being sent and whose retry time has come, with their reminders, in the order they were due.
+#they are marked as being sent until finish_deliveries is called with them
+def take_ready_deliveries(now: float) -> list[tuple[Delivery, Reminder]]:
+    ready = []
+    with lock:
+        for key, deliveries in outbox.items():
+            reminder = reminders[key]
+            for delivery in deliveries.values():
+                if delivery.durable and not delivery.sending and delivery.retry_at <= now:
+                    delivery.sending = True
+                    ready.append((delivery, reminder))
+    ready.sort(key=lambda item: (item[0].due_timestamp, item[0].name))
+    return ready
+
+#seconds until a delivery that is waiting (to be retried, or for its claim to be flushed) can be taken, None if none are
+def time_until_ready(now: float) -> float|None:
+    with lock:
+        waiting = [delivery.retry_at if delivery.durable else now + DELIVERY_RETRY_SECONDS
+                   for deliveries in outbox.values() for delivery in deliveries.values() if not delivery.sending]
+    return max(0.0, min(waiting) - now) if len(waiting) > 0 else None
+
+#records how taken deliveries went: sent ones are finished (removing their reminder if it doesn't repeat), and failed ones are
+#retried after DELIVERY_RETRY_SECONDS until MAX_DELIVERY_ATTEMPTS, then finished as failed. deliveries whose reminder was removed
+#while they were being sent are ignored. returns how many were given up on
+def finish_deliveries(results: list[tuple[Delivery, bool]]) -> int:
+    now = time.time()
+    given_up = 0
+    removed = []
+    with lock:
+        for delivery, sent in results:
+            key = (delivery.channel_id, delivery.name)
+            deliveries = outbox.get(key)
+            if deliveries is None or deliveries.get(delivery.repeat_increment_count) is not delivery:
+                continue
+            delivery.sending = False
+            delivery.attempts += 1
+            if not sent and delivery.attempts < MAX_DELIVERY_ATTEMPTS:
+                delivery.retry_at = now + DELIVERY_RETRY_SECONDS
+                journal_delivery(delivery)
+                continue
+
+            if not sent:
+                given_up += 1
+            delivery.state = DELIVERY_SENT if sent else DELIVERY_FAILED
+            bm.DELIVERIES_FINISHED.inc(DELIVERY_STATE_NAMES[delivery.state])
+            del deliveries[delivery.repeat_increment_count]
+            if len(deliveries) == 0:
+                del outbox[key]
+            if not reminders[key].has_repeat: #its deliveries go with it
+                unstore(delivery.name, delivery.channel_id)
+                journal(key, JOURNAL_DELETE)
+                removed.append(key)
+            else:
+                journal_delivery(delivery)
+
+    for channel_id, name in removed:
+        notify_reminder_changed(name, channel_id, None)
+    return given_up
+
+#records which message each of these taken deliveries goes out in, and writes it to disk before returning, since the message
+#mustn't be sent before its nonce is. deliveries removed since they were taken are left out. must run on the writer thread.
+#if the write fails they aren't durable anymore, so they aren't taken again until a later flush has written them
+def set_batch_nonces(batch_nonces: list[tuple[Delivery, str]]):
+    with lock:
+        for delivery, batch_nonce in batch_nonces:
+            deliveries = outbox.get((delivery.channel_id, delivery.name))
+            if deliveries is None or deliveries.get(delivery.repeat_increment_count) is not delivery:
+                continue
+            delivery.batch_nonce = batch_nonce
+            delivery.durable = False
+            journal_delivery(delivery)
+    flush()
+
+#puts back taken deliveries that weren't finished, because the tick failed before recording them. they are sent again
+#after DELIVERY_RETRY_SECONDS, whether or not they already were (in the same message, see set_batch_nonces)
+def release_deliveries(taken: list[tuple[Delivery, Reminder]]) -> int:
+    now = time.time()
+    released = 0
+    with lock:
+        for delivery, _ in taken:
+            deliveries = outbox.get((delivery.channel_id, delivery.name))
+            if delivery.sending and deliveries is not None and deliveries.get(delivery.repeat_increment_count) is delivery:
+                delivery.sending = False
+                delivery.retry_at = now + DELIVERY_RETRY_SECONDS
+                released += 1
+    return released
+
+def prune_deliveries() -> int:
+    return bd.prune_deliveries(DELIVERY_PENDING, int(time.time()) - DELIVERY_RETENTION_SECONDS)
+
+#deletes blobs no reminder references anymore. pending snapshots are flushed first so their blobs are counted
+def collect_blobs() -> int:
+    flush()
+    return bd.collect_blobs()
+
+#(number of reminders, approximate bytes used by them and the indexes). integers and strings shared between records
+#are counted once per record, so this overestimates a little
+def get_memory_stats() -> tuple[int, int]:
+    with lock:
+        size = sys.getsizeof(reminders) + sys.getsizeof(channel_reminders) + sys.getsizeof(channel_order)
+        for names in channel_reminders.values():
+            size += sys.getsizeof(names)
+        for order in channel_order.values():
+            size += sys.getsizeof(order) + sum(sys.getsizeof(key) for key in order)
+        for key, reminder in reminders.items():
+            size += sys.getsizeof(key) + sys.getsizeof(reminder)
+            size += sum(sys.getsizeof(getattr(reminder, slot)) for slot in Reminder.__slots__)
+        return (len(reminders), size)
@@ -0,0 +1,128 @@
+from collections import OrderedDict
+import time
+import bot_store as bst
+import bot_delivery as bdv
+import bot_response as br
+import bot_metrics as bm
+
+#commands are paid for from three token buckets (the user's, the channel's and a global one) before they are parsed any further,
+#so one spammer can't saturate the database writer or a channel's rate limit. writes cost more than reads.
+#everything here runs on the event loop, so nothing is locked
+USER_CAPACITY = 10
+USER_RATE = 1 #tokens per second
+CHANNEL_CAPACITY = 20
+CHANNEL_RATE = 2
+GLOBAL_CAPACITY = 1000
+GLOBAL_RATE = 200
+
+DEFAULT_COMMAND_COST = 1 #also what a command that doesn't exist costs
+COMMAND_COSTS = { #by canonical command name
+    "set_reminder" : 3,
+    "remove_reminder" : 2,
+    "remove_all_reminders" : 5,
+    "list_reminders" : 2,
+    "set_timezone" : 2,
+    "remove_timezone" : 2,
+}
+
+#reminders come first: while a delivery tick has been running this long, or this many reminder changes are waiting
+#to be written, every command is turned away
+SHED_TICK_SECONDS = 5
+SHED_PENDING_WRITES = 50000
+
+MAX_BUCKETS = 100000 #per scope. past this the least recently used bucket is dropped, it has had the longest to refill
+NOTIFY_SECONDS = 10 #someone being throttled is told so at most this often, the rest of their commands are dropped silently
+
+THROTTLED_USER = "user"
+THROTTLED_CHANNEL = "channel"
+THROTTLED_GLOBAL = "global"
+THROTTLED_OVERLOADED = "overloaded"
+
+class TokenBucket:
+    __slots__ = ('tokens', 'updated')
+
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated #time.monotonic() when tokens was last refilled
+
+class BucketScope:
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.buckets: OrderedDict[int, TokenBucket] = OrderedDict() #least recently used first
+
+    #refills the bucket for key and returns how many tokens it has
+    def available(self, key: int, now: float) -> float:
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            return self.capacity
+        self.buckets.move_to_end(key)
+        bucket.tokens = min(self.capacity, bucket.tokens + (now - bucket.updated) * self.rate)
+        bucket.updated = now
+        return bucket.tokens
+
+    #caller must have checked available first
+    def take(self, key: int, cost: float, now: float):
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            if len(self.buckets) >= MAX_BUCKETS:
+                self.buckets.popitem(last=False)
+            bucket = TokenBucket(self.capacity, now)
+            self.buckets[key] = bucket
+        bucket.tokens -= cost
+
+user_buckets = BucketScope(USER_CAPACITY, USER_RATE)
+channel_buckets = BucketScope(CHANNEL_CAPACITY, CHANNEL_RATE)
+global_buckets = BucketScope(GLOBAL_CAPACITY, GLOBAL_RATE)
+GLOBAL_KEY = 0
+
+notified_until: OrderedDict[int, float] = OrderedDict() #user_id -> time.monotonic() until which they aren't told they're throttled again, soonest first
+
+def is_overloaded(now: float) -> bool:
+    return ((bdv.tick_started is not None and now - bdv.tick_started > SHED_TICK_SECONDS) or
+            len(bst.pending) > SHED_PENDING_WRITES)
+
+#takes the command's cost from every bucket if they all have enough, otherwise takes nothing and returns why it was throttled
+def check(user_id: int, channel_id: int, command_name: str|None) -> str|None:
+    now = time.monotonic()
+    reason = None
+    if is_overloaded(now):
+        reason = THROTTLED_OVERLOADED
+    else:
+        cost = COMMAND_COSTS.get(command_name, DEFAULT_COMMAND_COST) if command_name is not None else DEFAULT_COMMAND_COST
+        if user_buckets.available(user_id, now) < cost:
+            reason = THROTTLED_USER
+        elif channel_buckets.available(channel_id, now) < cost:
+            reason = THROTTLED_CHANNEL
+        elif global_buckets.available(GLOBAL_KEY, now) < cost:
+            reason = THROTTLED_GLOBAL
+        else:
+            user_buckets.take(user_id, cost, now)
+            channel_buckets.take(channel_id, cost, now)
+            global_buckets.take(GLOBAL_KEY, cost, now)
+            return None
+
+    bm.COMMANDS_THROTTLED.inc(reason)
+    return reason
+
+COOLDOWN_RESPONSE = br.StaticResponse(
+    is_error=True,
+    title="Slow down!",
+    txt="You're sending commands too fast. Wait a few seconds and try again."
+)
+OVERLOADED_RESPONSE = br.StaticResponse(
+    is_error=True,
+    title="The bot is busy.",
+    txt="Reminders are being sent right now, so commands are paused. Try again in a minute."
+)
+
+#the reply for a throttled command, or None if the user was already told recently (so spam gets no replies at all)
+def make_throttled_response(user_id: int, reason: str) -> br.Response|None:
+    now = time.monotonic()
+    if notified_until.get(user_id, 0) > now:
+        return None
+    notified_until.pop(user_id, None)
+    while len(notified_until) > 0 and (len(notified_until) >= MAX_BUCKETS or next(iter(notified_until.values())) <= now):
+        notified_until.popitem(last=False)
+    notified_until[user_id] = now + NOTIFY_SECONDS
+    return OVERLOADED_RESPONSE if reason == THROTTLED_OVERLOADED else COOLDOWN_RESPONSE
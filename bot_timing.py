@@ -1,10 +1,14 @@
 from datetime import datetime, timedelta, timezone
 import calendar
+import functools
 from zoneinfo import ZoneInfo, available_timezones
 
 UTC = ZoneInfo("UTC")
 
-TIMEZONES_LOWERCASE = {tz.lower(): tz for tz in available_timezones()}
+#lowercase name -> name. built the first time a timezone is looked up, since finding them walks the whole tz database on disk
+@functools.cache
+def get_timezones_lowercase() -> dict[str, str]:
+    return {tz.lower(): tz for tz in available_timezones()}
 
 # Create mappings for full and short names
 FULL = {name.lower(): idx for idx, name in enumerate(calendar.day_name)}
@@ -46,11 +50,14 @@ def n_months_later(now: datetime, n: int) -> datetime:
     new_year = (now.month - 1 + n) // 12 + now.year
     _, days_in_month = calendar.monthrange(new_year, new_month)
     
-    new_day = max(now.day, days_in_month)
+    new_day = min(now.day, days_in_month)
     return now.replace(year=new_year, month=new_month, day=new_day)
 
+#29 february is rounded to 28 february in years that aren't leap years
 def n_years_later(now: datetime, n: int) -> datetime:
-    return now.replace(year=now.year + n)
+    new_year = now.year + n
+    _, days_in_month = calendar.monthrange(new_year, now.month)
+    return now.replace(year=new_year, day=min(now.day, days_in_month))
 
 TIME_INTERVAL_FUNCTIONS = [n_minutes_later, n_hours_later, n_days_later, n_weeks_later, n_months_later, n_years_later]
 TIME_INTERVAL_NAMES = ["minute", "hour", "day", "week", "month", "year"]
@@ -58,6 +65,52 @@ TIME_INTERVAL_NAMES_INV = {c: i for i, c in enumerate(TIME_INTERVAL_NAMES)}
 TIME_INTERVAL_ABBREVIATIONS = ["mi", "ho", "da", "we", "mo", "ye"]
 TIME_INTERVAL_ABBREVIATIONS_INV = {c: i for i, c in enumerate(TIME_INTERVAL_ABBREVIATIONS)}
 
+#length of one interval in wall clock seconds, for the intervals that have a fixed length
+TIME_INTERVAL_SECONDS = [60, 60 * 60, 24 * 60 * 60, 7 * 24 * 60 * 60, None, None]
+
+#smallest increment count whose repeat (start + count * increment intervals) is after now.
+#the count is estimated directly from the wall clock or calendar difference, then corrected by a step or two
+#for month ends and daylight saving shifts, so catching up after downtime doesn't loop over every missed repeat
+def first_increment_count_after(start: datetime, interval_index: int, increment: int, now: datetime) -> int:
+    local_now = now.astimezone(start.tzinfo) #also makes naive datetimes comparable, like datetime.timestamp() does
+    interval_seconds = TIME_INTERVAL_SECONDS[interval_index]
+    if interval_seconds is not None:
+        elapsed = (local_now.replace(tzinfo=None) - start.replace(tzinfo=None)).total_seconds()
+        count = int(elapsed // (interval_seconds * increment))
+    elif interval_index == TIME_INTERVAL_NAMES_INV["month"]:
+        count = ((local_now.year - start.year) * 12 + local_now.month - start.month) // increment
+    else:
+        count = (local_now.year - start.year) // increment
+    count = max(count, 0)
+
+    interval_function = TIME_INTERVAL_FUNCTIONS[interval_index]
+    while interval_function(start, increment * count) <= local_now:
+        count += 1
+    while count > 0 and interval_function(start, increment * (count - 1)) > local_now:
+        count -= 1
+    return count
+
+#what to do with the repeats of a reminder that were missed while the bot was down
+MISSED_POLICY_NAMES = ["once", "all", "skip"]
+MISSED_POLICY_NAMES_INV = {c: i for i, c in enumerate(MISSED_POLICY_NAMES)}
+MISSED_POLICY_DESCRIPTIONS = [
+    "send one reminder for all the missed repeats",
+    "send every missed repeat",
+    "send nothing for missed repeats",
+]
+MISSED_ONCE, MISSED_ALL, MISSED_SKIP = range(len(MISSED_POLICY_NAMES))
+DEFAULT_MISSED_POLICY = MISSED_ONCE
+MISSED_FIRE_CAP = 10 #most repeats the "all" policy sends for one outage
+MISSED_GRACE_SECONDS = 60 #a repeat that is less late than this is not counted as missed
+
+#increment count of the next repeat to send after sending the repeat at increment count `count`
+def next_increment_count(start: datetime, interval_index: int, increment: int, count: int, now: datetime, missed_policy: int) -> int:
+    first_count_after = first_increment_count_after(start, interval_index, increment, now)
+    if missed_policy == MISSED_ALL:
+        #stateless cap: jump to the last MISSED_FIRE_CAP - 1 missed repeats, so one outage sends at most MISSED_FIRE_CAP
+        return max(count + 1, first_count_after - (MISSED_FIRE_CAP - 1))
+    return max(count + 1, first_count_after)
+
 MONTH_ABBRS = ['jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec']
 MONTH_ABBRS_INV = {c: i for i, c in enumerate(MONTH_ABBRS)}
 